@@ -16,3 +16,9 @@ def require_auth(request):
     if not get_current_user(request):
         return RedirectResponse(url="/login", status_code=302)
     return None
+
+
+def is_admin(request):
+    """Check if the logged in user is an admin ("admin": true in users.json)"""
+    user = get_current_user(request)
+    return bool(user and VALID_USERS.get(user, {}).get("admin"))
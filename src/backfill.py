@@ -0,0 +1,59 @@
+from cron import (
+    get_objects_to_sync,
+    load_objects_from_s3,
+    get_peak_rss_mb,
+    ingest_lock,
+)
+from db import init_db
+from db.bulk_load import RunsBulkLoader
+from db.config import bulk_load_chunk_size
+from utils import get_s3_client
+import argparse
+import asyncio
+import time
+
+
+async def backfill(chunk_size: int, rebuild_indexes: bool):
+    """
+    Load every conversation in the traces on S3, whatever its start time and
+    whether or not it has been synced before, in chunks of chunk_size.
+    """
+    start = time.perf_counter()
+
+    await init_db()
+
+    s3_client = get_s3_client()
+    objects, _ = await asyncio.to_thread(get_objects_to_sync, s3_client, {})
+
+    async with RunsBulkLoader(
+        chunk_size=chunk_size,
+        rebuild_indexes=rebuild_indexes,
+        checkpoint_mode="TRUNCATE",
+    ) as loader:
+        num_conversations, num_synced, _ = await load_objects_from_s3(
+            s3_client, objects, None, loader
+        )
+
+    print(
+        f"Backfilled {num_conversations} conversations from {num_synced} S3 objects "
+        f"in {time.perf_counter() - start:.1f}s, peak RSS {get_peak_rss_mb():.1f} MB"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Backfill all the runs from the traces on S3"
+    )
+    parser.add_argument("--chunk-size", type=int, default=bulk_load_chunk_size)
+    parser.add_argument(
+        "--rebuild-indexes",
+        action="store_true",
+        help="Drop the indexes on runs during the load and rebuild them at the end",
+    )
+    args = parser.parse_args()
+
+    with ingest_lock() as locked:
+        if locked:
+            asyncio.run(backfill(args.chunk_size, args.rebuild_indexes))
+        else:
+            print("A sync is running, try again once it is done")
@@ -0,0 +1 @@
+# Benchmarks of the database entry points on synthetic data
@@ -0,0 +1,247 @@
+from db import init_db, get_new_db_connection
+from db.bulk_load import RunsBulkLoader
+from db.config import (
+    sqlite_db_path,
+    users_table_name,
+    runs_table_name,
+    annotations_table_name,
+    queues_table_name,
+    queue_runs_table_name,
+)
+from datetime import datetime, timedelta
+import argparse
+import asyncio
+import json
+import random
+import time
+
+# Shares of the values of each metadata field, roughly following the traces
+run_types = {"quiz": 0.7, "learning_material": 0.3}
+question_types = {"subjective": 0.6, "objective": 0.4}
+question_purposes = {"practice": 0.8, "exam": 0.2}
+question_input_types = {"text": 0.75, "code": 0.25}
+llms = {"gpt-4o": 0.6, "gpt-4o-mini": 0.3, "o3-mini": 0.1}
+
+num_annotators = 8
+# Share of the runs annotated, and share of those annotated by a second annotator
+annotated_share = 0.05
+double_annotated_share = 0.3
+correct_share = 0.75
+# One queue for every this many runs, each with up to queue_max_runs of them
+runs_per_queue = 2000
+queue_max_runs = 500
+
+# Runs start over this many days before the end of the generated range
+num_days = 180
+end_time = datetime(2025, 9, 1)
+
+words = (
+    "the answer is correct because loop function variable value returns list "
+    "error output input print python string number example explain step code "
+    "learner question hint feedback try again well done consider case edge"
+).split()
+
+
+def choose(rng: random.Random, shares: dict):
+    return rng.choices(list(shares), weights=list(shares.values()))[0]
+
+
+def make_text(rng: random.Random, num_words: int):
+    return " ".join(rng.choices(words, k=num_words))
+
+
+class RunGenerator:
+    """
+    Generates synthetic runs with the shape of the traces: orgs and courses of
+    very different sizes, learners attempting the questions of the tasks of
+    their course, and conversations of a few messages. The context of a
+    question is the same in every run of that question, as in the traces,
+    so that it ends up stored once as a blob.
+    """
+
+    def __init__(self, num_runs: int, seed: int = 0):
+        self.rng = random.Random(seed)
+        self.num_runs = num_runs
+
+        num_orgs = max(5, num_runs // 20000)
+        num_courses = max(20, num_runs // 2000)
+        num_learners = max(100, num_runs // 40)
+
+        # Zipf-like weights, so that a few orgs and courses have most runs
+        self.course_orgs = [
+            self.rng.randrange(num_orgs) + 1 for _ in range(num_courses)
+        ]
+        self.course_weights = [1 / (rank + 1) for rank in range(num_courses)]
+        self.num_learners = num_learners
+
+        self.contexts = {}
+
+    def get_context(self, course_id: int, task: int, question: int):
+        key = (course_id, task, question)
+        if key not in self.contexts:
+            self.contexts[key] = make_text(self.rng, self.rng.randint(100, 400))
+        return self.contexts[key]
+
+    def make_run(self, index: int, start_time: datetime):
+        rng = self.rng
+        course_id = (
+            rng.choices(range(len(self.course_weights)), self.course_weights)[0] + 1
+        )
+        org_id = self.course_orgs[course_id - 1]
+        learner = rng.randrange(self.num_learners) + 1
+        task = rng.randrange(20) + 1
+        question = rng.randrange(5) + 1
+        run_type = choose(rng, run_types)
+
+        messages = []
+        for turn in range(rng.randint(1, 4)):
+            messages.append(
+                {"role": "user", "content": make_text(rng, rng.randint(5, 60))}
+            )
+            messages.append(
+                {"role": "assistant", "content": make_text(rng, rng.randint(20, 200))}
+            )
+
+        metadata = {
+            "org": {"id": org_id, "name": f"Org {org_id}"},
+            "course": {"id": course_id, "name": f"Course {course_id}"},
+            "type": run_type,
+            "stage": rng.choice(["router", "feedback", "evaluation"]),
+            "user_id": learner,
+            "user_email": f"learner{learner}@example.com",
+            "task_title": f"Task {task} of course {course_id}",
+            "context": self.get_context(course_id, task, question),
+            "trace_id": f"trace-{index}",
+            "llm": choose(rng, llms),
+        }
+        if run_type == "quiz":
+            metadata.update(
+                {
+                    "question_title": f"Question {question} of task {task}",
+                    "question_type": choose(rng, question_types),
+                    "question_purpose": choose(rng, question_purposes),
+                    "question_input_type": choose(rng, question_input_types),
+                }
+            )
+
+        end = start_time + timedelta(seconds=rng.randint(1, 120))
+        return (
+            f"bench-span-{index}",
+            start_time.isoformat(timespec="microseconds"),
+            end.isoformat(timespec="microseconds"),
+            json.dumps(messages),
+            json.dumps(metadata),
+        )
+
+    def iter_batches(self, batch_size: int, offset: int = 0, num_runs: int = None):
+        """
+        Yield lists of run tuples, in increasing start time, like the traces.
+        """
+        num_runs = self.num_runs if num_runs is None else num_runs
+        span = timedelta(days=num_days).total_seconds()
+        batch = []
+        for index in range(offset, offset + num_runs):
+            seconds = span * (index + self.rng.random()) / self.num_runs
+            start_time = end_time - timedelta(seconds=span - seconds)
+            batch.append(self.make_run(index, start_time))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+async def insert_annotations_and_queues(seed: int = 0):
+    """
+    Add the annotators, annotations and queues of the generated runs.
+    """
+    rng = random.Random(seed + 1)
+
+    async with get_new_db_connection() as conn:
+        cursor = await conn.cursor()
+
+        await cursor.executemany(
+            f"INSERT OR IGNORE INTO {users_table_name} (name) VALUES (?)",
+            [(f"annotator{i}",) for i in range(1, num_annotators + 1)],
+        )
+        await cursor.execute(
+            f"SELECT id FROM {users_table_name} WHERE name LIKE 'annotator%'"
+        )
+        user_ids = [row[0] for row in await cursor.fetchall()]
+
+        await cursor.execute(f"SELECT id, start_time FROM {runs_table_name}")
+        runs = await cursor.fetchall()
+
+        annotations = []
+        for run_id, start_time in rng.sample(runs, int(len(runs) * annotated_share)):
+            num_judgements = 2 if rng.random() < double_annotated_share else 1
+            for user_id in rng.sample(user_ids, num_judgements):
+                judgement = "correct" if rng.random() < correct_share else "wrong"
+                notes = (
+                    make_text(rng, rng.randint(3, 20)) if rng.random() < 0.3 else None
+                )
+                created_at = (
+                    datetime.fromisoformat(start_time)
+                    + timedelta(days=rng.randint(0, 14))
+                ).strftime("%Y-%m-%d %H:%M:%S")
+                annotations.append((run_id, user_id, judgement, notes, created_at))
+        await cursor.executemany(
+            f"""
+            INSERT OR IGNORE INTO {annotations_table_name}
+            (run_id, user_id, judgement, notes, created_at) VALUES (?, ?, ?, ?, ?)
+            """,
+            annotations,
+        )
+
+        run_ids = [run_id for run_id, _ in runs]
+        for index in range(max(5, len(runs) // runs_per_queue)):
+            await cursor.execute(
+                f"""
+                INSERT INTO {queues_table_name} (name, description, user_id)
+                VALUES (?, ?, ?)
+                """,
+                (f"Queue {index + 1}", "Synthetic queue", rng.choice(user_ids)),
+            )
+            queue_id = cursor.lastrowid
+            size = min(rng.randint(50, queue_max_runs), len(run_ids))
+            await cursor.executemany(
+                f"INSERT INTO {queue_runs_table_name} (queue_id, run_id) VALUES (?, ?)",
+                [(queue_id, run_id) for run_id in rng.sample(run_ids, size)],
+            )
+
+        await conn.commit()
+        return len(annotations)
+
+
+async def generate(num_runs: int, seed: int = 0, chunk_size: int = 10000):
+    """
+    Create the database at SQLITE_DB_PATH and fill it with num_runs synthetic
+    runs, with their annotators, annotations and queues.
+    """
+    start = time.perf_counter()
+    await init_db()
+
+    generator = RunGenerator(num_runs, seed)
+    # Nothing reads the database while it is generated
+    async with RunsBulkLoader(
+        chunk_size=chunk_size, rebuild_indexes=True, verbose=False
+    ) as loader:
+        for batch in generator.iter_batches(chunk_size):
+            await loader.add(batch)
+
+    num_annotations = await insert_annotations_and_queues(seed)
+    print(
+        f"Generated {num_runs} runs and {num_annotations} annotations in "
+        f"{sqlite_db_path} in {time.perf_counter() - start:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fill the database at SQLITE_DB_PATH with synthetic runs"
+    )
+    parser.add_argument("--runs", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    asyncio.run(generate(args.runs, args.seed))
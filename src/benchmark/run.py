@@ -0,0 +1,195 @@
+from datetime import datetime, timezone
+from os.path import abspath, dirname, exists, join
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+# Directory that the benchmark modules are run from, so that db is importable
+src_dir = dirname(dirname(abspath(__file__)))
+
+
+def run_module(module: str, db_path: str, *args):
+    """
+    Run a benchmark module in its own process with SQLITE_DB_PATH set, since
+    the database path is read when db is imported, and so that the peak memory
+    of each database size is measured on its own.
+    """
+    subprocess.run(
+        [sys.executable, "-m", module, *args],
+        cwd=src_dir,
+        env={**os.environ, "SQLITE_DB_PATH": db_path},
+        check=True,
+    )
+
+
+def generate_database(db_path: str, num_runs: int, seed: int):
+    """
+    Generate the database of a size, unless it was generated by an earlier
+    benchmark. It is generated under another name and renamed once complete,
+    so that an interrupted generation is never reused.
+    """
+    if exists(db_path):
+        print(f"Reusing {db_path}")
+        return None
+
+    partial_path = f"{db_path}.partial"
+    for path in (partial_path, f"{partial_path}-wal", f"{partial_path}-shm"):
+        if exists(path):
+            os.remove(path)
+
+    start = time.perf_counter()
+    run_module(
+        "benchmark.generate", partial_path, "--runs", str(num_runs), "--seed", str(seed)
+    )
+    os.replace(partial_path, db_path)
+    return round(time.perf_counter() - start, 1)
+
+
+def get_database_size_mb(db_path: str):
+    """
+    Get the size of the pages of a database in use, which unlike the size of
+    the file does not count the pages freed when the runs inserted by earlier
+    benchmarks were removed.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        page_count, freelist_count, page_size = (
+            conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+            for pragma in ("page_count", "freelist_count", "page_size")
+        )
+    finally:
+        conn.close()
+    return round((page_count - freelist_count) * page_size / 1024 / 1024, 1)
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=src_dir,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(previous: dict, current: dict):
+    """
+    Print the change in p50 and p95 of every entry point measured in both runs
+    of the benchmark.
+    """
+    print(
+        f"\nCompared with {previous.get('git_commit')} ({previous.get('created_at')})"
+    )
+    for size, result in current["sizes"].items():
+        previous_result = previous.get("sizes", {}).get(size)
+        if previous_result is None:
+            continue
+
+        print(f"\n{int(size):,} runs")
+        for name, timings in result["entry_points"].items():
+            previous_timings = previous_result["entry_points"].get(name)
+            if previous_timings is None:
+                continue
+
+            changes = []
+            for key in ("p50_ms", "p95_ms"):
+                before, after = previous_timings[key], timings[key]
+                change = (after - before) / before * 100 if before else 0
+                changes.append(
+                    f"{key[:3]} {before:.2f} -> {after:.2f} ms ({change:+.0f}%)"
+                )
+            print(f"  {name}: {', '.join(changes)}")
+
+
+def main(
+    sizes: list[int],
+    repeat: int,
+    seed: int,
+    output: str,
+    data_dir: str = None,
+    compare: str = None,
+):
+    """
+    Generate a synthetic database of each size, time the database entry points
+    on it and write the p50/p95 latencies and peak memory of each to a JSON
+    results file, which later runs can be compared with.
+    """
+    keep_data = data_dir is not None
+    if data_dir is None:
+        data_dir = tempfile.mkdtemp(prefix="evals-benchmark-")
+    os.makedirs(data_dir, exist_ok=True)
+
+    results = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": get_git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "seed": seed,
+        "sizes": {},
+    }
+
+    try:
+        for size in sizes:
+            db_path = join(data_dir, f"benchmark-{size}-{seed}.sqlite")
+            generate_seconds = generate_database(db_path, size, seed)
+            db_size_mb = get_database_size_mb(db_path)
+
+            suite_output = join(data_dir, f"benchmark-{size}-{seed}.json")
+            run_module(
+                "benchmark.suite",
+                db_path,
+                "--repeat",
+                str(repeat),
+                "--output",
+                suite_output,
+            )
+            with open(suite_output) as file:
+                result = json.load(file)
+            os.remove(suite_output)
+
+            result["generate_seconds"] = generate_seconds
+            result["db_size_mb"] = db_size_mb
+            results["sizes"][str(size)] = result
+    finally:
+        if not keep_data:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"Wrote the results to {output}")
+
+    if compare:
+        with open(compare) as file:
+            compare_results(json.load(file), results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the database entry points on synthetic databases"
+    )
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10000, 100000, 1000000]
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument(
+        "--data-dir",
+        help="Keep the generated databases in this directory and reuse them in "
+        "later runs, instead of generating them in a temporary one",
+    )
+    parser.add_argument("--compare", help="Results file of an earlier run")
+    args = parser.parse_args()
+
+    main(args.sizes, args.repeat, args.seed, args.output, args.data_dir, args.compare)
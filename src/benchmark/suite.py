@@ -0,0 +1,246 @@
+from db import (
+    fetch_all_runs,
+    get_queue,
+    get_metrics,
+    get_unique_orgs_and_courses,
+    create_queue,
+    bulk_insert_runs,
+    get_new_db_connection,
+    start_db_pool,
+    stop_db_pool,
+)
+from db.config import (
+    sqlite_db_path,
+    users_table_name,
+    annotations_table_name,
+    runs_table_name,
+    queues_table_name,
+    queue_runs_table_name,
+)
+from benchmark.generate import RunGenerator
+import argparse
+import asyncio
+import json
+import numpy as np
+import resource
+import time
+import tracemalloc
+
+# Runs written by each call of bulk_insert_runs
+insert_batch_size = 1000
+
+
+async def get_fixtures():
+    """
+    Get the ids the entry points are called with: the annotator with the most
+    annotations, the largest queue and the number of runs, to name the runs
+    inserted by the benchmark. Works on any database, not only generated ones.
+    """
+    async with get_new_db_connection(readonly=True) as conn:
+        cursor = await conn.cursor()
+
+        await cursor.execute(
+            f"""
+            SELECT u.id FROM {users_table_name} u
+            LEFT JOIN {annotations_table_name} a ON a.user_id = u.id
+            GROUP BY u.id ORDER BY COUNT(a.id) DESC, u.id LIMIT 1
+            """
+        )
+        row = await cursor.fetchone()
+        user_id = row[0] if row else None
+
+        await cursor.execute(
+            f"""
+            SELECT queue_id FROM {queue_runs_table_name}
+            GROUP BY queue_id ORDER BY COUNT(*) DESC LIMIT 1
+            """
+        )
+        row = await cursor.fetchone()
+        queue_id = row[0] if row else None
+
+        await cursor.execute(f"SELECT COUNT(*) FROM {runs_table_name}")
+        num_runs = (await cursor.fetchone())[0]
+
+    return {"user_id": user_id, "queue_id": queue_id, "num_runs": num_runs}
+
+
+def get_cases(fixtures: dict):
+    """
+    Get the entry points to time, as (name, function of the iteration) pairs.
+    Reads come first, since the writes change the database. The filters are
+    those of the generated databases, and may match no runs in another one.
+    """
+    user_id = fixtures["user_id"]
+    num_runs = fixtures["num_runs"]
+    generator = RunGenerator(num_runs, seed=1)
+
+    async def insert_runs(iteration: int):
+        batch = next(
+            generator.iter_batches(
+                insert_batch_size,
+                offset=num_runs + iteration * insert_batch_size,
+                num_runs=insert_batch_size,
+            )
+        )
+        # Named apart from the generated runs, so that they can be removed
+        batch = [(f"benchmark-insert-{run[0]}", *run[1:]) for run in batch]
+        return await bulk_insert_runs(batch)
+
+    cases = [
+        ("fetch_all_runs", lambda i: fetch_all_runs()),
+        ("fetch_all_runs_page_50", lambda i: fetch_all_runs(page=50)),
+        (
+            "fetch_all_runs_filtered",
+            lambda i: fetch_all_runs(
+                run_type=["quiz"],
+                question_type=["objective"],
+                purpose=["exam"],
+                course_ids=[10],
+            ),
+        ),
+        (
+            "fetch_all_runs_annotated_by_user",
+            lambda i: fetch_all_runs(
+                annotation_filter="annotated", annotation_filter_user_id=user_id
+            ),
+        ),
+        ("fetch_all_runs_search", lambda i: fetch_all_runs(search="edge case")),
+        ("get_queue", lambda i: get_queue(fixtures["queue_id"])),
+        (
+            "get_queue_unannotated",
+            lambda i: get_queue(
+                fixtures["queue_id"],
+                annotation_filter="unannotated",
+                annotation_filter_user_id=user_id,
+            ),
+        ),
+        ("get_metrics", lambda i: get_metrics()),
+        ("get_unique_orgs_and_courses", lambda i: get_unique_orgs_and_courses()),
+        (
+            "create_queue_with_filters",
+            lambda i: create_queue(
+                f"benchmark-queue-{i}",
+                "",
+                user_id,
+                run_type=["quiz"],
+                question_type=["objective"],
+                course_ids=[10],
+            ),
+        ),
+        (f"bulk_insert_runs_{insert_batch_size}", insert_runs),
+    ]
+
+    # Entry points that need an annotator or a queue are left out without one
+    needs_user = {
+        "fetch_all_runs_annotated_by_user",
+        "get_queue_unannotated",
+        "create_queue_with_filters",
+    }
+    needs_queue = {"get_queue", "get_queue_unannotated"}
+    return [
+        (name, func)
+        for name, func in cases
+        if not (name in needs_user and user_id is None)
+        and not (name in needs_queue and fixtures["queue_id"] is None)
+    ]
+
+
+async def remove_benchmark_writes():
+    """
+    Remove the queues and runs written by the benchmark, so that the database
+    can be benchmarked again.
+    """
+    async with get_new_db_connection() as conn:
+        await conn.execute(
+            f"""
+            DELETE FROM {queue_runs_table_name} WHERE queue_id IN (
+                SELECT id FROM {queues_table_name} WHERE name LIKE 'benchmark-queue-%'
+            )
+            """
+        )
+        await conn.execute(
+            f"DELETE FROM {queues_table_name} WHERE name LIKE 'benchmark-queue-%'"
+        )
+        await conn.execute(
+            f"DELETE FROM {runs_table_name} WHERE run_id LIKE 'benchmark-insert-%'"
+        )
+        await conn.commit()
+
+
+async def time_case(func, repeat: int):
+    """
+    Call func once to warm up, repeat times to time it, and once more under
+    tracemalloc to get the peak memory allocated by a call, which is measured
+    apart since tracing slows every allocation down.
+    """
+    iteration = 0
+    await func(iteration)
+
+    timings = []
+    for _ in range(repeat):
+        iteration += 1
+        start = time.perf_counter()
+        await func(iteration)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    try:
+        await func(iteration + 1)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings = np.array(timings)
+    return {
+        "p50_ms": round(float(np.percentile(timings, 50)), 3),
+        "p95_ms": round(float(np.percentile(timings, 95)), 3),
+        "mean_ms": round(float(timings.mean()), 3),
+        "min_ms": round(float(timings.min()), 3),
+        "max_ms": round(float(timings.max()), 3),
+        "peak_memory_kb": round(peak / 1024, 1),
+    }
+
+
+async def run_suite(repeat: int):
+    """
+    Time every entry point on the database at SQLITE_DB_PATH, through the
+    connection pool as in the app.
+    """
+    await start_db_pool()
+    try:
+        fixtures = await get_fixtures()
+        results = {}
+        for name, func in get_cases(fixtures):
+            results[name] = await time_case(func, repeat)
+            print(
+                f"{name}: p50 {results[name]['p50_ms']:.2f} ms, "
+                f"p95 {results[name]['p95_ms']:.2f} ms, "
+                f"peak {results[name]['peak_memory_kb']:.0f} KB"
+            )
+    finally:
+        await stop_db_pool()
+        await remove_benchmark_writes()
+
+    return {
+        "num_runs": fixtures["num_runs"],
+        "entry_points": results,
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time the database entry points on the database at SQLITE_DB_PATH"
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    print(f"Benchmarking {sqlite_db_path}")
+    results = asyncio.run(run_suite(args.repeat))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
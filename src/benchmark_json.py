@@ -0,0 +1,164 @@
+from db import get_run_metadata_sql
+from db.config import sqlite_db_path, runs_table_name
+from db.compression import sql_functions
+from db.raw_json import RawJSON, escape_html_sql, dumps as dumps_raw_json
+import argparse
+import json
+import sqlite3
+import time
+
+
+def escape_html(text: str):
+    return text.replace("<", "&lt;").replace(">", "&gt;")
+
+
+def dumps_json(content):
+    # Same settings as starlette's JSONResponse
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    )
+
+
+def list_page_decoded(conn, run_ids):
+    rows = conn.execute(
+        f"SELECT id, summary FROM {runs_table_name} WHERE id IN ({','.join(['?'] * len(run_ids))})",
+        run_ids,
+    ).fetchall()
+    runs = []
+    for run_id, summary in rows:
+        summary = json.loads(escape_html(summary or "{}"))
+        runs.append(
+            {"id": run_id, "metadata": summary.pop("metadata", {}), "summary": summary}
+        )
+    return dumps_json({"runs": runs}).encode("utf-8")
+
+
+def list_page_raw(conn, run_ids):
+    rows = conn.execute(
+        f"""
+        SELECT id, {escape_html_sql("JSON_EXTRACT(summary, '$.metadata')")},
+            {escape_html_sql("JSON_REMOVE(summary, '$.metadata')")}
+        FROM {runs_table_name} WHERE id IN ({','.join(['?'] * len(run_ids))})
+        """,
+        run_ids,
+    ).fetchall()
+    runs = [
+        {
+            "id": run_id,
+            "metadata": RawJSON(metadata or "{}"),
+            "summary": RawJSON(summary or "{}"),
+        }
+        for run_id, metadata, summary in rows
+    ]
+    return dumps_raw_json({"runs": runs}).encode("utf-8")
+
+
+def detail_decoded(conn, run_id):
+    messages, metadata = conn.execute(
+        f"""
+        SELECT decompress_text(messages), {get_run_metadata_sql()}
+        FROM {runs_table_name} WHERE id = ?
+        """,
+        (run_id,),
+    ).fetchone()
+    run = {
+        "id": run_id,
+        "messages": json.loads(escape_html(messages)),
+        "metadata": json.loads(escape_html(metadata)),
+    }
+    return dumps_json({"run": run}).encode("utf-8")
+
+
+def detail_raw(conn, run_id):
+    messages, metadata = conn.execute(
+        f"""
+        SELECT {escape_html_sql("decompress_text(messages)")},
+            {escape_html_sql(get_run_metadata_sql())}
+        FROM {runs_table_name} WHERE id = ?
+        """,
+        (run_id,),
+    ).fetchone()
+    run = {"id": run_id, "messages": RawJSON(messages), "metadata": RawJSON(metadata)}
+    return dumps_raw_json({"run": run}).encode("utf-8")
+
+
+def full_page_decoded(conn, run_ids):
+    return b"".join(detail_decoded(conn, run_id) for run_id in run_ids)
+
+
+def full_page_raw(conn, run_ids):
+    return b"".join(detail_raw(conn, run_id) for run_id in run_ids)
+
+
+def measure(func, args_list):
+    """
+    Run func over every set of arguments, returning the mean CPU time per call
+    in milliseconds and the mean size of the output in KB
+    """
+    size = 0
+    start = time.process_time()
+    for args in args_list:
+        size += len(func(*args))
+    elapsed = time.process_time() - start
+    return elapsed / len(args_list) * 1000, size / len(args_list) / 1024
+
+
+def main(page_size: int, num_pages: int):
+    """
+    Compare the CPU time of building the run list and run detail responses by
+    decoding the stored JSON and encoding it again, and by splicing it in as is.
+    """
+    conn = sqlite3.connect(sqlite_db_path)
+    for name, num_params, func, deterministic in sql_functions:
+        conn.create_function(name, num_params, func, deterministic=deterministic)
+
+    ids = [
+        row[0]
+        for row in conn.execute(
+            f"SELECT id FROM {runs_table_name} ORDER BY id DESC LIMIT ?",
+            (page_size * num_pages,),
+        )
+    ]
+    if not ids:
+        print("No runs in the database")
+        return
+
+    pages = [(conn, ids[i : i + page_size]) for i in range(0, len(ids), page_size)]
+    details = [(conn, run_id) for run_id in ids[:num_pages]]
+
+    # Check that both paths give the same response before timing them
+    conn, run_ids = pages[0]
+    assert json.loads(list_page_decoded(conn, run_ids)) == json.loads(
+        list_page_raw(conn, run_ids)
+    )
+    assert json.loads(detail_decoded(conn, run_ids[0])) == json.loads(
+        detail_raw(conn, run_ids[0])
+    )
+
+    for name, decoded, raw, args_list in [
+        (f"list page ({page_size} runs)", list_page_decoded, list_page_raw, pages),
+        ("run detail", detail_decoded, detail_raw, details),
+        (
+            f"page of {page_size} full runs",
+            full_page_decoded,
+            full_page_raw,
+            pages,
+        ),
+    ]:
+        decoded_ms, size_kb = measure(decoded, args_list)
+        raw_ms, _ = measure(raw, args_list)
+        print(
+            f"{name}: {size_kb:.1f} KB, decode + re-encode {decoded_ms:.2f} ms, "
+            f"raw passthrough {raw_ms:.2f} ms ({decoded_ms / raw_ms:.1f}x less CPU)"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the CPU time saved by passing stored JSON through as is"
+    )
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=50)
+    args = parser.parse_args()
+
+    main(args.page_size, args.pages)
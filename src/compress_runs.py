@@ -0,0 +1,264 @@
+from db import (
+    init_db,
+    get_new_db_connection,
+    start_db_pool,
+    stop_db_pool,
+    get_run,
+)
+from db.compression import check_codec, train_dictionary, save_dictionary
+from db.config import (
+    sqlite_db_path,
+    runs_table_name,
+    blobs_table_name,
+    runs_compression,
+)
+import argparse
+import asyncio
+import random
+import sqlite3
+import time
+import numpy as np
+
+
+async def get_storage_stats():
+    """
+    Get the number of bytes stored in the messages and metadata columns of
+    runs and in the blobs they reference, and the size of the pages used by the
+    database.
+    """
+    async with get_new_db_connection() as conn:
+        cursor = await conn.cursor()
+        await cursor.execute(
+            f"""
+            SELECT COUNT(*), SUM(LENGTH(CAST(messages AS BLOB))),
+                SUM(LENGTH(CAST(metadata AS BLOB)))
+            FROM {runs_table_name}
+            """
+        )
+        num_runs, messages, metadata = await cursor.fetchone()
+
+        await cursor.execute(
+            f"SELECT SUM(LENGTH(CAST(data AS BLOB))) FROM {blobs_table_name}"
+        )
+        blobs = (await cursor.fetchone())[0]
+
+        sizes = {}
+        for pragma in ["page_size", "page_count", "freelist_count"]:
+            await cursor.execute(f"PRAGMA {pragma}")
+            sizes[pragma] = (await cursor.fetchone())[0]
+
+    return {
+        "num_runs": num_runs,
+        "messages": messages or 0,
+        "metadata": metadata or 0,
+        "blobs": blobs or 0,
+        "db_used": (sizes["page_count"] - sizes["freelist_count"]) * sizes["page_size"],
+    }
+
+
+async def measure_read_latency(run_ids: list[int]):
+    """
+    Time get_run, which decompresses the messages and context, on the given
+    runs through the connection pool, as the app does.
+
+    Returns:
+        p50 and p95 latencies in milliseconds
+    """
+    if not run_ids:
+        return 0, 0
+
+    await start_db_pool()
+    try:
+        latencies = []
+        for run_id in run_ids:
+            start = time.perf_counter()
+            await get_run(run_id)
+            latencies.append((time.perf_counter() - start) * 1000)
+    finally:
+        await stop_db_pool()
+
+    return np.percentile(latencies, 50), np.percentile(latencies, 95)
+
+
+async def train_run_dictionary(codec: str, sample_size: int):
+    """
+    Train a dictionary for the codec on the messages of a sample of runs and on
+    a sample of blobs, and store it, so that it is used for the values
+    compressed next.
+    """
+    async with get_new_db_connection() as conn:
+        cursor = await conn.cursor()
+        await cursor.execute(
+            f"""
+            SELECT decompress_text(messages) FROM {runs_table_name}
+            WHERE id IN (SELECT id FROM {runs_table_name} ORDER BY RANDOM() LIMIT ?)
+            """,
+            (sample_size,),
+        )
+        samples = [row[0] for row in await cursor.fetchall()]
+
+        await cursor.execute(
+            f"""
+            SELECT decompress_text(data) FROM {blobs_table_name}
+            ORDER BY RANDOM() LIMIT ?
+            """,
+            (sample_size,),
+        )
+        samples += [row[0] for row in await cursor.fetchall()]
+
+    data = train_dictionary(samples, codec)
+    if not data:
+        print("Not enough repeated content to train a dictionary")
+        return
+
+    conn = sqlite3.connect(sqlite_db_path)
+    try:
+        dictionary_id = save_dictionary(conn, codec, data)
+    finally:
+        conn.close()
+    print(f"Trained {codec} dictionary {dictionary_id} ({len(data)} bytes)")
+
+
+async def rewrite_column(
+    table: str, key: str, column: str, codec: str, batch_size: int
+):
+    """
+    Rewrite a column with the codec, in batches of rows (ordered by the key
+    column) committed one at a time. Values written with any other codec (or
+    none) are decompressed first, so this can also be used to switch codecs
+    or, with codec "none", to decompress every value.
+    """
+    async with get_new_db_connection() as conn:
+        cursor = await conn.cursor()
+
+        num_rewritten = 0
+        last_key = None
+        while True:
+            await cursor.execute(
+                f"""
+                SELECT MAX({key}), COUNT(*) FROM (
+                    SELECT {key} FROM {table}
+                    WHERE ?1 IS NULL OR {key} > ?1
+                    ORDER BY {key} LIMIT ?2
+                )
+                """,
+                (last_key, batch_size),
+            )
+            batch_end, num_rows = await cursor.fetchone()
+            if not num_rows:
+                break
+
+            await cursor.execute(
+                f"""
+                UPDATE {table}
+                SET {column} = compress_text(decompress_text({column}), ?1)
+                WHERE (?2 IS NULL OR {key} > ?2) AND {key} <= ?3
+                """,
+                (codec, last_key, batch_end),
+            )
+            await conn.commit()
+
+            last_key = batch_end
+            num_rewritten += num_rows
+            print(f"Rewrote the {column} of {num_rewritten} rows of {table}")
+
+
+def format_change(before: int, after: int):
+    change = (after - before) / before * 100 if before else 0
+    return f"{before / 1024 / 1024:.1f} MB -> {after / 1024 / 1024:.1f} MB ({change:+.1f}%)"
+
+
+async def compress_runs(
+    codec: str,
+    batch_size: int,
+    train: bool,
+    sample_size: int,
+    vacuum: bool,
+):
+    """
+    Rewrite the messages of every run and every blob with the codec, reporting
+    the storage used by runs and the latency of opening a run before and after.
+    """
+    if codec != "none":
+        check_codec(codec)
+
+    await init_db()
+
+    before = await get_storage_stats()
+    async with get_new_db_connection() as conn:
+        cursor = await conn.cursor()
+        await cursor.execute(f"SELECT id FROM {runs_table_name}")
+        all_ids = [row[0] for row in await cursor.fetchall()]
+    sample_ids = random.sample(all_ids, min(sample_size, len(all_ids)))
+    latency_before = await measure_read_latency(sample_ids)
+
+    if codec != "none" and train:
+        await train_run_dictionary(codec, sample_size)
+
+    start = time.perf_counter()
+    await rewrite_column(runs_table_name, "id", "messages", codec, batch_size)
+    await rewrite_column(blobs_table_name, "hash", "data", codec, batch_size)
+    print(f"Rewrote {before['num_runs']} runs in {time.perf_counter() - start:.1f}s")
+
+    if vacuum:
+        # Rewriting runs only frees pages inside the file; VACUUM shrinks it
+        conn = sqlite3.connect(sqlite_db_path)
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+
+    after = await get_storage_stats()
+    latency_after = await measure_read_latency(sample_ids)
+
+    print(f"\nRuns: {before['num_runs']}, codec: {codec}")
+    for column in ["messages", "metadata", "blobs"]:
+        print(f"  {column}: {format_change(before[column], after[column])}")
+    print(
+        f"  database (used pages): {format_change(before['db_used'], after['db_used'])}"
+    )
+    print(
+        f"  get_run latency over {len(sample_ids)} runs: "
+        f"p50 {latency_before[0]:.2f} ms -> {latency_after[0]:.2f} ms, "
+        f"p95 {latency_before[1]:.2f} ms -> {latency_after[1]:.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compress (or decompress) the messages of every run and the blobs they reference"
+    )
+    parser.add_argument(
+        "--codec",
+        choices=["zlib", "zstd", "none"],
+        default=runs_compression if runs_compression != "none" else "zlib",
+        help="Codec to rewrite the runs with; none decompresses every run",
+    )
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument(
+        "--no-dictionary",
+        action="store_true",
+        help="Do not train a new dictionary before compressing",
+    )
+    parser.add_argument(
+        "--sample",
+        type=int,
+        default=1000,
+        help="Number of runs used to train the dictionary and measure read latency",
+    )
+    parser.add_argument(
+        "--vacuum",
+        action="store_true",
+        help="VACUUM the database afterwards to return the freed space to the disk",
+    )
+    args = parser.parse_args()
+
+    asyncio.run(
+        compress_runs(
+            args.codec,
+            args.batch_size,
+            not args.no_dictionary,
+            args.sample,
+            args.vacuum,
+        )
+    )
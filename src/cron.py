@@ -1,12 +1,65 @@
-from utils import download_file_from_s3_as_bytes
+from utils import (
+    get_s3_client,
+    is_not_modified_error,
+    list_s3_objects,
+    iter_json_array,
+)
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dotenv import load_dotenv
+import fcntl
 import json
 import asyncio
 import os
-from db import get_last_run_time, bulk_insert_runs
+from datetime import datetime, timedelta
+import queue
+import resource
+import threading
+import time
+from db import get_last_run_time, get_s3_sync_state, set_s3_sync_state
+from db.bulk_load import RunsBulkLoader
+from db.config import bulk_load_chunk_size, data_root_dir
 
 load_dotenv()
 
+# Number of runs parsed per batch while streaming the traces from S3
+ingest_batch_size = int(os.getenv("INGEST_BATCH_SIZE", 1000))
+
+# Size of the chunks read from the S3 body stream
+s3_chunk_size = 1024 * 1024
+
+# Conversations starting up to this many hours before the latest run are
+# scanned again on every sync, to pick up runs that arrived late
+ingest_lookback_hours = float(os.getenv("INGEST_LOOKBACK_HOURS", 24))
+
+# Number of S3 objects fetched and parsed in parallel when syncing a key prefix
+s3_sync_concurrency = int(os.getenv("S3_SYNC_CONCURRENCY", 4))
+
+# Locked while a sync runs, so that syncs started by this script and by the
+# scheduler of the app never overlap
+ingest_lock_path = f"{data_root_dir}/ingest.lock"
+
+
+@contextmanager
+def ingest_lock():
+    """
+    Take the lock held while syncing runs, without waiting for it. Yields
+    whether it was taken; it is not when another sync is running, in this
+    process or in another one.
+    """
+    with open(ingest_lock_path, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
 
 def transform_conversation_to_run(conversation):
     return (
@@ -25,27 +78,281 @@ def transform_conversation_to_run(conversation):
     )
 
 
-async def add_new_runs_from_s3():
-    file_bytes = download_file_from_s3_as_bytes(os.getenv("S3_LLM_TRACES_KEY"))
-    file_str = file_bytes.decode("utf-8")
-    all_conversations = json.loads(file_str)
+def get_peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def get_ingest_cutoff(last_run_time: str, lookback_hours: float):
+    """
+    Get the start time from which conversations are ingested: lookback_hours
+    before the latest run, formatted like the run start times so that they can
+    be compared as strings.
+    """
+    if last_run_time is None:
+        return None
+
+    try:
+        cutoff = datetime.fromisoformat(last_run_time) - timedelta(hours=lookback_hours)
+    except ValueError:
+        return last_run_time
+
+    separator = last_run_time[10] if len(last_run_time) > 10 else "T"
+    return cutoff.isoformat(sep=separator, timespec="microseconds")
+
+
+def get_objects_to_sync(s3_client, sync_state: dict):
+    """
+    Get the S3 objects to sync as a list of (key, etag) pairs, where etag is the
+    version already synced (None if the object has never been synced), along
+    with the number of objects skipped because they have not changed.
+
+    If S3_LLM_TRACES_PREFIX is set, all the part files under that prefix are
+    listed and the ones whose ETag has not changed since the last sync are
+    skipped. Otherwise the single S3_LLM_TRACES_KEY object is synced, and
+    whether it has changed is left to a conditional GET.
+    """
+    prefix = os.getenv("S3_LLM_TRACES_PREFIX")
+    if not prefix:
+        key = os.getenv("S3_LLM_TRACES_KEY")
+        return [(key, sync_state.get(key, {}).get("etag"))], 0
+
+    objects = []
+    num_unchanged = 0
+    for item in list_s3_objects(s3_client, prefix):
+        synced_etag = sync_state.get(item["Key"], {}).get("etag")
+        if synced_etag == item["ETag"]:
+            num_unchanged += 1
+            continue
+        objects.append((item["Key"], synced_etag))
+
+    return objects, num_unchanged
+
+
+def fetch_object_runs(
+    s3_client,
+    key: str,
+    synced_etag: str,
+    cutoff: str,
+    batch_size: int,
+    results: queue.Queue,
+    stop: threading.Event,
+):
+    """
+    Stream one S3 object and put batches of new runs on the results queue,
+    followed by a ("done", ...) message with the version of the object that was
+    read. Runs in a worker thread; the queue is bounded so that the workers
+    cannot get ahead of the database inserts.
+    """
+    try:
+        kwargs = {"Bucket": os.getenv("S3_BUCKET_NAME"), "Key": key}
+        if synced_etag is not None:
+            kwargs["IfNoneMatch"] = synced_etag
+
+        try:
+            response = s3_client.get_object(**kwargs)
+        except ClientError as error:
+            if is_not_modified_error(error):
+                results.put(("not_modified", key, None))
+                return
+            raise
+
+        num_conversations = 0
+        batch = []
+
+        for conversation in iter_json_array(
+            response["Body"].iter_chunks(s3_chunk_size)
+        ):
+            if stop.is_set():
+                return
+
+            num_conversations += 1
+
+            if cutoff is not None and conversation["start_time"] < cutoff:
+                continue
 
-    last_run_time = await get_last_run_time()
-    new_conversations = [
-        conversation
-        for conversation in all_conversations
-        if conversation["start_time"] > last_run_time
-    ]
+            batch.append(transform_conversation_to_run(conversation))
 
-    new_runs = [
-        transform_conversation_to_run(conversation)
-        for conversation in new_conversations
-    ]
+            if len(batch) >= batch_size:
+                results.put(("batch", key, batch))
+                batch = []
 
-    await bulk_insert_runs(new_runs)
+        if batch:
+            results.put(("batch", key, batch))
+
+        last_modified = response.get("LastModified")
+        results.put(
+            (
+                "done",
+                key,
+                {
+                    "etag": response.get("ETag"),
+                    "last_modified": (
+                        last_modified.isoformat() if last_modified else None
+                    ),
+                    "num_conversations": num_conversations,
+                },
+            )
+        )
+    except Exception as error:
+        results.put(("error", key, error))
+
+
+async def load_objects_from_s3(
+    s3_client,
+    objects: list[tuple],
+    cutoff: str,
+    loader: RunsBulkLoader,
+    batch_size: int = ingest_batch_size,
+    concurrency: int = s3_sync_concurrency,
+):
+    """
+    Stream the given S3 objects, with up to `concurrency` of them fetched and
+    parsed in parallel, and load their conversations through the bulk loader.
+    Objects synced before only have the conversations that started at or after
+    cutoff (all of them if cutoff is None) loaded again, while objects never
+    synced (new part files) are loaded in full, however old their runs are.
+
+    Args:
+        objects: (key, etag) pairs, where etag is the version of the object
+            already synced, if any; objects still at that version are skipped
+
+    Returns:
+        Tuple of (number of conversations read, objects synced, objects
+        skipped because they had not changed)
+    """
+    num_conversations = 0
+    num_synced = 0
+    num_unchanged = 0
+
+    results = queue.Queue(maxsize=concurrency * 2)
+    stop = threading.Event()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(
+                fetch_object_runs,
+                s3_client,
+                key,
+                synced_etag,
+                # Runs of a new part file may be older than the cutoff, and the
+                # file is not read again once recorded as synced
+                cutoff if synced_etag is not None else None,
+                batch_size,
+                results,
+                stop,
+            )
+            for key, synced_etag in objects
+        ]
+
+        try:
+            num_pending = len(futures)
+            while num_pending:
+                kind, key, payload = await asyncio.to_thread(results.get)
+
+                if kind == "batch":
+                    await loader.add(payload)
+                elif kind == "done":
+                    # Only record the object as synced once all its runs are in
+                    await loader.flush()
+                    await set_s3_sync_state(
+                        key, payload["etag"], payload["last_modified"]
+                    )
+                    num_conversations += payload["num_conversations"]
+                    num_synced += 1
+                    num_pending -= 1
+                elif kind == "not_modified":
+                    num_unchanged += 1
+                    num_pending -= 1
+                else:
+                    raise payload
+        finally:
+            # On failure, stop the workers and keep draining the queue so that
+            # none of them stays blocked on a full queue
+            stop.set()
+            for future in futures:
+                future.cancel()
+            while not all(future.done() for future in futures):
+                try:
+                    results.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+    return num_conversations, num_synced, num_unchanged
+
+
+async def add_new_runs_from_s3(
+    batch_size: int = ingest_batch_size,
+    concurrency: int = s3_sync_concurrency,
+    lookback_hours: float = ingest_lookback_hours,
+    chunk_size: int = bulk_load_chunk_size,
+    s3_client=None,
+    pooled: bool = False,
+):
+    """
+    Stream the traces from S3 and upsert the conversations of the objects never
+    synced and, from the objects that changed since they were synced, those
+    that started at most lookback_hours before the latest run, committing them
+    in chunks of chunk_size, so that peak memory and the size of each
+    transaction do not depend on the size of the traces file.
+
+    Runs are upserted by their span id, so a sync can be retried at any time
+    without creating duplicates, and runs that arrive late or share the latest
+    start time are not dropped.
+
+    Objects whose ETag matches the one recorded at the last sync are not
+    downloaded again. With a key prefix, up to `concurrency` part files are
+    fetched and parsed in parallel.
+
+    Args:
+        s3_client: S3 client to reuse across syncs; a new one is created if None
+        pooled: Whether to write the runs through the app's connection pool
+
+    Returns:
+        Dict with the number of conversations read, runs added or updated, S3
+        objects synced and skipped, and the time taken in seconds
+    """
+    start = time.perf_counter()
+
+    cutoff = get_ingest_cutoff(await get_last_run_time(), lookback_hours)
+    sync_state = await get_s3_sync_state()
+
+    if s3_client is None:
+        s3_client = get_s3_client()
+    objects, num_skipped = await asyncio.to_thread(
+        get_objects_to_sync, s3_client, sync_state
+    )
+
+    print(f"Syncing runs that started since {cutoff}")
+    async with RunsBulkLoader(
+        chunk_size=chunk_size, verbose=False, pooled=pooled
+    ) as loader:
+        num_conversations, num_synced, num_unchanged = await load_objects_from_s3(
+            s3_client, objects, cutoff, loader, batch_size, concurrency
+        )
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Synced {num_synced} S3 objects, skipped {num_skipped + num_unchanged} unchanged"
+    )
+    print(
+        f"Processed {num_conversations} conversations in {elapsed:.1f}s "
+        f"({num_conversations / elapsed:.0f} conversations/sec), "
+        f"peak RSS {get_peak_rss_mb():.1f} MB"
+    )
 
-    print(f"Added {len(new_runs)} new runs")
+    return {
+        "num_conversations": num_conversations,
+        "num_changed": loader.num_changed,
+        "num_synced": num_synced,
+        "num_skipped": num_skipped + num_unchanged,
+        "elapsed": round(elapsed, 3),
+    }
 
 
 if __name__ == "__main__":
-    asyncio.run(add_new_runs_from_s3())
+    with ingest_lock() as locked:
+        if locked:
+            asyncio.run(add_new_runs_from_s3())
+        else:
+            print("Another sync is already running, skipping")
@@ -1,6 +1,8 @@
 import sqlite3
 import os
 import json
+import base64
+import re
 from os.path import exists
 from .config import (
     sqlite_db_path,
@@ -9,12 +11,32 @@ from .config import (
     annotations_table_name,
     queue_runs_table_name,
     users_table_name,
+    s3_sync_state_table_name,
+    metrics_totals_table_name,
+    metrics_learners_table_name,
+    metrics_annotators_table_name,
+    metrics_daily_runs_table_name,
+    metrics_daily_annotators_table_name,
+    orgs_table_name,
+    courses_table_name,
+    runs_search_table_name,
+    runs_compression,
+    compression_dictionaries_table_name,
+    blobs_table_name,
+    run_blob_min_size,
+    write_counters_table_name,
 )
+from .pool import db_pool, apply_connection_pragmas
+from .raw_json import RawJSON, escape_html, escape_html_sql, set_raw_json_fields
+from .compression import check_codec
+from .blobs import fetch_blobs
+from .instrumentation import query_stats, instrument_connection, db_timer
 from contextlib import asynccontextmanager
 import aiosqlite
 import traceback
 import numpy as np
 from typing import Optional, List, Tuple
+from datetime import date, datetime, timedelta, timezone
 import asyncio
 import functools
 
@@ -50,6 +72,269 @@ def log_exceptions(func):
         return wrapper
 
 
+# Metadata fields used in filters, exposed as indexed generated columns on the
+# runs table so that filtering does not have to parse the JSON of every row
+runs_metadata_columns = {
+    "org_id": ("INTEGER", "$.org.id"),
+    "course_id": ("INTEGER", "$.course.id"),
+    "run_type": ("TEXT", "$.type"),
+    "question_purpose": ("TEXT", "$.question_purpose"),
+    "question_type": ("TEXT", "$.question_type"),
+    "question_input_type": ("TEXT", "$.question_input_type"),
+    "user_email": ("TEXT", "$.user_email"),
+}
+
+
+def get_runs_metadata_column_definition(column: str) -> str:
+    column_type, json_path = runs_metadata_columns[column]
+    return f"{column} {column_type} GENERATED ALWAYS AS (JSON_EXTRACT(metadata, '{json_path}')) VIRTUAL"
+
+
+# Metadata fields kept in the run summaries returned by the list endpoints
+run_summary_metadata_fields = [
+    "stage",
+    "type",
+    "user_id",
+    "user_email",
+    "task_title",
+    "question_title",
+    "question_type",
+    "question_purpose",
+    "question_input_type",
+    "question_has_context",
+    "org",
+    "course",
+    "milestone",
+]
+
+# Length of the preview of the first user message kept in the run summaries
+run_summary_preview_length = 200
+
+
+def get_run_summary_sql(messages: str, metadata: str, start_time: str, end_time: str):
+    """
+    SQL expression for the summary of a run shown in the run listings: the
+    number of messages, a preview of the first user message, the duration in
+    seconds and the metadata fields in run_summary_metadata_fields (leaving out
+    large fields such as the context). It is computed once, when the run is
+    written, so that listing runs never has to parse the full messages.
+    """
+    valid_messages = f"CASE WHEN JSON_VALID({messages}) THEN {messages} ELSE '[]' END"
+    metadata_fields = ", ".join(
+        f"'{field}', JSON_EXTRACT({metadata}, '$.{field}')"
+        for field in run_summary_metadata_fields
+    )
+
+    return f"""JSON_OBJECT(
+        'message_count', JSON_ARRAY_LENGTH({valid_messages}),
+        'preview', (
+            SELECT SUBSTR(JSON_EXTRACT(value, '$.content'), 1, {run_summary_preview_length})
+            FROM JSON_EACH({valid_messages})
+            WHERE JSON_EXTRACT(value, '$.role') = 'user'
+            LIMIT 1
+        ),
+        'duration_seconds', ROUND((JULIANDAY({end_time}) - JULIANDAY({start_time})) * 86400, 3),
+        'metadata', CASE WHEN JSON_VALID({metadata}) THEN JSON_OBJECT({metadata_fields}) ELSE JSON_OBJECT() END
+    )"""
+
+
+# Metadata fields stored in the blobs table when they are large, since the same
+# values are repeated across many runs (e.g. all the runs of a question)
+run_blob_fields = ["context"]
+
+# Columns written when inserting a run, in the order of get_run_values_sql
+runs_insert_columns = (
+    "run_id, start_time, end_time, messages, metadata, blob_refs, summary"
+)
+
+
+def get_run_blob_sql(metadata: str, field: str):
+    """
+    SQL expression for the JSON text of a metadata field if it is large enough
+    to be stored as a blob, and NULL otherwise.
+    """
+    value = f"JSON_EXTRACT({metadata}, '$.{field}')"
+    return f"""CASE WHEN JSON_VALID({metadata}) THEN (
+        CASE WHEN LENGTH({value}) >= {run_blob_min_size} THEN JSON_QUOTE({value}) END
+    ) END"""
+
+
+def get_run_inline_metadata_sql(metadata: str):
+    """
+    SQL expression for the metadata of a run stored in the runs table, without
+    the fields stored as blobs.
+    """
+    inline_metadata = metadata
+    for field in run_blob_fields:
+        inline_metadata = f"""CASE WHEN {get_run_blob_sql(metadata, field)} IS NULL
+            THEN {inline_metadata}
+            ELSE JSON_REMOVE({inline_metadata}, '$.{field}')
+        END"""
+    return inline_metadata
+
+
+def get_run_blob_refs_sql(metadata: str):
+    """
+    SQL expression for the blob references of a run: a JSON object mapping each
+    metadata field stored as a blob to its hash, or NULL if there is none.
+    """
+    refs = ", ".join(
+        f"'{field}', content_hash({get_run_blob_sql(metadata, field)})"
+        for field in run_blob_fields
+    )
+    # Fields with a NULL hash are dropped by the patch
+    return f"NULLIF(JSON_PATCH('{{}}', JSON_OBJECT({refs})), '{{}}')"
+
+
+def get_blobs_insert_query(
+    metadata: str = "?5", source: str = "", compression: str = runs_compression
+):
+    """
+    Get the query storing the large metadata fields of runs in the blobs table,
+    once per distinct value.
+
+    Args:
+        metadata: SQL expression for the full metadata of a run; by default the
+            metadata parameter of a run inserted with get_runs_upsert_query
+        source: FROM clause (with any conditions) the metadata is read from
+        compression: Codec to compress the blobs with, or "none"
+    """
+    if compression == "none":
+        data = "text"
+    else:
+        check_codec(compression)
+        data = f"compress_text(text, '{compression}')"
+
+    values = " UNION ALL ".join(
+        f"SELECT {get_run_blob_sql(metadata, field)} AS text {source}"
+        for field in run_blob_fields
+    )
+
+    # The WHERE clause is required by the upsert syntax after a SELECT
+    return f"""
+        INSERT INTO {blobs_table_name} (hash, data, size)
+        SELECT content_hash(text), {data}, LENGTH(text)
+        FROM (SELECT DISTINCT text FROM ({values}))
+        WHERE text IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM {blobs_table_name} WHERE hash = content_hash(text)
+        )
+        ON CONFLICT(hash) DO NOTHING
+    """
+
+
+def get_run_values_sql(compression: str = runs_compression):
+    """
+    SQL for the values of a run inserted from the parameters ?1 to ?5 (run_id,
+    start_time, end_time, messages and metadata), in the order of
+    runs_insert_columns. The large metadata fields are replaced by references
+    to the blobs written by get_blobs_insert_query, and the messages are
+    compressed if compression is enabled. The summary is always computed from
+    the full values.
+    """
+    if compression == "none":
+        messages = "?4"
+    else:
+        check_codec(compression)
+        messages = f"compress_text(?4, '{compression}')"
+
+    metadata = get_run_inline_metadata_sql("?5")
+    blob_refs = get_run_blob_refs_sql("?5")
+    summary = get_run_summary_sql("?4", "?5", "?2", "?3")
+    return f"?1, ?2, ?3, {messages}, {metadata}, {blob_refs}, {summary}"
+
+
+def get_run_metadata_sql(alias: str = ""):
+    """
+    SQL expression for the full metadata of a run, with the fields stored as
+    blobs put back in. The read paths that return full runs use
+    db.blobs.fetch_blobs instead, which caches the blobs.
+    """
+    metadata = f"{alias}metadata"
+    for field in run_blob_fields:
+        ref = f"JSON_EXTRACT({alias}blob_refs, '$.{field}')"
+        blob = (
+            f"(SELECT decompress_text(data) FROM {blobs_table_name} WHERE hash = {ref})"
+        )
+        metadata = f"""CASE WHEN {ref} IS NULL THEN {metadata}
+            ELSE JSON_SET({metadata}, '$.{field}', JSON({blob}))
+        END"""
+    return metadata
+
+
+def build_search_query(search: str) -> Optional[str]:
+    """
+    Turn a free-text search into an FTS5 query matching the runs that contain
+    all of its terms, where text in double quotes is matched as a phrase.
+    Every term is quoted so that FTS5 operators in the input are taken literally.
+
+    Returns:
+        The FTS5 query, or None if the search has no terms
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', search or ""):
+        term = (phrase or word).strip()
+        if term:
+            terms.append('"{}"'.format(term.replace('"', '""')))
+
+    return " ".join(terms) or None
+
+
+def build_annotation_filters(
+    annotation_filter: str = None,
+    annotation_filter_user_id: int = None,
+) -> Optional[Tuple[List[str], List, bool]]:
+    """
+    Build the conditions an annotation (aliased as a) has to match for a run to
+    pass the annotation filter.
+
+    Args:
+        annotation_filter: Filter by annotation status
+        annotation_filter_user_id: User ID for annotation filtering (can be current user or specific annotator)
+
+    Returns:
+        None if the annotation filter does not apply, otherwise a tuple of
+        (conditions, params, negate) where negate is True when runs must have
+        no annotation matching the conditions
+    """
+    conditions = []
+    params = []
+
+    if annotation_filter and annotation_filter_user_id:
+        # Filter by annotation status for specific user
+        if annotation_filter == "annotated" or annotation_filter == "has_annotations":
+            negate = False
+        elif (
+            annotation_filter == "unannotated" or annotation_filter == "no_annotations"
+        ):
+            negate = True
+        elif annotation_filter == "correct" or annotation_filter == "wrong":
+            conditions.append(f"a.judgement = '{annotation_filter}'")
+            negate = False
+        else:
+            return None
+
+        conditions.append("a.user_id = ?")
+        params.append(annotation_filter_user_id)
+        return conditions, params, negate
+
+    if annotation_filter_user_id and not annotation_filter:
+        # If only user_id is specified (for annotator filtering), show only runs with annotations by that user
+        return ["a.user_id = ?"], [annotation_filter_user_id], False
+
+    if annotation_filter and not annotation_filter_user_id:
+        # Any user's annotations when no specific user is set
+        if annotation_filter == "annotated" or annotation_filter == "has_annotations":
+            return [], [], False
+        elif (
+            annotation_filter == "unannotated" or annotation_filter == "no_annotations"
+        ):
+            return [], [], True
+        elif annotation_filter == "correct" or annotation_filter == "wrong":
+            return [f"a.judgement = '{annotation_filter}'"], [], False
+
+    return None
+
+
 def build_run_filters(
     annotation_filter: str = None,
     annotation_filter_user_id: int = None,
@@ -63,6 +348,7 @@ def build_run_filters(
     user_email: str = None,
     task_title: str = None,
     question_title: str = None,
+    search: str = None,
     initial_params: list = None,
 ) -> Tuple[List[str], List]:
     """
@@ -81,6 +367,7 @@ def build_run_filters(
         user_email: Email to filter by (from metadata)
         task_title: Task title to filter by (from metadata, substring match)
         question_title: Question title to filter by (from metadata, substring match)
+        search: Free text to search for in the messages and annotation notes
         initial_params: Initial parameters list to start with
 
     Returns:
@@ -89,43 +376,23 @@ def build_run_filters(
     where_conditions = []
     params = initial_params or []
 
-    # Annotation filter - filter by annotation status for specific user
-    if annotation_filter and annotation_filter_user_id:
-        if annotation_filter == "annotated" or annotation_filter == "has_annotations":
-            where_conditions.append("a.id IS NOT NULL AND a.user_id = ?")
-            params.append(annotation_filter_user_id)
-        elif (
-            annotation_filter == "unannotated" or annotation_filter == "no_annotations"
-        ):
-            where_conditions.append(
-                f"""r.id NOT IN (
-                SELECT DISTINCT run_id FROM {annotations_table_name} 
-                WHERE user_id = ?
+    # Annotation filter - runs are matched with EXISTS subqueries so that
+    # filtering never requires joining (and fanning out over) the annotations
+    annotation_match = build_annotation_filters(
+        annotation_filter, annotation_filter_user_id
+    )
+    if annotation_match:
+        annotation_conditions, annotation_params, negate = annotation_match
+        subquery_conditions = " ".join(
+            f"AND {condition}" for condition in annotation_conditions
+        )
+        where_conditions.append(
+            f"""{"NOT " if negate else ""}EXISTS (
+                SELECT 1 FROM {annotations_table_name} a
+                WHERE a.run_id = r.id {subquery_conditions}
             )"""
-            )
-            params.append(annotation_filter_user_id)
-        elif annotation_filter == "correct":
-            where_conditions.append("a.judgement = 'correct' AND a.user_id = ?")
-            params.append(annotation_filter_user_id)
-        elif annotation_filter == "wrong":
-            where_conditions.append("a.judgement = 'wrong' AND a.user_id = ?")
-            params.append(annotation_filter_user_id)
-    elif annotation_filter_user_id and not annotation_filter:
-        # If only user_id is specified (for annotator filtering), show only runs with annotations by that user
-        where_conditions.append("a.user_id = ?")
-        params.append(annotation_filter_user_id)
-    elif annotation_filter and not annotation_filter_user_id:
-        # Original logic for any user annotations when no specific user is set
-        if annotation_filter == "annotated" or annotation_filter == "has_annotations":
-            where_conditions.append("a.id IS NOT NULL")
-        elif (
-            annotation_filter == "unannotated" or annotation_filter == "no_annotations"
-        ):
-            where_conditions.append("a.id IS NULL")
-        elif annotation_filter == "correct":
-            where_conditions.append("a.judgement = 'correct'")
-        elif annotation_filter == "wrong":
-            where_conditions.append("a.judgement = 'wrong'")
+        )
+        params.extend(annotation_params)
 
     # Time range filter
     if time_range:
@@ -138,27 +405,23 @@ def build_run_filters(
         elif time_range == "last30" or time_range == "last_30_days":
             where_conditions.append("r.start_time >= DATE('now', '-30 days')")
 
-    # Metadata filters (support multiple values)
-    def add_multi_filter(field, values, json_path):
+    # Metadata filters (support multiple values), using the indexed generated columns
+    def add_multi_filter(column, values):
         if values:
             placeholders = ",".join(["?"] * len(values))
-            where_conditions.append(
-                f"JSON_EXTRACT(r.metadata, '{json_path}') IN ({placeholders})"
-            )
+            where_conditions.append(f"r.{column} IN ({placeholders})")
             params.extend(values)
 
-    add_multi_filter("org_id", org_ids, "$.org.id")
-    add_multi_filter("course_id", course_ids, "$.course.id")
-    add_multi_filter("run_type", run_type, "$.type")
-    add_multi_filter("purpose", purpose, "$.question_purpose")
-    add_multi_filter("question_type", question_type, "$.question_type")
-    add_multi_filter(
-        "question_input_type", question_input_type, "$.question_input_type"
-    )
+    add_multi_filter("org_id", org_ids)
+    add_multi_filter("course_id", course_ids)
+    add_multi_filter("run_type", run_type)
+    add_multi_filter("question_purpose", purpose)
+    add_multi_filter("question_type", question_type)
+    add_multi_filter("question_input_type", question_input_type)
 
     # User email filter (single value)
     if user_email:
-        where_conditions.append("JSON_EXTRACT(r.metadata, '$.user_email') = ?")
+        where_conditions.append("r.user_email = ?")
         params.append(user_email)
 
     # Task title filter (substring match)
@@ -171,16 +434,165 @@ def build_run_filters(
         where_conditions.append("JSON_EXTRACT(r.metadata, '$.question_title') LIKE ?")
         params.append(f"%{question_title}%")
 
+    # Full-text search, served by the FTS5 index
+    search_query = build_search_query(search)
+    if search_query:
+        where_conditions.append(
+            f"r.id IN (SELECT rowid FROM {runs_search_table_name} WHERE {runs_search_table_name} MATCH ?)"
+        )
+        params.append(search_query)
+
     return where_conditions, params
 
 
+def encode_run_cursor(run: dict) -> str:
+    """
+    Encode the position of a run as an opaque cursor token.
+    """
+    payload = json.dumps([run["start_time"], run["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_run_cursor(cursor: str = None) -> Optional[Tuple[str, int]]:
+    """
+    Decode a cursor token created by encode_run_cursor into (start_time, id).
+    Raises ValueError if the token is malformed.
+    """
+    if not cursor:
+        return None
+
+    try:
+        start_time, run_id = json.loads(
+            base64.urlsafe_b64decode(cursor.encode("ascii"))
+        )
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+    if not isinstance(start_time, str) or not isinstance(run_id, int):
+        raise ValueError("Invalid cursor")
+
+    return start_time, run_id
+
+
+def build_run_cursor_condition(
+    sort_direction: str,
+    after: Tuple[str, int] = None,
+    before: Tuple[str, int] = None,
+) -> Tuple[List[str], List, str]:
+    """
+    Build the keyset condition for cursor pagination over (start_time, id).
+
+    Args:
+        sort_direction: Direction the page is displayed in ("ASC" or "DESC")
+        after: Cursor of the last run of the previous page (next page)
+        before: Cursor of the first run of the following page (previous page)
+
+    Returns:
+        Tuple of (where_conditions, params, scan_direction), where scan_direction
+        is the direction the page has to be read in before it is re-sorted
+    """
+    if after:
+        operator = "<" if sort_direction == "DESC" else ">"
+        return [f"(r.start_time, r.id) {operator} (?, ?)"], list(after), sort_direction
+
+    if before:
+        operator = ">" if sort_direction == "DESC" else "<"
+        scan_direction = "ASC" if sort_direction == "DESC" else "DESC"
+        return [f"(r.start_time, r.id) {operator} (?, ?)"], list(before), scan_direction
+
+    return [], [], sort_direction
+
+
+def get_run_page_cursors(
+    runs: list,
+    page_size: int,
+    page: int = 1,
+    after: Tuple[str, int] = None,
+    before: Tuple[str, int] = None,
+    by_relevance: bool = False,
+    has_more: bool = None,
+) -> dict:
+    """
+    Get the cursors pointing to the pages before and after a page of runs.
+    Runs ordered by search relevance are only paged by offset, so they get none.
+
+    Args:
+        has_more: Whether there are more runs past the page in the direction it
+            was read in (towards the previous pages when paging with before), as
+            returned by fetch_runs_page; when not given, a full page is assumed
+            to have more runs after it
+    """
+    if not runs or by_relevance:
+        return {"prev_cursor": None, "next_cursor": None}
+
+    if has_more is None:
+        has_more = len(runs) >= page_size
+    if before:
+        has_prev = has_more
+        has_next = True
+    else:
+        has_prev = bool(after) or page > 1
+        has_next = has_more
+
+    return {
+        "prev_cursor": encode_run_cursor(runs[0]) if has_prev else None,
+        "next_cursor": encode_run_cursor(runs[-1]) if has_next else None,
+    }
+
+
+async def start_db_pool():
+    """Open the long-lived connections used by the app process."""
+    await db_pool.start()
+
+
+async def stop_db_pool():
+    """Close all pooled connections."""
+    await db_pool.stop()
+
+
+def get_db_pool_stats():
+    return db_pool.stats()
+
+
 @asynccontextmanager
-async def get_new_db_connection():
+async def get_new_db_connection(readonly: bool = False):
+    """
+    Get a database connection. Uses the connection pool when it has been
+    started (inside the app) and opens a one-off connection otherwise (scripts).
+    While query instrumentation is on, the statements run on the connection are
+    recorded in db.instrumentation.query_stats. During a request of the app, the
+    time spent waiting for and holding pooled connections is added to the
+    database time of the request.
+
+    Args:
+        readonly: Whether the caller only reads; read-only callers get one of
+            the pooled reader connections instead of waiting on the writer
+    """
+    if db_pool.started:
+        timer = db_timer.get()
+        if timer is not None:
+            timer.enter()
+        try:
+            async with db_pool.acquire(readonly=readonly) as conn:
+                if not query_stats.enabled:
+                    yield conn
+                else:
+                    async with instrument_connection(conn) as instrumented:
+                        yield instrumented
+        finally:
+            if timer is not None:
+                timer.exit()
+        return
+
     conn = None
     try:
         conn = await aiosqlite.connect(sqlite_db_path)
-        await conn.execute("PRAGMA synchronous=NORMAL;")
-        yield conn
+        await apply_connection_pragmas(conn)
+        if not query_stats.enabled:
+            yield conn
+        else:
+            async with instrument_connection(conn) as instrumented:
+                yield instrumented
     except Exception as e:
         if conn:
             await conn.rollback()  # Rollback on any exception
@@ -214,7 +626,10 @@ async def create_tables(cursor):
             end_time TEXT,
             messages TEXT,
             metadata TEXT,
-            created_at NOT NULL DEFAULT CURRENT_TIMESTAMP
+            created_at NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            summary TEXT,
+            blob_refs TEXT,
+            {", ".join(get_runs_metadata_column_definition(column) for column in runs_metadata_columns)}
         )
     """
     )
@@ -270,107 +685,1188 @@ async def create_tables(cursor):
     """
     )
 
+    await cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {s3_sync_state_table_name} (
+            key TEXT PRIMARY KEY,
+            etag TEXT NOT NULL,
+            last_modified TEXT,
+            synced_at NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+    )
 
-async def init_db():
-    # Ensure the database folder exists
-    db_folder = os.path.dirname(sqlite_db_path)
-    if not os.path.exists(db_folder):
-        os.makedirs(db_folder)
+    await cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {blobs_table_name} (
+            hash TEXT PRIMARY KEY,
+            data BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            created_at NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    """
+    )
 
-    if not exists(sqlite_db_path):
-        # only set the defaults the first time
-        set_db_defaults()
+    await cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {compression_dictionaries_table_name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            codec TEXT NOT NULL,
+            data BLOB NOT NULL,
+            created_at NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+    )
 
-    async with get_new_db_connection() as conn:
-        cursor = await conn.cursor()
 
-        try:
-            # Check if any table is missing and create tables if needed
-            await create_tables(cursor)
-            await conn.commit()
+async def create_metrics_rollup_tables(cursor):
+    """
+    Create the summary tables read by get_metrics, along with the triggers that
+    keep them up to date on every write to the runs and annotations tables.
+    """
+    await cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {metrics_totals_table_name} (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            num_runs INTEGER NOT NULL DEFAULT 0,
+            num_learners INTEGER NOT NULL DEFAULT 0,
+            num_annotations INTEGER NOT NULL DEFAULT 0,
+            num_correct INTEGER NOT NULL DEFAULT 0,
+            num_wrong INTEGER NOT NULL DEFAULT 0
+        )
+    """
+    )
 
-        except Exception as exception:
-            # delete db
-            os.remove(sqlite_db_path)
-            raise exception
+    await cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {metrics_learners_table_name} (
+            user_id PRIMARY KEY
+        ) WITHOUT ROWID
+    """
+    )
 
+    await cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {metrics_annotators_table_name} (
+            user_id INTEGER PRIMARY KEY,
+            correct INTEGER NOT NULL DEFAULT 0,
+            wrong INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0
+        )
+    """
+    )
 
-async def create_run(
-    run_id: str,
-    start_time: str = None,
-    end_time: str = None,
-    messages: str = None,
-    metadata: str = None,
+    # Learners are added with an upsert rather than INSERT OR IGNORE, which
+    # would be overridden by the conflict handling of an upsert into runs
+    add_learner = f"""
+            INSERT INTO {metrics_learners_table_name} (user_id)
+            SELECT JSON_EXTRACT(NEW.metadata, '$.user_id')
+            WHERE JSON_EXTRACT(NEW.metadata, '$.user_id') IS NOT NULL
+            ON CONFLICT(user_id) DO NOTHING;
+    """
+
+    # Recreated in case it was created with INSERT OR IGNORE
+    await cursor.execute(f"DROP TRIGGER IF EXISTS trg_{runs_table_name}_metrics_insert")
+    await cursor.execute(
+        f"""
+        CREATE TRIGGER trg_{runs_table_name}_metrics_insert
+        AFTER INSERT ON {runs_table_name}
+        BEGIN
+            UPDATE {metrics_totals_table_name} SET num_runs = num_runs + 1 WHERE id = 1;
+            {add_learner}
+        END
+    """
+    )
+
+    await cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{runs_table_name}_metrics_update
+        AFTER UPDATE OF metadata ON {runs_table_name}
+        BEGIN
+            {add_learner}
+        END
+    """
+    )
+
+    await cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{runs_table_name}_metrics_delete
+        AFTER DELETE ON {runs_table_name}
+        BEGIN
+            UPDATE {metrics_totals_table_name} SET num_runs = num_runs - 1 WHERE id = 1;
+        END
+    """
+    )
+
+    await cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{metrics_learners_table_name}_insert
+        AFTER INSERT ON {metrics_learners_table_name}
+        BEGIN
+            UPDATE {metrics_totals_table_name} SET num_learners = num_learners + 1 WHERE id = 1;
+        END
+    """
+    )
+
+    # Annotations are counted towards their user when added and taken back out
+    # when removed; an update (e.g. a changed judgement) does both
+    add_annotation = """
+            INSERT INTO {annotators} (user_id, correct, wrong, total)
+            VALUES (NEW.user_id, LOWER(NEW.judgement) = 'correct', LOWER(NEW.judgement) = 'wrong', 1)
+            ON CONFLICT(user_id) DO UPDATE SET
+                correct = correct + excluded.correct,
+                wrong = wrong + excluded.wrong,
+                total = total + 1;
+            UPDATE {totals} SET
+                num_annotations = num_annotations + 1,
+                num_correct = num_correct + (LOWER(NEW.judgement) = 'correct'),
+                num_wrong = num_wrong + (LOWER(NEW.judgement) = 'wrong')
+            WHERE id = 1;
+    """.format(
+        annotators=metrics_annotators_table_name, totals=metrics_totals_table_name
+    )
+    remove_annotation = """
+            UPDATE {annotators} SET
+                correct = correct - (LOWER(OLD.judgement) = 'correct'),
+                wrong = wrong - (LOWER(OLD.judgement) = 'wrong'),
+                total = total - 1
+            WHERE user_id = OLD.user_id;
+            UPDATE {totals} SET
+                num_annotations = num_annotations - 1,
+                num_correct = num_correct - (LOWER(OLD.judgement) = 'correct'),
+                num_wrong = num_wrong - (LOWER(OLD.judgement) = 'wrong')
+            WHERE id = 1;
+    """.format(
+        annotators=metrics_annotators_table_name, totals=metrics_totals_table_name
+    )
+
+    await cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{annotations_table_name}_metrics_insert
+        AFTER INSERT ON {annotations_table_name}
+        BEGIN
+            {add_annotation}
+        END
+    """
+    )
+
+    await cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{annotations_table_name}_metrics_update
+        AFTER UPDATE OF user_id, judgement ON {annotations_table_name}
+        BEGIN
+            {remove_annotation}
+            {add_annotation}
+        END
+    """
+    )
+
+    await cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{annotations_table_name}_metrics_delete
+        AFTER DELETE ON {annotations_table_name}
+        BEGIN
+            {remove_annotation}
+        END
+    """
+    )
+
+
+async def create_daily_metrics_tables(cursor):
+    """
+    Create the per-day summary tables read by get_metric_trends, counting the
+    runs started and the annotations made by each annotator on each day, along
+    with the triggers that keep them up to date on every write to the runs and
+    annotations tables.
+    """
+    await cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {metrics_daily_runs_table_name} (
+            day TEXT PRIMARY KEY,
+            num_runs INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """
+    )
+
+    await cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {metrics_daily_annotators_table_name} (
+            day TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            correct INTEGER NOT NULL DEFAULT 0,
+            wrong INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, user_id)
+        ) WITHOUT ROWID
+    """
+    )
+
+    # Runs are counted on the day they started
+    add_run = f"""
+            INSERT INTO {metrics_daily_runs_table_name} (day, num_runs)
+            SELECT DATE(NEW.start_time), 1 WHERE DATE(NEW.start_time) IS NOT NULL
+            ON CONFLICT(day) DO UPDATE SET num_runs = num_runs + 1;
+    """
+    remove_run = f"""
+            UPDATE {metrics_daily_runs_table_name} SET num_runs = num_runs - 1
+            WHERE day = DATE(OLD.start_time);
+    """
+
+    await cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{runs_table_name}_daily_metrics_insert
+        AFTER INSERT ON {runs_table_name}
+        BEGIN
+            {add_run}
+        END
+    """
+    )
+
+    await cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{runs_table_name}_daily_metrics_update
+        AFTER UPDATE OF start_time ON {runs_table_name}
+        WHEN DATE(OLD.start_time) IS NOT DATE(NEW.start_time)
+        BEGIN
+            {remove_run}
+            {add_run}
+        END
+    """
+    )
+
+    await cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{runs_table_name}_daily_metrics_delete
+        AFTER DELETE ON {runs_table_name}
+        BEGIN
+            {remove_run}
+        END
+    """
+    )
+
+    # Annotations are counted on the day they were made, like in the all-time
+    # summary tables
+    add_annotation = f"""
+            INSERT INTO {metrics_daily_annotators_table_name} (day, user_id, correct, wrong, total)
+            VALUES (
+                DATE(NEW.created_at), NEW.user_id,
+                LOWER(NEW.judgement) = 'correct', LOWER(NEW.judgement) = 'wrong', 1
+            )
+            ON CONFLICT(day, user_id) DO UPDATE SET
+                correct = correct + excluded.correct,
+                wrong = wrong + excluded.wrong,
+                total = total + 1;
+    """
+    remove_annotation = f"""
+            UPDATE {metrics_daily_annotators_table_name} SET
+                correct = correct - (LOWER(OLD.judgement) = 'correct'),
+                wrong = wrong - (LOWER(OLD.judgement) = 'wrong'),
+                total = total - 1
+            WHERE day = DATE(OLD.created_at) AND user_id = OLD.user_id;
+    """
+
+    await cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{annotations_table_name}_daily_metrics_insert
+        AFTER INSERT ON {annotations_table_name}
+        BEGIN
+            {add_annotation}
+        END
+    """
+    )
+
+    await cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{annotations_table_name}_daily_metrics_update
+        AFTER UPDATE OF user_id, judgement, created_at ON {annotations_table_name}
+        BEGIN
+            {remove_annotation}
+            {add_annotation}
+        END
+    """
+    )
+
+    await cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{annotations_table_name}_daily_metrics_delete
+        AFTER DELETE ON {annotations_table_name}
+        BEGIN
+            {remove_annotation}
+        END
+    """
+    )
+
+
+async def backfill_daily_metrics(cursor):
+    """
+    Recompute the per-day summary tables from the runs and annotations tables.
+    """
+    await cursor.execute(f"DELETE FROM {metrics_daily_runs_table_name}")
+    await cursor.execute(f"DELETE FROM {metrics_daily_annotators_table_name}")
+
+    await cursor.execute(
+        f"""
+        INSERT INTO {metrics_daily_runs_table_name} (day, num_runs)
+        SELECT DATE(start_time) AS day, COUNT(*) FROM {runs_table_name}
+        WHERE day IS NOT NULL
+        GROUP BY day
+        """
+    )
+
+    await cursor.execute(
+        f"""
+        INSERT INTO {metrics_daily_annotators_table_name} (day, user_id, correct, wrong, total)
+        SELECT DATE(created_at) AS day, user_id,
+               SUM(LOWER(judgement) = 'correct'),
+               SUM(LOWER(judgement) = 'wrong'),
+               COUNT(*)
+        FROM {annotations_table_name}
+        GROUP BY day, user_id
+        """
+    )
+
+
+# Dimension tables for the facets shown in the filters, with the metadata
+# paths of the name and the generated column holding the id
+facet_tables = {
+    orgs_table_name: ("org_id", "$.org.name"),
+    courses_table_name: ("course_id", "$.course.name"),
+}
+
+
+async def create_facet_tables(cursor):
+    """
+    Create the orgs and courses tables, along with the triggers that upsert
+    the org and course of every run as it is inserted or updated.
+    """
+    upserts = []
+    for table_name, (id_column, name_path) in facet_tables.items():
+        # ids are untyped so that an unexpected id in the metadata never makes
+        # the insert of a run fail
+        await cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table_name} (
+                id NOT NULL PRIMARY KEY,
+                name TEXT NOT NULL
+            ) WITHOUT ROWID
+        """
+        )
+
+        await cursor.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS idx_{table_name}_name
+            ON {table_name} (name COLLATE NOCASE, id)
+            """
+        )
+
+        upserts.append(
+            f"""
+            INSERT INTO {table_name} (id, name)
+            SELECT NEW.{id_column}, JSON_EXTRACT(NEW.metadata, '{name_path}')
+            WHERE NEW.{id_column} IS NOT NULL
+            AND JSON_EXTRACT(NEW.metadata, '{name_path}') IS NOT NULL
+            ON CONFLICT(id) DO UPDATE SET name = excluded.name
+            WHERE name IS NOT excluded.name;
+            """
+        )
+
+    await cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{runs_table_name}_facets_insert
+        AFTER INSERT ON {runs_table_name}
+        BEGIN
+            {"".join(upserts)}
+        END
+    """
+    )
+
+    await cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{runs_table_name}_facets_update
+        AFTER UPDATE OF metadata ON {runs_table_name}
+        BEGIN
+            {"".join(upserts)}
+        END
+    """
+    )
+
+
+def get_search_messages_sql(messages: str):
+    """
+    SQL expression for the text of a run's messages that is indexed for search:
+    the content of every message, skipping messages that are not valid JSON.
+    The messages must be given as text, decompressed if they were compressed.
+    """
+    return f"""(
+        SELECT GROUP_CONCAT(JSON_EXTRACT(value, '$.content'), ' ')
+        FROM (SELECT {messages} AS text) AS m,
+            JSON_EACH(CASE WHEN JSON_VALID(m.text) THEN m.text ELSE '[]' END)
+    )"""
+
+
+def get_search_messages_update_query(update_existing: bool = True):
+    """
+    Get the query indexing the messages of a run stored compressed, which the
+    triggers leave out, from the parameters ?1 and ?2 (the run_id and the text
+    of the messages). The index is only written when the text has changed.
+
+    Args:
+        update_existing: Whether the run was upserted with update_existing, so
+            that its messages are the ones given; otherwise the run is only
+            indexed if they are
+    """
+    messages = get_search_messages_sql("?2")
+    condition = "" if update_existing else "AND decompress_text(messages) = ?2"
+    return f"""
+        UPDATE {runs_search_table_name} SET messages = {messages}
+        WHERE rowid = (
+            SELECT id FROM {runs_table_name}
+            WHERE run_id = ?1 AND TYPEOF(messages) = 'blob' {condition}
+        )
+        AND messages IS NOT {messages}
+    """
+
+
+def get_search_notes_sql(run_id: str):
+    """
+    SQL expression for the annotation notes of a run that are indexed for search.
+    """
+    return f"""(
+        SELECT GROUP_CONCAT(notes, ' ') FROM {annotations_table_name}
+        WHERE run_id = {run_id} AND notes IS NOT NULL AND notes != ''
+    )"""
+
+
+async def create_search_index(cursor):
+    """
+    Create the full-text index over the messages and annotation notes of every
+    run (keyed by the run's id), along with the triggers keeping it in sync as
+    runs and annotations are inserted, updated and deleted.
+    """
+    await cursor.execute(
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {runs_search_table_name}
+        USING fts5(messages, notes)
+    """
+    )
+
+    # The triggers only use built-in SQL functions, so that runs can be
+    # written by any client of the database, not only the app's connections
+    # which register decompress_text. They index the messages stored as text;
+    # compressed messages are indexed by write_runs from their text instead.
+    # Compressing or decompressing messages leaves their text, and so the
+    # index, unchanged. Recreated in case older versions of them are there
+    await cursor.execute(f"DROP TRIGGER IF EXISTS trg_{runs_table_name}_search_insert")
+    await cursor.execute(f"DROP TRIGGER IF EXISTS trg_{runs_table_name}_search_update")
+    await cursor.execute(
+        f"""
+        CREATE TRIGGER trg_{runs_table_name}_search_insert
+        AFTER INSERT ON {runs_table_name}
+        BEGIN
+            INSERT INTO {runs_search_table_name} (rowid, messages, notes)
+            VALUES (
+                NEW.id,
+                CASE WHEN TYPEOF(NEW.messages) = 'text'
+                    THEN {get_search_messages_sql("NEW.messages")}
+                END,
+                NULL
+            );
+        END
+    """
+    )
+
+    await cursor.execute(
+        f"""
+        CREATE TRIGGER trg_{runs_table_name}_search_update
+        AFTER UPDATE OF messages ON {runs_table_name}
+        WHEN OLD.messages IS NOT NEW.messages AND TYPEOF(NEW.messages) = 'text'
+        BEGIN
+            UPDATE {runs_search_table_name}
+            SET messages = {get_search_messages_sql("NEW.messages")}
+            WHERE rowid = NEW.id;
+        END
+    """
+    )
+
+    await cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{runs_table_name}_search_delete
+        AFTER DELETE ON {runs_table_name}
+        BEGIN
+            DELETE FROM {runs_search_table_name} WHERE rowid = OLD.id;
+        END
+    """
+    )
+
+    # The notes of all the annotations of a run are indexed together, so they
+    # are recomputed for the run whenever one of its annotations changes
+    update_notes = """
+            UPDATE {search} SET notes = {notes} WHERE rowid = {run_id};
+    """
+
+    await cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{annotations_table_name}_search_insert
+        AFTER INSERT ON {annotations_table_name}
+        BEGIN
+            {update_notes.format(search=runs_search_table_name, notes=get_search_notes_sql("NEW.run_id"), run_id="NEW.run_id")}
+        END
+    """
+    )
+
+    await cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{annotations_table_name}_search_update
+        AFTER UPDATE OF run_id, notes ON {annotations_table_name}
+        BEGIN
+            {update_notes.format(search=runs_search_table_name, notes=get_search_notes_sql("OLD.run_id"), run_id="OLD.run_id")}
+            {update_notes.format(search=runs_search_table_name, notes=get_search_notes_sql("NEW.run_id"), run_id="NEW.run_id")}
+        END
+    """
+    )
+
+    await cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{annotations_table_name}_search_delete
+        AFTER DELETE ON {annotations_table_name}
+        BEGIN
+            {update_notes.format(search=runs_search_table_name, notes=get_search_notes_sql("OLD.run_id"), run_id="OLD.run_id")}
+        END
+    """
+    )
+
+
+# Tables whose writes are counted in the write counters table
+write_counted_tables = [
+    runs_table_name,
+    annotations_table_name,
+    queues_table_name,
+    queue_runs_table_name,
+    users_table_name,
+]
+
+
+async def create_write_counters(cursor):
+    """
+    Create the table counting the writes to each table in write_counted_tables,
+    along with the triggers incrementing the counters.
+    """
+    await cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {write_counters_table_name} (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """
+    )
+
+    for table_name in write_counted_tables:
+        await cursor.execute(
+            f"""
+            INSERT INTO {write_counters_table_name} (table_name) VALUES (?)
+            ON CONFLICT(table_name) DO NOTHING
+            """,
+            (table_name,),
+        )
+
+        for event in ["insert", "update", "delete"]:
+            await cursor.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table_name}_write_counter_{event}
+                AFTER {event.upper()} ON {table_name}
+                BEGIN
+                    UPDATE {write_counters_table_name} SET version = version + 1
+                    WHERE table_name = '{table_name}';
+                END
+            """
+            )
+
+
+# Write counters read at the last data_version seen by the connection pool
+_write_versions = {"data_version": None, "versions": None}
+
+
+async def get_write_versions() -> dict:
+    """
+    Get the number of writes to each table in write_counted_tables. Within the
+    app, the counters are only read again when PRAGMA data_version shows that
+    something was committed since they were last read, so this is cheap enough
+    to be called on every request.
+
+    Returns:
+        Dictionary mapping each table name to its write counter
+    """
+    data_version = await db_pool.data_version() if db_pool.started else None
+    if data_version is not None and data_version == _write_versions["data_version"]:
+        return _write_versions["versions"]
+
+    # data_version is read before the counters, so that the cached counters can
+    # only be newer than the version they are stored under
+    async with get_new_db_connection(readonly=True) as conn:
+        cursor = await conn.cursor()
+        await cursor.execute(
+            f"SELECT table_name, version FROM {write_counters_table_name}"
+        )
+        versions = dict(await cursor.fetchall())
+
+    _write_versions["data_version"] = data_version
+    _write_versions["versions"] = versions
+    return versions
+
+
+async def backfill_search_index(cursor):
+    """
+    Fill the full-text index from the existing runs and annotations.
+    """
+    await cursor.execute(f"DELETE FROM {runs_search_table_name}")
+    await cursor.execute(
+        f"""
+        INSERT INTO {runs_search_table_name} (rowid, messages, notes)
+        SELECT r.id, {get_search_messages_sql("decompress_text(r.messages)")}, {get_search_notes_sql("r.id")}
+        FROM {runs_table_name} r
+        """
+    )
+    # Merge the index segments written by the backfill into one
+    await cursor.execute(
+        f"INSERT INTO {runs_search_table_name} ({runs_search_table_name}) VALUES ('optimize')"
+    )
+
+
+async def backfill_facet_tables(cursor):
+    """
+    Fill the orgs and courses tables from the existing runs; the most recently
+    inserted run wins when a name has changed.
+    """
+    for table_name, (id_column, name_path) in facet_tables.items():
+        await cursor.execute(
+            f"""
+            INSERT INTO {table_name} (id, name)
+            SELECT {id_column}, JSON_EXTRACT(metadata, '{name_path}')
+            FROM {runs_table_name}
+            WHERE {id_column} IS NOT NULL
+            AND JSON_EXTRACT(metadata, '{name_path}') IS NOT NULL
+            ORDER BY id
+            ON CONFLICT(id) DO UPDATE SET name = excluded.name
+            """
+        )
+
+
+@log_exceptions
+async def rebuild_metrics():
+    """
+    Recompute the metrics summary tables, including the per-day ones, from the
+    runs and annotations tables, repairing any drift.
+    """
+    async with get_new_db_connection() as conn:
+        cursor = await conn.cursor()
+
+        await cursor.execute(f"DELETE FROM {metrics_learners_table_name}")
+        await cursor.execute(f"DELETE FROM {metrics_annotators_table_name}")
+        await cursor.execute(
+            f"INSERT OR REPLACE INTO {metrics_totals_table_name} (id) VALUES (1)"
+        )
+
+        # num_learners is counted by the trigger on the learners table
+        await cursor.execute(
+            f"""
+            INSERT INTO {metrics_learners_table_name} (user_id)
+            SELECT DISTINCT JSON_EXTRACT(metadata, '$.user_id') FROM {runs_table_name}
+            WHERE JSON_EXTRACT(metadata, '$.user_id') IS NOT NULL
+            """
+        )
+
+        await cursor.execute(
+            f"""
+            INSERT INTO {metrics_annotators_table_name} (user_id, correct, wrong, total)
+            SELECT user_id,
+                   SUM(LOWER(judgement) = 'correct'),
+                   SUM(LOWER(judgement) = 'wrong'),
+                   COUNT(*)
+            FROM {annotations_table_name}
+            GROUP BY user_id
+            """
+        )
+
+        await cursor.execute(
+            f"""
+            UPDATE {metrics_totals_table_name} SET
+                num_runs = (SELECT COUNT(*) FROM {runs_table_name}),
+                num_annotations = (SELECT COALESCE(SUM(total), 0) FROM {metrics_annotators_table_name}),
+                num_correct = (SELECT COALESCE(SUM(correct), 0) FROM {metrics_annotators_table_name}),
+                num_wrong = (SELECT COALESCE(SUM(wrong), 0) FROM {metrics_annotators_table_name})
+            WHERE id = 1
+            """
+        )
+
+        await create_daily_metrics_tables(cursor)
+        await backfill_daily_metrics(cursor)
+
+        await conn.commit()
+
+
+async def init_db():
+    # Ensure the database folder exists
+    db_folder = os.path.dirname(sqlite_db_path)
+    if not os.path.exists(db_folder):
+        os.makedirs(db_folder)
+
+    if not exists(sqlite_db_path):
+        # only set the defaults the first time
+        set_db_defaults()
+
+    async with get_new_db_connection() as conn:
+        cursor = await conn.cursor()
+
+        try:
+            # Check if any table is missing and create tables if needed
+            await create_tables(cursor)
+            await conn.commit()
+
+        except Exception as exception:
+            # delete db
+            os.remove(sqlite_db_path)
+            raise exception
+
+    # Bring existing databases up to date (columns, indexes) without ever deleting them
+    from .migrations import run_migrations
+
+    await run_migrations()
+
+
+async def create_run(
+    run_id: str,
+    start_time: str = None,
+    end_time: str = None,
+    messages: str = None,
+    metadata: str = None,
+):
+    """
+    Create a new run record in the database.
+
+    Args:
+        run_id: Unique identifier for the run
+        start_time: Start time of the run
+        end_time: End time of the run
+        messages: Messages associated with the run
+        metadata: Additional metadata for the run
+
+    Returns:
+        The ID of the created run
+    """
+    async with get_new_db_connection() as conn:
+        cursor = await conn.cursor()
+
+        values = (
+            run_id,
+            start_time,
+            end_time,
+            json.dumps(messages),
+            json.dumps(metadata),
+        )
+        await cursor.execute(get_blobs_insert_query(), values)
+        await cursor.execute(
+            f"""
+            INSERT INTO {runs_table_name} ({runs_insert_columns})
+            SELECT {get_run_values_sql()}
+            """,
+            values,
+        )
+        row_id = cursor.lastrowid
+        if runs_compression != "none":
+            await cursor.execute(
+                get_search_messages_update_query(), (values[0], values[3])
+            )
+
+        await conn.commit()
+        return row_id
+
+
+def get_runs_upsert_query(update_existing: bool = True):
+    """
+    Get the query inserting a run keyed by its run_id, so that inserting the
+    same runs again never creates duplicates.
+
+    Args:
+        update_existing: Whether to overwrite a run that already exists with the
+            values given for it, or leave it unchanged
+    """
+    if update_existing:
+        # Rows whose values have not changed are not rewritten
+        on_conflict = """
+            DO UPDATE SET
+                start_time = excluded.start_time,
+                end_time = excluded.end_time,
+                messages = excluded.messages,
+                metadata = excluded.metadata,
+                blob_refs = excluded.blob_refs,
+                summary = excluded.summary
+            WHERE (start_time, end_time, messages, metadata, blob_refs)
+                IS NOT (excluded.start_time, excluded.end_time, excluded.messages, excluded.metadata, excluded.blob_refs)
+        """
+    else:
+        on_conflict = "DO NOTHING"
+
+    # The WHERE clause is required by the upsert syntax after a SELECT
+    return f"""
+        INSERT INTO {runs_table_name} ({runs_insert_columns})
+        SELECT {get_run_values_sql()}
+        WHERE true
+        ON CONFLICT(run_id) {on_conflict}
+    """
+
+
+async def bulk_insert_runs(runs: list[tuple], update_existing: bool = True):
+    """
+    Bulk insert runs into the database, in a single transaction. For loading
+    a large number of runs, use db.bulk_load.RunsBulkLoader instead.
+
+    Args:
+        runs: (run_id, start_time, end_time, messages, metadata) tuples
+        update_existing: Whether to overwrite a run that already exists with the
+            values given for it, or leave it unchanged
+
+    Returns:
+        Number of runs inserted or changed
+    """
+    async with get_new_db_connection() as conn:
+        num_changed = await write_runs(conn, runs, update_existing)
+        await conn.commit()
+        return num_changed
+
+
+async def write_runs(conn, runs: list[tuple], update_existing: bool = True):
+    """
+    Upsert runs, along with the blobs they reference, on a connection without
+    committing.
+
+    Args:
+        runs: (run_id, start_time, end_time, messages, metadata) tuples
+        update_existing: Whether to overwrite a run that already exists with the
+            values given for it, or leave it unchanged
+
+    Returns:
+        Number of runs inserted or changed
+    """
+    await conn.executemany(get_blobs_insert_query(), runs)
+    cursor = await conn.executemany(get_runs_upsert_query(update_existing), runs)
+    num_changed = cursor.rowcount
+
+    if runs_compression != "none":
+        await conn.executemany(
+            get_search_messages_update_query(update_existing),
+            [(run[0], run[3]) for run in runs],
+        )
+
+    return num_changed
+
+
+async def create_user(name: str):
+    """
+    Create a new user in the database.
+
+    Args:
+        name: Unique name for the user
+
+    Returns:
+        The ID of the created user
+    """
+    async with get_new_db_connection() as conn:
+        cursor = await conn.cursor()
+
+        await cursor.execute(
+            f"""
+            INSERT INTO {users_table_name} (name)
+            VALUES (?)
+            """,
+            (name,),
+        )
+
+        await conn.commit()
+        return cursor.lastrowid
+
+
+async def fetch_annotations_for_runs(
+    cursor,
+    run_ids: List[int],
+    annotation_match: Optional[Tuple[List[str], List, bool]] = None,
+) -> dict:
+    """
+    Fetch the annotations of a set of runs in one batched query.
+
+    Args:
+        cursor: Cursor to run the query on
+        run_ids: IDs of the runs
+        annotation_match: Output of build_annotation_filters; when it selects runs
+            with matching annotations, only those annotations are returned
+
+    Returns:
+        Dictionary mapping each run ID to {username: annotation}
+    """
+    annotations = {run_id: {} for run_id in run_ids}
+    if not run_ids:
+        return annotations
+
+    conditions = [f"a.run_id IN ({','.join(['?'] * len(run_ids))})"]
+    params = list(run_ids)
+    if annotation_match and not annotation_match[2]:
+        conditions.extend(annotation_match[0])
+        params.extend(annotation_match[1])
+
+    await cursor.execute(
+        f"""
+        SELECT a.run_id, a.judgement, a.notes, a.created_at, u.name
+        FROM {annotations_table_name} a
+        JOIN {users_table_name} u ON a.user_id = u.id
+        WHERE {" AND ".join(conditions)}
+        """,
+        params,
+    )
+
+    for run_id, judgement, notes, timestamp, username in await cursor.fetchall():
+        annotations[run_id][username] = {
+            "judgement": judgement,
+            "notes": notes,
+            "timestamp": timestamp,
+        }
+
+    return annotations
+
+
+async def fetch_search_results(cursor, run_ids: List[int], search_query: str):
+    """
+    Fetch the rank and a snippet of the text matching an FTS5 query for the
+    given runs, as a dictionary mapping each run id to
+    {"rank": ..., "snippet": ...}.
+    """
+    if not run_ids:
+        return {}
+
+    # Matches are marked with control characters so that the snippet can be
+    # escaped like the rest of the run before the <mark> tags are added
+    await cursor.execute(
+        f"""
+        SELECT rowid, rank, SNIPPET({runs_search_table_name}, -1, char(2), char(3), '…', 16)
+        FROM {runs_search_table_name}
+        WHERE {runs_search_table_name} MATCH ?
+        AND rowid IN ({",".join(["?"] * len(run_ids))})
+        """,
+        [search_query] + list(run_ids),
+    )
+
+    return {
+        run_id: {
+            "rank": rank,
+            "snippet": (snippet or "")
+            .replace("<", "&lt;")
+            .replace(">", "&gt;")
+            .replace("\x02", "<mark>")
+            .replace("\x03", "</mark>"),
+        }
+        for run_id, rank, snippet in await cursor.fetchall()
+    }
+
+
+async def fetch_runs_page(
+    cursor,
+    where_conditions: List[str],
+    params: List,
+    page: int = 1,
+    page_size: int = 20,
+    sort_direction: str = "DESC",
+    after: Tuple[str, int] = None,
+    before: Tuple[str, int] = None,
+    annotation_match: Optional[Tuple[List[str], List, bool]] = None,
+    search: str = None,
+    order_by_rank: bool = False,
 ):
     """
-    Create a new run record in the database.
+    Fetch one page of the runs (aliased as r) matching the given conditions,
+    along with their annotations. Runs are returned as summaries, with the
+    metadata fields shown in the listings but without their messages; the full
+    run is returned by get_run. The metadata and summary are HTML-escaped
+    RawJSON text, to be serialized with db.raw_json.dumps.
+
+    The page is selected over the runs table alone, so every page holds exactly
+    page_size runs however many annotations each run has, and the annotations
+    of the page are then loaded in a single batched query.
+
+    With a search (which the conditions are expected to filter on), every run
+    also gets a "search" entry with its FTS5 rank (lower is more relevant) and
+    a snippet of the matching text with the matches wrapped in <mark> tags.
+    With order_by_rank, runs are ordered by relevance and paged by offset.
+
+    Returns a tuple: (runs, total_count, has_more), where has_more tells whether
+    there are runs past the page in the direction it was read in (before the
+    page when paging with before), for get_run_page_cursors
+    """
+    search_query = build_search_query(search)
+    order_by_rank = order_by_rank and search_query is not None
+
+    # The summary is split into the metadata and the rest, and HTML-escaped, by
+    # SQLite, so that it can be returned without being decoded here
+    summary_columns = ", ".join(
+        [
+            escape_html_sql("JSON_EXTRACT(r.summary, '$.metadata')"),
+            escape_html_sql("JSON_REMOVE(r.summary, '$.metadata')"),
+        ]
+    )
 
-    Args:
-        run_id: Unique identifier for the run
-        start_time: Start time of the run
-        end_time: End time of the run
-        messages: Messages associated with the run
-        metadata: Additional metadata for the run
+    where_clause = ""
+    if where_conditions:
+        where_clause = " WHERE " + " AND ".join(where_conditions)
 
-    Returns:
-        The ID of the created run
-    """
-    async with get_new_db_connection() as conn:
-        cursor = await conn.cursor()
+    # Get total count for pagination
+    await cursor.execute(
+        f"SELECT COUNT(*) FROM {runs_table_name} r{where_clause}", params
+    )
+    total_count = (await cursor.fetchone())[0]
+
+    cursor_conditions, cursor_params, scan_direction = build_run_cursor_condition(
+        sort_direction, after=after, before=before
+    )
+    page_conditions = where_conditions + cursor_conditions
+    page_where_clause = ""
+    if page_conditions:
+        page_where_clause = " WHERE " + " AND ".join(page_conditions)
+
+    # Cursor pages start right after the cursor; offset pages skip the previous pages
+    offset = 0 if (after or before) else (page - 1) * page_size
 
+    if order_by_rank:
+        # Rank the matches and pick the page of run ids before reading the large
+        # columns of just those runs
         await cursor.execute(
             f"""
-            INSERT INTO {runs_table_name} 
-            (run_id, start_time, end_time, messages, metadata)
-            VALUES (?, ?, ?, ?, ?)
+            SELECT r.id FROM {runs_table_name} r
+            JOIN (
+                SELECT rowid, rank FROM {runs_search_table_name}
+                WHERE {runs_search_table_name} MATCH ?
+            ) s ON s.rowid = r.id
+            {where_clause}
+            ORDER BY s.rank, r.id
+            LIMIT ? OFFSET ?
             """,
-            (run_id, start_time, end_time, json.dumps(messages), json.dumps(metadata)),
+            [search_query] + params + [page_size, (page - 1) * page_size],
         )
+        page_ids = [row[0] for row in await cursor.fetchall()]
+        has_more = len(page_ids) == page_size
 
-        await conn.commit()
-        return cursor.lastrowid
-
-
-async def bulk_insert_runs(runs: list[tuple]):
-    """
-    Bulk insert runs into the database.
-    """
-    async with get_new_db_connection() as conn:
-        cursor = await conn.cursor()
-        await cursor.executemany(
+        await cursor.execute(
             f"""
-            INSERT INTO {runs_table_name}
-            (run_id, start_time, end_time, messages, metadata)
-            VALUES (?, ?, ?, ?, ?)
+            SELECT r.id, r.run_id, r.start_time, r.end_time, {summary_columns}, r.created_at
+            FROM {runs_table_name} r
+            WHERE r.id IN ({",".join(["?"] * len(page_ids))})
             """,
-            runs,
+            page_ids,
         )
-        await conn.commit()
+        rows_by_id = {row[0]: row for row in await cursor.fetchall()}
+        rows = [rows_by_id[run_id] for run_id in page_ids if run_id in rows_by_id]
+    else:
+        # Pick the page of run ids from the (start_time, id) index before reading
+        # the large columns of just those runs. One more run is read to know
+        # whether there is another page in the direction of the scan.
+        await cursor.execute(
+            f"""
+            SELECT r.id, r.run_id, r.start_time, r.end_time, {summary_columns}, r.created_at
+            FROM {runs_table_name} r
+            WHERE r.id IN (
+                SELECT r.id FROM {runs_table_name} r
+                {page_where_clause}
+                ORDER BY r.start_time {scan_direction}, r.id {scan_direction}
+                LIMIT ? OFFSET ?
+            )
+            ORDER BY r.start_time {sort_direction}, r.id {sort_direction}
+            """,
+            params + cursor_params + [page_size + 1, offset],
+        )
+        rows = await cursor.fetchall()
+        has_more = len(rows) > page_size
+        if has_more:
+            # The extra run comes last in the scan, which is reversed for before
+            rows = rows[1:] if scan_direction != sort_direction else rows[:-1]
+
+    annotations = await fetch_annotations_for_runs(
+        cursor, [row[0] for row in rows], annotation_match
+    )
 
+    runs = [
+        {
+            "id": row[0],
+            "run_id": row[1],
+            "start_time": row[2],
+            "end_time": row[3],
+            "metadata": RawJSON(row[4] or "{}"),
+            "summary": RawJSON(row[5] or "{}"),
+            "created_at": row[6],
+            "annotations": annotations[row[0]],
+        }
+        for row in rows
+    ]
 
-async def create_user(name: str):
+    if search_query:
+        search_results = await fetch_search_results(
+            cursor, [row[0] for row in rows], search_query
+        )
+        for run in runs:
+            run["search"] = search_results.get(run["id"])
+
+    return runs, total_count, has_more
+
+
+async def get_run(id: int):
     """
-    Create a new user in the database.
+    Get a run with its full messages and metadata, along with its annotations.
+    The messages and metadata are returned as HTML-escaped RawJSON text, to be
+    serialized with db.raw_json.dumps. Compressed messages are only decompressed
+    here, when a single run is opened, and the metadata fields stored as blobs
+    are put back in from the blob cache.
 
     Args:
-        name: Unique name for the user
+        id: ID of the run
 
     Returns:
-        The ID of the created user
+        The run, or None if it does not exist
     """
-    async with get_new_db_connection() as conn:
+    async with get_new_db_connection(readonly=True) as conn:
         cursor = await conn.cursor()
-
         await cursor.execute(
             f"""
-            INSERT INTO {users_table_name} (name)
-            VALUES (?)
+            SELECT id, run_id, start_time, end_time,
+                {escape_html_sql("decompress_text(messages)")},
+                {escape_html_sql("metadata")}, created_at, blob_refs
+            FROM {runs_table_name} WHERE id = ?
             """,
-            (name,),
+            (id,),
         )
+        row = await cursor.fetchone()
+        if not row:
+            return None
+
+        metadata = row[5]
+        if row[7]:
+            blob_refs = json.loads(row[7])
+            blobs = await fetch_blobs(cursor, blob_refs.values())
+            metadata = set_raw_json_fields(
+                metadata,
+                {
+                    field: escape_html(blobs[hash])
+                    for field, hash in blob_refs.items()
+                    if hash in blobs
+                },
+            )
 
-        await conn.commit()
-        return cursor.lastrowid
+        annotations = await fetch_annotations_for_runs(cursor, [row[0]])
+
+        return {
+            "id": row[0],
+            "run_id": row[1],
+            "start_time": row[2],
+            "end_time": row[3],
+            "messages": RawJSON(row[4]),
+            "metadata": RawJSON(metadata),
+            "created_at": row[6],
+            "annotations": annotations[row[0]],
+        }
 
 
 async def get_queue(
@@ -382,11 +1878,20 @@ async def get_queue(
     user_email: str = None,
     task_title: str = None,
     question_title: str = None,
+    after: Tuple[str, int] = None,
+    before: Tuple[str, int] = None,
+    search: str = None,
+    sort_by: str = "timestamp",
 ):
     """
     Get a queue with its associated user information and runs with annotations, with pagination and annotation status filtering support.
+    Runs are ordered by (start_time, id), newest first, and paged by offset or, when an
+    after/before cursor is given, by keyset. With a search, only the runs matching it are
+    returned, ordered by relevance if sort_by is "relevance".
+    Returns a tuple: (queue, total_count, has_more), with has_more as returned by
+    fetch_runs_page
     """
-    async with get_new_db_connection() as conn:
+    async with get_new_db_connection(readonly=True) as conn:
         cursor = await conn.cursor()
 
         # Get queue details
@@ -409,93 +1914,42 @@ async def get_queue(
         }
 
         # Build WHERE clause for filtering runs in this queue
-        where_conditions = ["q.id = ?"]
+        where_conditions = [
+            f"r.id IN (SELECT run_id FROM {queue_runs_table_name} WHERE queue_id = ?)"
+        ]
         params = [queue_id]
-        if annotation_filter or user_email or task_title or question_title:
+        annotation_match = None
+        if annotation_filter or user_email or task_title or question_title or search:
             filter_conds, filter_params = build_run_filters(
                 annotation_filter=annotation_filter,
                 annotation_filter_user_id=annotation_filter_user_id,
                 user_email=user_email,
                 task_title=task_title,
                 question_title=question_title,
+                search=search,
             )
             where_conditions.extend(filter_conds)
             params.extend(filter_params)
-        where_clause = " AND ".join(where_conditions)
+            annotation_match = build_annotation_filters(
+                annotation_filter, annotation_filter_user_id
+            )
 
-        # Get total count of runs in this queue (with filter)
-        await cursor.execute(
-            f"""
-            SELECT COUNT(DISTINCT r.id)
-            FROM {queues_table_name} q
-            LEFT JOIN {queue_runs_table_name} qr ON q.id = qr.queue_id
-            LEFT JOIN {runs_table_name} r ON qr.run_id = r.id
-            LEFT JOIN {annotations_table_name} a ON r.id = a.run_id
-            WHERE {where_clause}
-            """,
+        runs, total_count, has_more = await fetch_runs_page(
+            cursor,
+            where_conditions,
             params,
+            page=page,
+            page_size=page_size,
+            after=after,
+            before=before,
+            annotation_match=annotation_match,
+            search=search,
+            order_by_rank=sort_by == "relevance",
         )
-        total_count = (await cursor.fetchone())[0]
-
-        # Calculate offset for pagination
-        offset = (page - 1) * page_size
-
-        # Get paginated runs with annotations (with filter)
-        await cursor.execute(
-            f"""
-                SELECT r.id as run_id, r.run_id as span_id, r.start_time, r.end_time, r.messages, r.metadata, r.created_at as run_created_at, a.judgement, a.notes, a.created_at as annotation_timestamp, ann_user.name as annotation_username
-            FROM {queues_table_name} q
-            LEFT JOIN {queue_runs_table_name} qr ON q.id = qr.queue_id
-            LEFT JOIN {runs_table_name} r ON qr.run_id = r.id
-            LEFT JOIN {annotations_table_name} a ON r.id = a.run_id
-            LEFT JOIN {users_table_name} ann_user ON a.user_id = ann_user.id
-            WHERE {where_clause}
-            ORDER BY r.created_at DESC
-            LIMIT ? OFFSET ?
-            """,
-            params + [page_size, offset],
-        )
-
-        rows = await cursor.fetchall()
-
-        runs = []
-        current_run = None
-
-        for row in rows:
-            run_id = row[0]
-
-            if current_run is None or current_run["id"] != run_id:
-                if current_run is not None:
-                    runs.append(current_run)
-
-                current_run = {
-                    "id": row[0],
-                    "run_id": row[1],
-                    "start_time": row[2],
-                    "end_time": row[3],
-                    "messages": json.loads(
-                        row[4].replace("<", "&lt;").replace(">", "&gt;")
-                    ),
-                    "metadata": json.loads(
-                        row[5].replace("<", "&lt;").replace(">", "&gt;")
-                    ),
-                    "created_at": row[6],
-                    "annotations": {},
-                }
-
-            if row[7] is not None:
-                current_run["annotations"][row[10]] = {
-                    "judgement": row[7],
-                    "notes": row[8],
-                    "timestamp": row[9],
-                }
-
-        if current_run is not None:
-            runs.append(current_run)
 
         queue["runs"] = runs
 
-        return queue, total_count
+        return queue, total_count, has_more
 
 
 @log_exceptions
@@ -580,8 +2034,6 @@ async def create_queue(
                 INSERT INTO {queue_runs_table_name} (queue_id, run_id)
                 SELECT ?, r.id
                 FROM {runs_table_name} r
-                LEFT JOIN {annotations_table_name} a ON r.id = a.run_id
-                LEFT JOIN {users_table_name} u ON a.user_id = u.id
             """
 
             # Build WHERE clause based on filters (same logic as fetch_all_runs)
@@ -604,10 +2056,7 @@ async def create_queue(
                 where_clause = " WHERE " + " AND ".join(where_conditions)
 
             # Execute the INSERT SELECT query
-            query = (
-                base_query + where_clause + " GROUP BY r.id"
-            )  # GROUP BY to avoid duplicates from JOINs
-            await cursor.execute(query, params)
+            await cursor.execute(base_query + where_clause, params)
 
         await conn.commit()
         return queue_id
@@ -790,24 +2239,22 @@ async def fetch_all_runs(
     user_email: str = None,
     task_title: str = None,
     question_title: str = None,
+    after: Tuple[str, int] = None,
+    before: Tuple[str, int] = None,
+    search: str = None,
 ):
     """
     Fetch runs from the database with their annotations, filtered by query parameters and paginated.
-    Returns a tuple: (runs, total_count)
+    Pages are selected by offset (page), or by keyset over (start_time, id) when an
+    after/before cursor is given, so that deep pages cost the same as the first one.
+    With a search, only the runs whose messages or annotation notes match it are returned,
+    ordered by relevance if sort_by is "relevance".
+    Returns a tuple: (runs, total_count, has_more), with has_more as returned by
+    fetch_runs_page
     """
-    async with get_new_db_connection() as conn:
+    async with get_new_db_connection(readonly=True) as conn:
         cursor = await conn.cursor()
 
-        # Build the base query
-        base_query = f"""
-            SELECT r.id, r.run_id, r.start_time, r.end_time, r.messages, r.metadata, r.created_at,
-                   a.judgement, a.notes, a.created_at as timestamp, u.name as username
-            FROM {runs_table_name} r
-            LEFT JOIN {annotations_table_name} a ON r.id = a.run_id
-            LEFT JOIN {users_table_name} u ON a.user_id = u.id
-        """
-        count_query = f"SELECT COUNT(DISTINCT r.id) FROM {runs_table_name} r LEFT JOIN {annotations_table_name} a ON r.id = a.run_id LEFT JOIN {users_table_name} u ON a.user_id = u.id"
-
         # Build WHERE clause based on filters
         where_conditions, params = build_run_filters(
             annotation_filter=annotation_filter,
@@ -822,75 +2269,141 @@ async def fetch_all_runs(
             user_email=user_email,
             task_title=task_title,
             question_title=question_title,
+            search=search,
         )
 
-        # Add WHERE clause if there are conditions
-        where_clause = ""
-        if where_conditions:
-            where_clause = " WHERE " + " AND ".join(where_conditions)
-
-        # Get total count for pagination
-        await cursor.execute(count_query + where_clause, params)
-        total_count = await cursor.fetchone()
-        total_count = total_count[0] if total_count else 0
-
-        # Build ORDER BY clause based on sort parameters
-        order_by_clause = ""
-        if sort_by == "timestamp":
-            # Use start_time for timestamp sorting
-            sort_column = "r.start_time"
-        else:
-            # Default to timestamp if unknown sort field
-            sort_column = "r.start_time"
-
-        # Ensure sort_order is either ASC or DESC
+        # Runs are sorted by timestamp (start_time) or, when searching, by relevance,
+        # with the id as a tie-breaker so that the order is stable for cursors
         sort_direction = "ASC" if sort_order.lower() == "asc" else "DESC"
-        order_by_clause = f" ORDER BY {sort_column} {sort_direction}"
 
-        # Add LIMIT, OFFSET for pagination
-        offset = (page - 1) * page_size
-        query = base_query + where_clause + order_by_clause + f" LIMIT ? OFFSET ?"
-        page_params = params + [page_size, offset]
+        return await fetch_runs_page(
+            cursor,
+            where_conditions,
+            params,
+            page=page,
+            page_size=page_size,
+            sort_direction=sort_direction,
+            after=after,
+            before=before,
+            annotation_match=build_annotation_filters(
+                annotation_filter, annotation_filter_user_id
+            ),
+            search=search,
+            order_by_rank=sort_by == "relevance",
+        )
 
-        # Execute query with parameters
-        await cursor.execute(query, page_params)
-        rows = await cursor.fetchall()
 
-        # Convert rows to list of dictionaries with annotations
-        runs = []
-        current_run = None
+async def iter_export_runs(
+    annotation_filter: str = None,
+    annotation_filter_user_id: int = None,
+    time_range: str = None,
+    org_ids: list = None,
+    course_ids: list = None,
+    run_type: list = None,
+    purpose: list = None,
+    question_type: list = None,
+    question_input_type: list = None,
+    sort_order: str = "desc",
+    user_email: str = None,
+    task_title: str = None,
+    question_title: str = None,
+    search: str = None,
+    chunk_size: int = 500,
+):
+    """
+    Iterate over every run matching the filters of fetch_all_runs, with its full
+    messages and metadata and its annotations, in chunks of chunk_size runs.
+
+    Chunks are read by keyset over (start_time, id), each on a connection held
+    only while the chunk is read, so that a slow consumer never keeps a pooled
+    connection and memory stays bounded by the chunk size however many runs
+    are exported. Unlike the API, the messages and metadata are not HTML-escaped.
+
+    Yields:
+        Lists of runs, as dictionaries with RawJSON messages and metadata
+    """
+    where_conditions, params = build_run_filters(
+        annotation_filter=annotation_filter,
+        annotation_filter_user_id=annotation_filter_user_id,
+        time_range=time_range,
+        org_ids=org_ids,
+        course_ids=course_ids,
+        run_type=run_type,
+        purpose=purpose,
+        question_type=question_type,
+        question_input_type=question_input_type,
+        user_email=user_email,
+        task_title=task_title,
+        question_title=question_title,
+        search=search,
+    )
+    annotation_match = build_annotation_filters(
+        annotation_filter, annotation_filter_user_id
+    )
+    sort_direction = "ASC" if sort_order.lower() == "asc" else "DESC"
+
+    last = None
+    while True:
+        cursor_conditions, cursor_params, _ = build_run_cursor_condition(
+            sort_direction, after=last
+        )
+        conditions = where_conditions + cursor_conditions
+        where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
+
+        async with get_new_db_connection(readonly=True) as conn:
+            cursor = await conn.cursor()
+            await cursor.execute(
+                f"""
+                SELECT r.id, r.run_id, r.start_time, r.end_time,
+                    decompress_text(r.messages), r.metadata, r.created_at, r.blob_refs
+                FROM {runs_table_name} r
+                {where_clause}
+                ORDER BY r.start_time {sort_direction}, r.id {sort_direction}
+                LIMIT ?
+                """,
+                params + cursor_params + [chunk_size],
+            )
+            rows = await cursor.fetchall()
+            if not rows:
+                return
+
+            blob_refs = {row[0]: json.loads(row[7]) for row in rows if row[7]}
+            blobs = await fetch_blobs(
+                cursor, [hash for refs in blob_refs.values() for hash in refs.values()]
+            )
+            annotations = await fetch_annotations_for_runs(
+                cursor, [row[0] for row in rows], annotation_match
+            )
 
+        runs = []
         for row in rows:
-            run_id = row[0]
-            # If this is a new run, create a new run entry
-            if current_run is None or current_run["id"] != run_id:
-                if current_run is not None:
-                    runs.append(current_run)
-                current_run = {
+            metadata = row[5] or "{}"
+            if row[0] in blob_refs:
+                metadata = set_raw_json_fields(
+                    metadata,
+                    {
+                        field: blobs[hash]
+                        for field, hash in blob_refs[row[0]].items()
+                        if hash in blobs
+                    },
+                )
+            runs.append(
+                {
                     "id": row[0],
                     "run_id": row[1],
                     "start_time": row[2],
                     "end_time": row[3],
-                    "messages": json.loads(
-                        row[4].replace("<", "&lt;").replace(">", "&gt;")
-                    ),
-                    "metadata": json.loads(
-                        row[5].replace("<", "&lt;").replace(">", "&gt;")
-                    ),
+                    "messages": RawJSON(row[4] or "[]"),
+                    "metadata": RawJSON(metadata),
                     "created_at": row[6],
-                    "annotations": {},
+                    "annotations": annotations[row[0]],
                 }
-            # Add annotation if it exists (username is not None)
-            if row[10] is not None:  # username is not None
-                current_run["annotations"][row[10]] = {
-                    "judgement": row[7],
-                    "notes": row[8],
-                    "timestamp": row[9],
-                }
-        # Add the last run
-        if current_run is not None:
-            runs.append(current_run)
-        return runs, total_count
+            )
+        yield runs
+
+        if len(rows) < chunk_size:
+            return
+        last = (rows[-1][2], rows[-1][0])
 
 
 @log_exceptions
@@ -901,7 +2414,7 @@ async def get_all_queues():
     Returns:
         List of dictionaries containing queue data with num_runs count
     """
-    async with get_new_db_connection() as conn:
+    async with get_new_db_connection(readonly=True) as conn:
         cursor = await conn.cursor()
 
         # Get all queues with their basic info and run count
@@ -934,7 +2447,7 @@ async def get_all_queues():
 
 
 async def get_all_users():
-    async with get_new_db_connection() as conn:
+    async with get_new_db_connection(readonly=True) as conn:
         cursor = await conn.cursor()
         await cursor.execute(f"""SELECT id, name FROM {users_table_name}""")
         rows = await cursor.fetchall()
@@ -943,57 +2456,30 @@ async def get_all_users():
 
 async def get_unique_orgs_and_courses():
     """
-    Fetch unique organization and course names and ids from the metadata of all runs.
+    Fetch unique organization and course names and ids from the orgs and courses
+    tables, which are filled in as runs are inserted.
     Returns:
         {
             "orgs": [{"id": ..., "name": ...}, ...],
             "courses": [{"id": ..., "name": ...}, ...]
         }
     """
-    async with get_new_db_connection() as conn:
+    async with get_new_db_connection(readonly=True) as conn:
         cursor = await conn.cursor()
-        await cursor.execute(f"SELECT metadata FROM {runs_table_name}")
-        rows = await cursor.fetchall()
-
-        orgs_set = set()
-        courses_set = set()
 
-        for row in rows:
-            metadata = row[0]
-            if not metadata:
-                continue
-            try:
-                # metadata may be a JSON string
-                meta = json.loads(metadata)
-            except Exception:
-                continue
-
-            org = meta.get("org")
-            if org and isinstance(org, dict):
-                org_id = org.get("id")
-                org_name = org.get("name")
-                if org_id is not None and org_name is not None:
-                    orgs_set.add((org_id, org_name))
-
-            course = meta.get("course")
-            if course and isinstance(course, dict):
-                course_id = course.get("id")
-                course_name = course.get("name")
-                if course_id is not None and course_name is not None:
-                    courses_set.add((course_id, course_name))
-
-        orgs = [
-            {"id": oid, "name": oname}
-            for oid, oname in sorted(orgs_set, key=lambda x: (str(x[1]).lower(), x[0]))
-        ]
-        courses = [
-            {"id": cid, "name": cname}
-            for cid, cname in sorted(
-                courses_set, key=lambda x: (str(x[1]).lower(), x[0])
+        result = {}
+        for key, table_name in [
+            ("orgs", orgs_table_name),
+            ("courses", courses_table_name),
+        ]:
+            await cursor.execute(
+                f"SELECT id, name FROM {table_name} ORDER BY name COLLATE NOCASE, id"
             )
-        ]
+            result[key] = [
+                {"id": row[0], "name": row[1]} for row in await cursor.fetchall()
+            ]
 
-        return {"orgs": orgs, "courses": courses}
+        return result
 
 
 async def create_user(name: str):
@@ -1009,8 +2495,44 @@ async def create_user(name: str):
         return cursor.lastrowid
 
 
-async def get_last_run_time():
+async def get_s3_sync_state():
+    """
+    Get the ETag and last modified time recorded for every S3 object synced so far.
+
+    Returns:
+        Dictionary mapping each key to {"etag": ..., "last_modified": ...}
+    """
+    async with get_new_db_connection(readonly=True) as conn:
+        cursor = await conn.cursor()
+        await cursor.execute(
+            f"SELECT key, etag, last_modified FROM {s3_sync_state_table_name}"
+        )
+        rows = await cursor.fetchall()
+        return {row[0]: {"etag": row[1], "last_modified": row[2]} for row in rows}
+
+
+async def set_s3_sync_state(key: str, etag: str, last_modified: str = None):
+    """
+    Record that an S3 object has been synced at the given version.
+    """
     async with get_new_db_connection() as conn:
+        cursor = await conn.cursor()
+        await cursor.execute(
+            f"""
+            INSERT INTO {s3_sync_state_table_name} (key, etag, last_modified)
+            VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                etag=excluded.etag,
+                last_modified=excluded.last_modified,
+                synced_at=CURRENT_TIMESTAMP
+            """,
+            (key, etag, last_modified),
+        )
+        await conn.commit()
+
+
+async def get_last_run_time():
+    async with get_new_db_connection(readonly=True) as conn:
         cursor = await conn.cursor()
         await cursor.execute(f"SELECT MAX(start_time) FROM {runs_table_name}")
         row = await cursor.fetchone()
@@ -1107,8 +2629,6 @@ async def update_queue(
                 INSERT INTO {queue_runs_table_name} (queue_id, run_id)
                 SELECT ?, r.id
                 FROM {runs_table_name} r
-                LEFT JOIN {annotations_table_name} a ON r.id = a.run_id
-                LEFT JOIN {users_table_name} u ON a.user_id = u.id
                 WHERE NOT EXISTS (
                     SELECT 1 FROM {queue_runs_table_name} qr 
                     WHERE qr.queue_id = ? AND qr.run_id = r.id
@@ -1137,10 +2657,7 @@ async def update_queue(
                 base_query += " AND " + " AND ".join(where_conditions)
 
             # Execute the INSERT SELECT query
-            query = (
-                base_query + " GROUP BY r.id"
-            )  # GROUP BY to avoid duplicates from JOINs
-            result = await cursor.execute(query, params)
+            result = await cursor.execute(base_query, params)
             runs_added = result.rowcount
 
         await conn.commit()
@@ -1148,93 +2665,35 @@ async def update_queue(
 
 
 async def get_metrics():
-    async with get_new_db_connection() as conn:
+    """
+    Get the overview metrics from the summary tables, which are kept up to date
+    on write, so the cost depends on the number of annotators and not on the
+    number of runs or annotations.
+    """
+    async with get_new_db_connection(readonly=True) as conn:
         cursor = await conn.cursor()
 
-        # Number of runs
-        await cursor.execute(f"SELECT COUNT(*) FROM {runs_table_name}")
-        num_runs = (await cursor.fetchone())[0]
-
-        # Number of unique users across all runs (from metadata->user_id)
-        await cursor.execute(f"SELECT metadata FROM {runs_table_name}")
-        rows = await cursor.fetchall()
-        user_ids = set()
-
-        for row in rows:
-            metadata = row[0]
-            if metadata:
-                try:
-                    meta = json.loads(metadata)
-                    user_id = meta.get("user_id")
-                    if user_id is not None:
-                        user_ids.add(user_id)
-                except Exception:
-                    continue
-
-        num_unique_users = len(user_ids)
-
-        # Get annotator-level metrics (this will be our primary query)
         await cursor.execute(
             f"""
-            SELECT user_id, judgement, COUNT(*) as count
-            FROM {annotations_table_name}
-            GROUP BY user_id, judgement
-        """
+            SELECT num_runs, num_learners, num_annotations, num_correct, num_wrong
+            FROM {metrics_totals_table_name} WHERE id = 1
+            """
         )
+        totals = await cursor.fetchone() or (0, 0, 0, 0, 0)
+        num_runs, num_unique_users, num_annotations, num_correct, num_wrong = totals
 
+        # Get annotator-level metrics along with the user names
+        await cursor.execute(
+            f"""
+            SELECT m.user_id, u.name, m.correct, m.wrong, m.total
+            FROM {metrics_annotators_table_name} m
+            LEFT JOIN {users_table_name} u ON m.user_id = u.id
+            WHERE m.total > 0
+            """
+        )
         annotator_rows = await cursor.fetchall()
 
-        # Process annotator data and aggregate totals
-        annotator_stats = {}
-        num_annotations = 0
-        num_correct = 0
-        num_wrong = 0
-
-        for user_id, judgement, count in annotator_rows:
-            if user_id not in annotator_stats:
-                annotator_stats[user_id] = {"correct": 0, "wrong": 0, "total": 0}
-
-            # Aggregate totals while processing annotator data
-            num_annotations += count
-
-            if str(judgement).lower() == "correct":
-                annotator_stats[user_id]["correct"] = count
-                num_correct += count
-            elif str(judgement).lower() == "wrong":
-                annotator_stats[user_id]["wrong"] = count
-                num_wrong += count
-
-            annotator_stats[user_id]["total"] += count
-
-        # Get user names from the users table
-        await cursor.execute(f"SELECT id, name FROM {users_table_name}")
-        user_name_rows = await cursor.fetchall()
-        user_id_to_name = {user_id: name for user_id, name in user_name_rows}
-
-        # Create leaderboard data with names and calculate accuracy
-        leaderboard = []
-        for user_id, stats in annotator_stats.items():
-            if stats["total"] > 0:  # Only include users with annotations
-                accuracy = (
-                    (stats["correct"] / stats["total"]) * 100
-                    if stats["total"] > 0
-                    else 0
-                )
-                leaderboard.append(
-                    {
-                        "user_id": user_id,
-                        "name": user_id_to_name.get(user_id, f"User {user_id}"),
-                        "total_annotations": stats["total"],
-                        "correct": stats["correct"],
-                        "wrong": stats["wrong"],
-                        "accuracy": round(accuracy, 1),
-                    }
-                )
-
-        # Sort by total annotations descending, then by accuracy descending
-        leaderboard.sort(
-            key=lambda x: (x["total_annotations"], x["accuracy"]), reverse=True
-        )
+        leaderboard = build_leaderboard(annotator_rows)
 
         return {
             "num_runs": num_runs,
@@ -1249,3 +2708,170 @@ async def get_metrics():
             ),
             "leaderboard": leaderboard,
         }
+
+
+def build_leaderboard(annotator_rows) -> list:
+    """
+    Build the annotation leaderboard from (user_id, name, correct, wrong, total)
+    rows, ranked by total annotations, then by accuracy.
+    """
+    leaderboard = []
+    for user_id, name, correct, wrong, total in annotator_rows:
+        if total <= 0:
+            continue
+
+        accuracy = (correct / total) * 100
+        leaderboard.append(
+            {
+                "user_id": user_id,
+                "name": name if name is not None else f"User {user_id}",
+                "total_annotations": total,
+                "correct": correct,
+                "wrong": wrong,
+                "accuracy": round(accuracy, 1),
+            }
+        )
+
+    # Sort by total annotations descending, then by accuracy descending
+    leaderboard.sort(
+        key=lambda x: (x["total_annotations"], x["accuracy"]), reverse=True
+    )
+    return leaderboard
+
+
+# Number of days in each bucket of the metric trends
+trend_bucket_days = {"day": 1, "week": 7}
+
+
+async def get_metric_trends(
+    granularity: str = "day", days: int = 90, end_date: date = None
+):
+    """
+    Get the daily or weekly time series of the runs started and the annotations
+    made (overall and by annotator), along with the leaderboard of the
+    annotators over the same window. They are read from the per-day summary
+    tables, one row per day (and annotator), and bucketed with NumPy, so the
+    cost depends on the length of the window and not on the number of runs or
+    annotations.
+
+    Args:
+        granularity: "day" or "week"; weeks start on Monday, so the first week
+            may start before the window (and the leaderboard only counts the
+            days in the window)
+        days: Number of days in the window, ending on end_date
+        end_date: Last day of the window (UTC), today by default
+
+    Returns:
+        Dictionary with the start date of each bucket, the series (lists with
+        one value per bucket) and the leaderboard
+    """
+    if granularity not in trend_bucket_days:
+        raise ValueError(f"Invalid granularity: {granularity}")
+    if days < 1:
+        raise ValueError("The window must be at least one day long")
+
+    end_date = end_date or datetime.now(timezone.utc).date()
+    start_date = end_date - timedelta(days=days - 1)
+    bucket_days = trend_bucket_days[granularity]
+    first_day = start_date - timedelta(days=start_date.weekday() % bucket_days)
+    num_buckets = (end_date - first_day).days // bucket_days + 1
+
+    async with get_new_db_connection(readonly=True) as conn:
+        cursor = await conn.cursor()
+
+        await cursor.execute(
+            f"""
+            SELECT day, num_runs FROM {metrics_daily_runs_table_name}
+            WHERE day >= ? AND day <= ?
+            """,
+            (first_day.isoformat(), end_date.isoformat()),
+        )
+        run_rows = await cursor.fetchall()
+
+        await cursor.execute(
+            f"""
+            SELECT day, user_id, correct, wrong, total
+            FROM {metrics_daily_annotators_table_name}
+            WHERE day >= ? AND day <= ? AND total > 0
+            """,
+            (first_day.isoformat(), end_date.isoformat()),
+        )
+        annotator_rows = await cursor.fetchall()
+
+        await cursor.execute(f"SELECT id, name FROM {users_table_name}")
+        user_names = dict(await cursor.fetchall())
+
+    def get_day_offsets(rows):
+        day_values = np.array([row[0] for row in rows], dtype="datetime64[D]")
+        return (day_values - np.datetime64(first_day)).astype(np.int64)
+
+    runs = np.bincount(
+        get_day_offsets(run_rows) // bucket_days,
+        weights=[row[1] for row in run_rows],
+        minlength=num_buckets,
+    )
+
+    day_offsets = get_day_offsets(annotator_rows)
+    buckets = day_offsets // bucket_days
+    user_ids, user_index = np.unique(
+        np.array([row[1] for row in annotator_rows], dtype=np.int64),
+        return_inverse=True,
+    )
+    counts = np.array([row[2:] for row in annotator_rows], dtype=np.int64).reshape(
+        -1, 3
+    )
+
+    # (annotator, bucket, [correct, wrong, total]) counts
+    annotator_counts = np.zeros((len(user_ids), num_buckets, 3), dtype=np.int64)
+    np.add.at(annotator_counts, (user_index, buckets), counts)
+    correct, wrong, total = annotator_counts.sum(axis=0).T
+
+    # The leaderboard only counts the days in the window
+    in_window = day_offsets >= (start_date - first_day).days
+    window_counts = np.zeros((len(user_ids), 3), dtype=np.int64)
+    np.add.at(window_counts, user_index[in_window], counts[in_window])
+
+    accuracy = np.round(
+        np.divide(correct * 100, total, out=np.zeros(num_buckets), where=total > 0), 1
+    )
+
+    annotators = [
+        {
+            "user_id": int(user_id),
+            "name": user_names.get(user_id, f"User {user_id}"),
+            "total": annotator_counts[i, :, 2].tolist(),
+            "correct": annotator_counts[i, :, 0].tolist(),
+            "wrong": annotator_counts[i, :, 1].tolist(),
+        }
+        for i, user_id in enumerate(user_ids.tolist())
+    ]
+    annotators.sort(key=lambda annotator: sum(annotator["total"]), reverse=True)
+
+    return {
+        "granularity": granularity,
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "buckets": [
+            (first_day + timedelta(days=i * bucket_days)).isoformat()
+            for i in range(num_buckets)
+        ],
+        "runs": runs.astype(np.int64).tolist(),
+        "annotations": {
+            "total": total.tolist(),
+            "correct": correct.tolist(),
+            "wrong": wrong.tolist(),
+            "accuracy": [
+                value if count > 0 else None
+                for value, count in zip(accuracy.tolist(), total.tolist())
+            ],
+        },
+        "annotators": annotators,
+        "leaderboard": build_leaderboard(
+            (
+                user_id,
+                user_names.get(user_id),
+                *window_counts[i].tolist(),
+            )
+            for i, user_id in enumerate(user_ids.tolist())
+        ),
+    }
@@ -0,0 +1,282 @@
+import numpy as np
+from typing import Optional
+from .config import (
+    annotations_table_name,
+    queues_table_name,
+    queue_runs_table_name,
+    users_table_name,
+)
+from . import get_new_db_connection
+
+
+# The judgements the app gives, coded without first reading all the distinct ones
+judgement_categories = ["correct", "wrong"]
+
+
+async def load_judgements(cursor, queue_id: int = None):
+    """
+    Load the annotations as integer-coded arrays, keeping only the runs judged
+    by at least two annotators, since agreement can only be measured on those.
+
+    Returns:
+        Tuple of (run_ids, user_ids, codes, categories), where codes index into
+        the list of distinct judgements in categories
+    """
+    categories = list(judgement_categories)
+    run_ids, user_ids, codes = await load_coded_judgements(cursor, categories, queue_id)
+    if (codes >= 0).all():
+        return run_ids, user_ids, codes, categories
+
+    # Other judgements were given, so they get their own codes
+    placeholders = ", ".join("?" for _ in categories)
+    await cursor.execute(
+        f"""
+        SELECT DISTINCT LOWER(judgement) FROM {annotations_table_name}
+        WHERE LOWER(judgement) NOT IN ({placeholders}) ORDER BY 1
+        """,
+        categories,
+    )
+    categories += [row[0] for row in await cursor.fetchall()]
+    run_ids, user_ids, codes = await load_coded_judgements(cursor, categories, queue_id)
+
+    # Judgements added since the categories were read
+    known = codes >= 0
+    return run_ids[known], user_ids[known], codes[known], categories
+
+
+async def load_coded_judgements(cursor, categories: list[str], queue_id: int = None):
+    """
+    Load the run, annotator and judgement of the annotations of the runs judged
+    more than once, with each judgement coded by its index in categories, or -1
+    if it is not in them.
+    """
+    # Judgements are coded by SQLite, so that only integers are sent back
+    code = " ".join(f"WHEN ? THEN {index}" for index in range(len(categories)))
+    params = list(categories)
+
+    queue_condition = ""
+    if queue_id is not None:
+        queue_condition = f"AND a.run_id IN (SELECT run_id FROM {queue_runs_table_name} WHERE queue_id = ?)"
+        params.append(queue_id)
+
+    # Each column is sent back as one comma-separated string, which NumPy
+    # parses much faster than Python builds one tuple per annotation
+    await cursor.execute(
+        f"""
+        SELECT GROUP_CONCAT(a.run_id), GROUP_CONCAT(a.user_id),
+            GROUP_CONCAT(CASE LOWER(a.judgement) {code} ELSE -1 END)
+        FROM {annotations_table_name} a
+        WHERE a.run_id IN (
+            SELECT run_id FROM {annotations_table_name}
+            GROUP BY run_id HAVING COUNT(*) > 1
+        ) {queue_condition}
+        """,
+        params,
+    )
+    return [
+        np.fromstring(column or "", dtype=np.int64, sep=",")
+        for column in await cursor.fetchone()
+    ]
+
+
+def pairwise_cohen_kappa(judgements: np.ndarray, num_categories: int):
+    """
+    Cohen's kappa between every pair of annotators, over the runs they both
+    judged, from a (runs, annotators) matrix of codes with -1 where an
+    annotator did not judge a run. Every count is a product of the one-hot
+    (runs, annotators) matrices of each judgement, so no pair is looped over.
+
+    Returns:
+        Tuple of (annotators, annotators) matrices of the number of runs both
+        judged, the observed agreement and kappa, which is NaN where it is
+        undefined (no runs, or both annotators always gave the same judgement)
+    """
+    judged = (judgements >= 0).astype(np.float64)
+    num_runs = judged.T @ judged
+
+    agreements = np.zeros_like(num_runs)
+    expected = np.zeros_like(num_runs)
+    for category in range(num_categories):
+        chosen = (judgements == category).astype(np.float64)
+        agreements += chosen.T @ chosen
+        # [i, j] is the number of runs judged by j on which i chose the category
+        marginals = chosen.T @ judged
+        expected += marginals * marginals.T
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        observed = agreements / num_runs
+        expected /= num_runs**2
+        kappa = np.where(expected < 1, (observed - expected) / (1 - expected), np.nan)
+    return num_runs.astype(np.int64), observed, kappa
+
+
+def fleiss_kappa(counts: np.ndarray):
+    """
+    Fleiss' kappa from a (runs, categories) matrix of the number of annotators
+    who gave each judgement to each run, in its form for a number of annotators
+    that varies across runs. Every run must have at least two judgements.
+    """
+    if len(counts) == 0:
+        return None
+
+    num_raters = counts.sum(axis=1)
+    per_run = ((counts * (counts - 1)).sum(axis=1)) / (num_raters * (num_raters - 1))
+    observed = per_run.mean()
+
+    proportions = counts.sum(axis=0) / num_raters.sum()
+    expected = np.dot(proportions, proportions)
+    if expected >= 1:
+        return None
+    return float((observed - expected) / (1 - expected))
+
+
+def compute_agreement(
+    run_ids: np.ndarray,
+    user_ids: np.ndarray,
+    codes: np.ndarray,
+    categories: list[str],
+    user_names: dict,
+    max_disagreements: int = 0,
+):
+    """
+    Compute the agreement between annotators over the runs judged by at least
+    two of them: the pairwise Cohen's kappa of every pair of annotators who
+    judged the same runs, Fleiss' kappa over all the annotators, and the runs
+    they disagree on (the first max_disagreements of them, latest first).
+    """
+    num_categories = max(len(categories), 1)
+    runs, run_index = np.unique(run_ids, return_inverse=True)
+    users, user_index = np.unique(user_ids, return_inverse=True)
+
+    # (run, annotator) matrix of the codes, -1 where the annotator did not judge the run
+    judgements = np.full((len(runs), len(users)), -1, dtype=np.int16)
+    judgements[run_index, user_index] = codes
+
+    # (run, category) matrix of the number of annotators who gave each judgement
+    counts = np.bincount(
+        run_index * num_categories + codes, minlength=len(runs) * num_categories
+    ).reshape(len(runs), num_categories)
+    # Runs are loaded with at least two judgements, which a queue may not keep
+    multiple = counts.sum(axis=1) > 1
+    counts = counts[multiple]
+    is_disagreement = (counts > 0).sum(axis=1) > 1
+
+    num_runs, observed, kappa = pairwise_cohen_kappa(judgements, num_categories)
+    pairwise = []
+    for i, j in zip(*np.triu_indices(len(users), k=1)):
+        if num_runs[i, j] == 0:
+            continue
+
+        pairwise.append(
+            {
+                "user_ids": [int(users[i]), int(users[j])],
+                "annotators": [
+                    user_names.get(int(users[i]), f"User {users[i]}"),
+                    user_names.get(int(users[j]), f"User {users[j]}"),
+                ],
+                "num_runs": int(num_runs[i, j]),
+                "observed_agreement": round(float(observed[i, j]), 4),
+                "cohen_kappa": (
+                    None if np.isnan(kappa[i, j]) else round(float(kappa[i, j]), 4)
+                ),
+            }
+        )
+    pairwise.sort(key=lambda pair: pair["num_runs"], reverse=True)
+
+    kappa = fleiss_kappa(counts)
+    result = {
+        "num_annotations": int((judgements[multiple] >= 0).sum()),
+        "num_runs": int(multiple.sum()),
+        "num_annotators": len(users),
+        "categories": categories,
+        "percent_agreement": (
+            round(float(1 - is_disagreement.mean()) * 100, 2) if len(counts) else None
+        ),
+        "fleiss_kappa": None if kappa is None else round(kappa, 4),
+        "pairwise": pairwise,
+        "num_disagreements": int(is_disagreement.sum()),
+    }
+
+    if max_disagreements:
+        disagreement_rows = np.flatnonzero(multiple)[is_disagreement][::-1]
+        disagreements = []
+        for row in disagreement_rows[:max_disagreements]:
+            annotated = np.flatnonzero(judgements[row] >= 0)
+            disagreements.append(
+                {
+                    "run_id": int(runs[row]),
+                    "judgements": {
+                        user_names.get(
+                            int(users[column]), f"User {users[column]}"
+                        ): categories[judgements[row, column]]
+                        for column in annotated
+                    },
+                }
+            )
+        result["disagreements"] = disagreements
+
+    return result
+
+
+async def get_agreement(queue_id: Optional[int] = None, max_disagreements: int = 100):
+    """
+    Get the agreement between annotators, over all the annotations or those of
+    the runs of a queue, with the runs they disagree on. Without a queue, the
+    agreement within each queue is also returned, without its disagreements.
+
+    Only (run_id, user_id, judgement) triples of the runs judged more than once
+    are loaded, as integer arrays, so this scales to hundreds of thousands of
+    annotations without reading the runs themselves.
+    """
+    async with get_new_db_connection(readonly=True) as conn:
+        cursor = await conn.cursor()
+        return await get_agreement_on_cursor(cursor, queue_id, max_disagreements)
+
+
+async def get_agreement_on_cursor(
+    cursor, queue_id: Optional[int], max_disagreements: int
+):
+    await cursor.execute(f"SELECT id, name FROM {users_table_name}")
+    user_names = dict(await cursor.fetchall())
+
+    run_ids, user_ids, codes, categories = await load_judgements(cursor, queue_id)
+    result = compute_agreement(
+        run_ids, user_ids, codes, categories, user_names, max_disagreements
+    )
+    if queue_id is not None:
+        return result
+
+    # The agreement within each queue is computed from the same arrays
+    await cursor.execute(
+        f"""
+        SELECT qr.queue_id, qr.run_id FROM {queue_runs_table_name} qr
+        WHERE qr.run_id IN (
+            SELECT run_id FROM {annotations_table_name}
+            GROUP BY run_id HAVING COUNT(*) > 1
+        )
+        """
+    )
+    queue_runs = np.array(await cursor.fetchall(), dtype=np.int64).reshape(-1, 2)
+    await cursor.execute(f"SELECT id, name FROM {queues_table_name}")
+    queue_names = dict(await cursor.fetchall())
+
+    queues = []
+    for queue in np.unique(queue_runs[:, 0]).tolist():
+        in_queue = np.isin(run_ids, queue_runs[queue_runs[:, 0] == queue, 1])
+        queues.append(
+            {
+                "queue_id": queue,
+                "name": queue_names.get(queue),
+                **compute_agreement(
+                    run_ids[in_queue],
+                    user_ids[in_queue],
+                    codes[in_queue],
+                    categories,
+                    user_names,
+                ),
+            }
+        )
+    queues.sort(key=lambda queue: queue["num_runs"], reverse=True)
+    result["queues"] = queues
+
+    return result
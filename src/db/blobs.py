@@ -0,0 +1,97 @@
+import hashlib
+from collections import OrderedDict
+from .config import blobs_table_name, blob_cache_size_mb
+
+
+def content_hash(text: str):
+    """
+    Hash identifying a blob by its content, so that identical contexts are
+    stored once.
+    """
+    if not isinstance(text, str):
+        return text
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# SQL functions registered on every connection, used to write blobs at ingest
+sql_functions = [("content_hash", 1, content_hash, True)]
+
+
+class BlobCache:
+    """
+    In-memory LRU cache of the decompressed text of blobs, bounded by the total
+    size of the cached text. Blobs are immutable (keyed by the hash of their
+    content), so cached entries never need to be invalidated.
+    """
+
+    def __init__(self, max_size_mb: float = blob_cache_size_mb):
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self._entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, hash: str):
+        text = self._entries.get(hash)
+        if text is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(hash)
+        self.hits += 1
+        return text
+
+    def put(self, hash: str, text: str):
+        if hash in self._entries or len(text) > self.max_size:
+            return
+
+        self._entries[hash] = text
+        self.size += len(text)
+        while self.size > self.max_size:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "size_mb": round(self.size / 1024 / 1024, 3),
+            "max_size_mb": round(self.max_size / 1024 / 1024, 3),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0,
+        }
+
+
+blob_cache = BlobCache()
+
+
+async def fetch_blobs(cursor, hashes) -> dict:
+    """
+    Get the text of blobs by their hash, from the cache when possible.
+
+    Returns:
+        Dictionary mapping each hash found to the text of its blob
+    """
+    blobs = {}
+    missing = []
+    for hash in set(hashes):
+        text = blob_cache.get(hash)
+        if text is None:
+            missing.append(hash)
+        else:
+            blobs[hash] = text
+
+    if missing:
+        await cursor.execute(
+            f"""
+            SELECT hash, decompress_text(data) FROM {blobs_table_name}
+            WHERE hash IN ({",".join(["?"] * len(missing))})
+            """,
+            missing,
+        )
+        for hash, text in await cursor.fetchall():
+            blob_cache.put(hash, text)
+            blobs[hash] = text
+
+    return blobs
@@ -0,0 +1,182 @@
+import time
+import aiosqlite
+from .config import (
+    sqlite_db_path,
+    runs_table_name,
+    bulk_load_chunk_size,
+    bulk_load_cache_size_kb,
+)
+from .pool import apply_connection_pragmas
+from . import get_new_db_connection, write_runs
+
+
+class RunsBulkLoader:
+    """
+    Loads a large number of runs in chunks, committing each chunk in its own
+    transaction so that the WAL stays bounded and a failure only loses the
+    chunk in progress.
+
+    The loader uses its own connection with relaxed durability and a larger
+    cache for the duration of the load, and checkpoints the WAL after every
+    chunk. With rebuild_indexes, the secondary indexes on runs are dropped
+    before the load and recreated in one pass at the end, which is much faster
+    than maintaining them row by row when backfilling many runs; readers see
+    slow queries in the meantime, so this is meant for offline backfills.
+
+    With pooled, as when runs are synced inside the app, each chunk is instead
+    written through the pooled writer connection, which is only held for that
+    chunk so that the app's own writes are not blocked for the whole load.
+
+    A summary with the throughput is printed at the end of the load, and with
+    verbose also after every chunk.
+
+    Usage:
+        async with RunsBulkLoader() as loader:
+            await loader.add(runs)
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = bulk_load_chunk_size,
+        update_existing: bool = True,
+        rebuild_indexes: bool = False,
+        checkpoint_mode: str = "PASSIVE",
+        verbose: bool = True,
+        pooled: bool = False,
+    ):
+        if pooled and rebuild_indexes:
+            raise ValueError("Indexes cannot be rebuilt by a pooled load")
+
+        self.chunk_size = chunk_size
+        self.update_existing = update_existing
+        self.rebuild_indexes = rebuild_indexes
+        self.checkpoint_mode = checkpoint_mode
+        self.verbose = verbose
+        self.pooled = pooled
+
+        self.conn = None
+        self.dropped_indexes = []
+        self.pending = []
+        self.num_rows = 0
+        self.num_changed = 0
+        self.num_chunks = 0
+        self.start_time = None
+
+    async def __aenter__(self):
+        if self.pooled:
+            self.start_time = time.perf_counter()
+            return self
+
+        self.conn = await aiosqlite.connect(sqlite_db_path)
+        await apply_connection_pragmas(self.conn)
+
+        # Losing the last chunks on a power failure is acceptable for a load
+        # that can be rerun (runs are upserted); the database is never corrupted
+        await self.conn.execute("PRAGMA synchronous=OFF;")
+        await self.conn.execute(f"PRAGMA cache_size=-{bulk_load_cache_size_kb};")
+        # The WAL is checkpointed explicitly after every chunk instead
+        await self.conn.execute("PRAGMA wal_autocheckpoint=0;")
+
+        if self.rebuild_indexes:
+            await self._drop_indexes()
+
+        self.start_time = time.perf_counter()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                await self.flush()
+        finally:
+            if self.conn is not None:
+                await self._close()
+
+        if exc_type is None:
+            elapsed = time.perf_counter() - self.start_time
+            print(
+                f"Bulk loaded {self.num_rows} runs ({self.num_changed} added or "
+                f"updated) in {self.num_chunks} chunks and {elapsed:.1f}s "
+                f"({self.num_rows / elapsed if elapsed else 0:.0f} rows/sec)"
+            )
+
+    async def _close(self):
+        try:
+            if self.dropped_indexes:
+                await self._recreate_indexes()
+            await self.conn.execute("PRAGMA wal_checkpoint(PASSIVE);")
+        finally:
+            await self.conn.close()
+            self.conn = None
+
+    async def _drop_indexes(self):
+        # The unique index on run_id is kept since the upsert relies on it
+        cursor = await self.conn.execute(
+            """
+            SELECT name, sql FROM sqlite_master
+            WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL
+            AND sql NOT LIKE 'CREATE UNIQUE%'
+            """,
+            (runs_table_name,),
+        )
+        self.dropped_indexes = await cursor.fetchall()
+
+        for name, _ in self.dropped_indexes:
+            await self.conn.execute(f"DROP INDEX {name}")
+        await self.conn.commit()
+
+    async def _recreate_indexes(self):
+        start = time.perf_counter()
+        for _, sql in self.dropped_indexes:
+            await self.conn.execute(sql)
+        await self.conn.commit()
+        self.dropped_indexes = []
+
+        if self.verbose:
+            print(
+                f"Rebuilt indexes on {runs_table_name} in {time.perf_counter() - start:.1f}s"
+            )
+
+    async def add(self, runs: list[tuple]):
+        """
+        Queue runs for loading, writing out every full chunk.
+
+        Args:
+            runs: (run_id, start_time, end_time, messages, metadata) tuples
+        """
+        self.pending.extend(runs)
+        while len(self.pending) >= self.chunk_size:
+            chunk = self.pending[: self.chunk_size]
+            self.pending = self.pending[self.chunk_size :]
+            await self._write_chunk(chunk)
+
+    async def flush(self):
+        """
+        Write out the runs queued so far, so that they are committed.
+        """
+        if self.pending:
+            chunk, self.pending = self.pending, []
+            await self._write_chunk(chunk)
+
+    async def _write_chunk(self, chunk: list[tuple]):
+        start = time.perf_counter()
+
+        if self.pooled:
+            async with get_new_db_connection() as conn:
+                num_changed = await write_runs(conn, chunk, self.update_existing)
+                await conn.commit()
+        else:
+            num_changed = await write_runs(self.conn, chunk, self.update_existing)
+            await self.conn.commit()
+            await self.conn.execute(f"PRAGMA wal_checkpoint({self.checkpoint_mode});")
+
+        self.num_rows += len(chunk)
+        self.num_changed += num_changed
+        self.num_chunks += 1
+
+        if self.verbose:
+            elapsed = time.perf_counter() - start
+            print(
+                f"Chunk {self.num_chunks}: {len(chunk)} runs in {elapsed:.2f}s "
+                f"({len(chunk) / elapsed if elapsed else 0:.0f} rows/sec), "
+                f"{self.num_rows} runs so far"
+            )
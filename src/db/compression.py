@@ -0,0 +1,233 @@
+import sqlite3
+import struct
+import zlib
+from collections import Counter
+from .config import (
+    sqlite_db_path,
+    runs_compression,
+    runs_compression_level,
+    compression_dictionaries_table_name,
+)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Compressed values are stored as BLOBs starting with a NUL byte, the codec and
+# the id of the dictionary they were compressed with (0 for none), so that they
+# can never be confused with the JSON TEXT of uncompressed rows
+header = struct.Struct(">ccI")
+codec_ids = {"zlib": b"z", "zstd": b"s"}
+codec_names = {value: key for key, value in codec_ids.items()}
+
+# zlib only uses the last 32KB of a preset dictionary
+dictionary_sizes = {"zlib": 32 * 1024, "zstd": 112 * 1024}
+
+# Dictionaries by id as (codec, data), and the id of the latest dictionary of
+# each codec, loaded from the database when first needed
+_dictionaries = {}
+_latest_dictionary_ids = {}
+_dictionaries_loaded = False
+_zstd_cache = {}
+
+
+def check_codec(codec: str):
+    if codec not in codec_ids:
+        raise ValueError(f"Unknown compression codec: {codec}")
+    if codec == "zstd" and zstandard is None:
+        raise RuntimeError("zstd compression requires the zstandard package")
+
+
+def load_dictionaries(force: bool = False):
+    """
+    Load the compression dictionaries from the database into memory.
+    """
+    global _dictionaries, _latest_dictionary_ids, _dictionaries_loaded
+
+    if _dictionaries_loaded and not force:
+        return
+
+    conn = sqlite3.connect(sqlite_db_path)
+    try:
+        table_exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+            (compression_dictionaries_table_name,),
+        ).fetchone()
+
+        rows = []
+        if table_exists:
+            rows = conn.execute(
+                f"SELECT id, codec, data FROM {compression_dictionaries_table_name} ORDER BY id"
+            ).fetchall()
+    finally:
+        conn.close()
+
+    dictionaries = {}
+    latest_dictionary_ids = {}
+    for dictionary_id, codec, data in rows:
+        dictionaries[dictionary_id] = (codec, data)
+        latest_dictionary_ids[codec] = dictionary_id
+
+    # Swapped in rather than refilled, since connections on other threads may
+    # be reading them. Dictionaries are never changed once saved, so the zstd
+    # objects cached for them stay valid
+    _dictionaries = dictionaries
+    _latest_dictionary_ids = latest_dictionary_ids
+    _dictionaries_loaded = True
+
+
+def get_dictionary(dictionary_id: int) -> bytes:
+    dictionary = _dictionaries.get(dictionary_id)
+    if dictionary is None:
+        # The dictionary may have been trained after they were loaded
+        load_dictionaries(force=True)
+        dictionary = _dictionaries.get(dictionary_id)
+    if dictionary is None:
+        raise ValueError(f"Unknown compression dictionary: {dictionary_id}")
+    return dictionary[1]
+
+
+def _get_zstd(kind: str, dictionary_id: int):
+    key = (kind, dictionary_id)
+    if key not in _zstd_cache:
+        dictionary = None
+        if dictionary_id:
+            dictionary = zstandard.ZstdCompressionDict(get_dictionary(dictionary_id))
+
+        if kind == "compressor":
+            _zstd_cache[key] = zstandard.ZstdCompressor(
+                level=runs_compression_level, dict_data=dictionary
+            )
+        else:
+            _zstd_cache[key] = zstandard.ZstdDecompressor(dict_data=dictionary)
+    return _zstd_cache[key]
+
+
+def compress_text(text: str, codec: str = None):
+    """
+    Compress a text value with the given codec (the configured one by default),
+    using the latest dictionary trained for that codec, if any.
+
+    Returns:
+        The compressed BLOB, or the value itself if compression is disabled, if
+        it is already compressed or if compressing it does not make it smaller
+    """
+    codec = codec or runs_compression
+    if not isinstance(text, str) or codec == "none":
+        return text
+
+    check_codec(codec)
+    load_dictionaries()
+    dictionary_id = _latest_dictionary_ids.get(codec, 0)
+
+    data = text.encode("utf-8")
+    if codec == "zlib":
+        if dictionary_id:
+            compressor = zlib.compressobj(
+                runs_compression_level, zdict=get_dictionary(dictionary_id)
+            )
+        else:
+            compressor = zlib.compressobj(runs_compression_level)
+        payload = compressor.compress(data) + compressor.flush()
+    else:
+        payload = _get_zstd("compressor", dictionary_id).compress(data)
+
+    if header.size + len(payload) >= len(data):
+        return text
+
+    return header.pack(b"\x00", codec_ids[codec], dictionary_id) + payload
+
+
+def decompress_text(value):
+    """
+    Get back the text of a value written by compress_text. Text values (rows
+    that were not compressed) are returned as they are.
+    """
+    if not isinstance(value, bytes):
+        return value
+
+    _, codec_id, dictionary_id = header.unpack_from(value)
+    codec = codec_names[codec_id]
+    check_codec(codec)
+    payload = value[header.size :]
+
+    if codec == "zlib":
+        if dictionary_id:
+            decompressor = zlib.decompressobj(zdict=get_dictionary(dictionary_id))
+        else:
+            decompressor = zlib.decompressobj()
+        data = decompressor.decompress(payload) + decompressor.flush()
+    else:
+        data = _get_zstd("decompressor", dictionary_id).decompress(payload)
+
+    return data.decode("utf-8")
+
+
+def sql_compress_text(text, codec=None):
+    return compress_text(text, codec)
+
+
+# SQL functions registered on every connection, so that triggers and queries
+# can read and write compressed columns: compress_text(text[, codec]) and
+# decompress_text(value)
+sql_functions = [
+    ("compress_text", -1, sql_compress_text, False),
+    ("decompress_text", 1, decompress_text, True),
+]
+
+
+def train_dictionary(samples: list, codec: str) -> bytes:
+    """
+    Build a compression dictionary from sample texts (e.g. messages and
+    contexts), capturing the boilerplate they share.
+
+    zstd trains its own dictionary. For zlib, which uses a preset dictionary as
+    if it preceded the data, the dictionary is made of the lines that repeat
+    most across the samples, the most common ones last since zlib references
+    recent data more cheaply.
+    """
+    check_codec(codec)
+    size = dictionary_sizes[codec]
+
+    if codec == "zstd":
+        encoded = [sample.encode("utf-8") for sample in samples if sample]
+        return zstandard.train_dictionary(size, encoded).as_bytes()
+
+    line_counts = Counter()
+    for sample in samples:
+        if sample:
+            # Count each line once per sample, so that a single long
+            # conversation does not dominate
+            line_counts.update(set(sample.splitlines()))
+
+    lines = []
+    total_size = 0
+    for line, count in line_counts.most_common():
+        if count < 2:
+            break
+        encoded = line.encode("utf-8") + b"\n"
+        if total_size + len(encoded) > size:
+            continue
+        lines.append(encoded)
+        total_size += len(encoded)
+
+    return b"".join(reversed(lines))
+
+
+def save_dictionary(conn: sqlite3.Connection, codec: str, data: bytes) -> int:
+    """
+    Store a dictionary, which becomes the one used to compress new values with
+    its codec.
+
+    Returns:
+        The id of the dictionary
+    """
+    cursor = conn.execute(
+        f"INSERT INTO {compression_dictionaries_table_name} (codec, data) VALUES (?, ?)",
+        (codec, data),
+    )
+    conn.commit()
+    load_dictionaries(force=True)
+    return cursor.lastrowid
@@ -12,11 +12,58 @@ if not exists(data_root_dir):
     os.makedirs(data_root_dir)
 
 
-sqlite_db_path = f"{data_root_dir}/db.evals.sqlite"
-users_json_path = f"{data_root_dir}/users.json"
+# Can be pointed at another database, e.g. the synthetic ones of the benchmarks
+sqlite_db_path = os.getenv("SQLITE_DB_PATH", f"{data_root_dir}/db.evals.sqlite")
+users_json_path = os.getenv("USERS_JSON_PATH", f"{data_root_dir}/users.json")
 
 runs_table_name = "runs"
 queues_table_name = "queues"
 annotations_table_name = "annotations"
 users_table_name = "users"
 queue_runs_table_name = "queue_runs"
+s3_sync_state_table_name = "s3_sync_state"
+
+# Summary tables kept up to date by triggers, read by get_metrics
+metrics_totals_table_name = "metrics_totals"
+metrics_learners_table_name = "metrics_learners"
+metrics_annotators_table_name = "metrics_annotators"
+
+# Per-day summary tables, kept up to date by triggers, read by get_metric_trends
+metrics_daily_runs_table_name = "metrics_daily_runs"
+metrics_daily_annotators_table_name = "metrics_daily_annotators"
+
+# Dimension tables listing the orgs and courses seen in runs, used by the filters
+orgs_table_name = "orgs"
+courses_table_name = "courses"
+
+# Number of writes to each table, kept up to date by triggers, used to tell
+# whether the responses of the API may have changed
+write_counters_table_name = "write_counters"
+
+# Full-text index over the messages of every run and the notes of its annotations
+runs_search_table_name = "runs_search"
+
+# Connection pool settings (used by the app process; scripts such as cron.py
+# fall back to one connection per call when the pool is not started)
+sqlite_pool_size = int(os.getenv("SQLITE_POOL_SIZE", 4))
+sqlite_cache_size_kb = int(os.getenv("SQLITE_CACHE_SIZE_KB", 64 * 1024))
+sqlite_mmap_size = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+sqlite_busy_timeout_ms = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+
+# Bulk load settings, used when backfilling runs in chunks
+bulk_load_chunk_size = int(os.getenv("BULK_LOAD_CHUNK_SIZE", 5000))
+bulk_load_cache_size_kb = int(os.getenv("BULK_LOAD_CACHE_SIZE_KB", 256 * 1024))
+
+# Compression of the messages of runs and of blobs: "none", "zlib" or "zstd"
+# (zstd requires the zstandard package). Rows written with any codec can always
+# be read back, whatever the current setting.
+runs_compression = os.getenv("RUNS_COMPRESSION", "none").lower()
+runs_compression_level = int(os.getenv("RUNS_COMPRESSION_LEVEL", 6))
+compression_dictionaries_table_name = "compression_dictionaries"
+
+# Large metadata values repeated across runs (such as the context) are stored
+# once in the blobs table, keyed by the hash of their content, and referenced
+# from the runs; values shorter than this many characters are kept inline
+blobs_table_name = "blobs"
+run_blob_min_size = int(os.getenv("RUN_BLOB_MIN_SIZE", 256))
+blob_cache_size_mb = float(os.getenv("BLOB_CACHE_SIZE_MB", 64))
@@ -0,0 +1,347 @@
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from collections import deque
+from datetime import datetime, timezone
+from functools import lru_cache
+import json
+import os
+import re
+import sys
+import time
+from .config import data_root_dir
+
+# Off by default; can also be turned on and off at /api/debug/queries
+sql_instrumentation_enabled = os.getenv("SQL_INSTRUMENTATION", "0") == "1"
+# Statements taking longer than this, including fetching their rows, are logged
+slow_query_ms = float(os.getenv("SQL_SLOW_QUERY_MS", 100))
+slow_query_log_path = os.getenv(
+    "SQL_SLOW_QUERY_LOG", f"{data_root_dir}/slow_queries.log"
+)
+# Number of the latest slow queries kept in memory
+slow_query_history_size = 50
+
+# Frames of these modules are skipped when looking for the caller of a statement
+skipped_caller_modules = ("aiosqlite", "contextlib", "asyncio", __name__)
+
+whitespace_pattern = re.compile(r"\s+")
+literal_pattern = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+placeholder_list_pattern = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+@lru_cache(maxsize=4096)
+def normalize_sql(sql: str) -> str:
+    """
+    Normalize a statement so that the ones differing only in their values are
+    counted together: whitespace is collapsed, string and number literals
+    (which the queries built with f-strings embed) become ?, and lists of
+    placeholders become (?, ...).
+    """
+    sql = whitespace_pattern.sub(" ", sql).strip()
+    # JSON paths ('$.org.id') are part of the query rather than values
+    sql = literal_pattern.sub(
+        lambda match: match.group() if match.group().startswith("'$") else "?", sql
+    )
+    return placeholder_list_pattern.sub("(?, ...)", sql)
+
+
+def get_caller():
+    """
+    Get the function that ran a statement, as module.function, skipping the
+    frames of this module, aiosqlite and the context managers in between.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if not module.startswith(skipped_caller_modules):
+            return f"{module}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+def format_query_plan(rows: list) -> list[str]:
+    """
+    Format the rows of EXPLAIN QUERY PLAN as indented lines, like the sqlite3
+    shell does.
+    """
+    depths = {0: -1}
+    lines = []
+    for node_id, parent_id, _, detail in rows:
+        depth = depths.get(parent_id, -1) + 1
+        depths[node_id] = depth
+        lines.append(f"{'  ' * depth}{detail}")
+    return lines
+
+
+class QueryStats:
+    """
+    Timings, row counts and callers of the statements run through
+    get_new_db_connection, aggregated by normalized statement, and the latest
+    slow queries with their query plans, which are also appended to the slow
+    query log as JSON lines.
+    """
+
+    def __init__(self, enabled: bool = sql_instrumentation_enabled):
+        self.enabled = enabled
+        self.slow_query_ms = slow_query_ms
+        self.reset()
+
+    def reset(self):
+        self.statements = {}
+        self.slow_queries = deque(maxlen=slow_query_history_size)
+        self.since = time.time()
+
+    def record(self, sql: str, elapsed_ms: float, rows: int, caller: str):
+        normalized = normalize_sql(sql)
+        stats = self.statements.get(normalized)
+        if stats is None:
+            stats = self.statements[normalized] = {
+                "calls": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "rows": 0,
+                "slow_calls": 0,
+                "callers": {},
+            }
+
+        stats["calls"] += 1
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+        stats["rows"] += rows
+        stats["callers"][caller] = stats["callers"].get(caller, 0) + 1
+
+        is_slow = elapsed_ms >= self.slow_query_ms
+        if is_slow:
+            stats["slow_calls"] += 1
+        return is_slow
+
+    async def log_slow_query(
+        self, conn, sql: str, parameters, elapsed_ms: float, rows: int, caller: str
+    ):
+        plan = None
+        if sql.lstrip()[:6].upper() in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH"):
+            try:
+                cursor = await conn.execute(
+                    f"EXPLAIN QUERY PLAN {sql}", parameters or ()
+                )
+                plan = format_query_plan(await cursor.fetchall())
+                await cursor.close()
+            except Exception as e:
+                plan = [f"Could not get the query plan: {e}"]
+
+        entry = {
+            "time": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "elapsed_ms": round(elapsed_ms, 3),
+            "rows": rows,
+            "caller": caller,
+            "sql": normalize_sql(sql),
+            "plan": plan,
+        }
+        self.slow_queries.append(entry)
+        print(f"Slow query ({elapsed_ms:.0f} ms, {rows} rows) in {caller}")
+
+        try:
+            with open(slow_query_log_path, "a") as file:
+                file.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            print(f"Could not write to the slow query log: {e}")
+
+    def stats(self, limit: int = 50, sort_by: str = "total_ms"):
+        statements = []
+        for sql, stats in self.statements.items():
+            statements.append(
+                {
+                    "sql": sql,
+                    **stats,
+                    "total_ms": round(stats["total_ms"], 3),
+                    "max_ms": round(stats["max_ms"], 3),
+                    "mean_ms": round(stats["total_ms"] / stats["calls"], 3),
+                }
+            )
+        statements.sort(key=lambda statement: statement[sort_by], reverse=True)
+
+        return {
+            "enabled": self.enabled,
+            "slow_query_ms": self.slow_query_ms,
+            "since": datetime.fromtimestamp(self.since, timezone.utc).isoformat(),
+            "num_statements": len(statements),
+            "num_calls": sum(stats["calls"] for stats in self.statements.values()),
+            "statements": statements[:limit],
+            "slow_queries": list(reversed(self.slow_queries)),
+        }
+
+
+query_stats = QueryStats()
+
+
+class DBTimer:
+    """
+    Time during which a request was holding, or waiting for, at least one
+    database connection. Connections used at the same time, or one inside
+    another, are only counted once. The time includes the Python work done on
+    the rows while a connection is held, but needs no wrapping of connections,
+    so it costs next to nothing.
+    """
+
+    __slots__ = ("seconds", "num_active", "start")
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.num_active = 0
+        self.start = 0.0
+
+    def enter(self):
+        if self.num_active == 0:
+            self.start = time.perf_counter()
+        self.num_active += 1
+
+    def exit(self):
+        self.num_active -= 1
+        if self.num_active == 0:
+            self.seconds += time.perf_counter() - self.start
+
+
+# Timer of the request being handled, set by the request timing middleware of
+# the app and updated by get_new_db_connection
+db_timer = ContextVar("db_timer", default=None)
+
+
+class InstrumentedCursor:
+    """
+    Wraps an aiosqlite cursor to time each statement, from its execution to
+    the last of its rows being fetched, and count the rows it returned or
+    changed. A statement is recorded once the cursor runs the next one, is
+    closed, or its connection is given back.
+    """
+
+    def __init__(self, cursor, conn, stats: QueryStats):
+        self._cursor = cursor
+        self._conn = conn
+        self._stats = stats
+        self._pending = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    async def _run(
+        self, method, sql: str, parameters, caller: str, is_many: bool = False
+    ):
+        await self.finish()
+
+        start = time.perf_counter()
+        if parameters is None:
+            await method(sql)
+        else:
+            await method(sql, parameters)
+        elapsed = time.perf_counter() - start
+
+        # Statements that change rows report how many, queries count as fetched
+        rows = max(self._cursor.rowcount, 0)
+        self._pending = [sql, parameters, caller, elapsed, rows, is_many]
+        return self
+
+    async def execute(self, sql: str, parameters=None):
+        return await self._run(self._cursor.execute, sql, parameters, get_caller())
+
+    async def executemany(self, sql: str, parameters):
+        return await self._run(
+            self._cursor.executemany,
+            sql,
+            list(parameters),
+            get_caller(),
+            is_many=True,
+        )
+
+    async def _fetch(self, method, *args):
+        start = time.perf_counter()
+        result = await method(*args)
+        if self._pending is not None:
+            self._pending[3] += time.perf_counter() - start
+            if isinstance(result, list):
+                self._pending[4] += len(result)
+            elif result is not None:
+                self._pending[4] += 1
+        return result
+
+    async def fetchone(self):
+        return await self._fetch(self._cursor.fetchone)
+
+    async def fetchmany(self, size: int = None):
+        if size is None:
+            return await self._fetch(self._cursor.fetchmany)
+        return await self._fetch(self._cursor.fetchmany, size)
+
+    async def fetchall(self):
+        return await self._fetch(self._cursor.fetchall)
+
+    async def close(self):
+        await self.finish()
+        await self._cursor.close()
+
+    async def finish(self):
+        if self._pending is None:
+            return
+
+        sql, parameters, caller, elapsed, rows, is_many = self._pending
+        self._pending = None
+        elapsed_ms = elapsed * 1000
+        if self._stats.record(sql, elapsed_ms, rows, caller):
+            # executemany runs the plan of its statement with the first parameters
+            if is_many:
+                parameters = parameters[0] if parameters else None
+            await self._stats.log_slow_query(
+                self._conn, sql, parameters, elapsed_ms, rows, caller
+            )
+
+
+class InstrumentedConnection:
+    """
+    Wraps an aiosqlite connection so that the statements run through it, or
+    through the cursors it creates, are recorded in the query stats.
+    """
+
+    def __init__(self, conn, stats: QueryStats):
+        self._conn = conn
+        self._stats = stats
+        self._cursors = []
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    async def cursor(self):
+        cursor = InstrumentedCursor(await self._conn.cursor(), self._conn, self._stats)
+        self._cursors.append(cursor)
+        return cursor
+
+    async def execute(self, sql: str, parameters=None):
+        cursor = await self.cursor()
+        return await cursor._run(cursor._cursor.execute, sql, parameters, get_caller())
+
+    async def executemany(self, sql: str, parameters):
+        cursor = await self.cursor()
+        return await cursor._run(
+            cursor._cursor.executemany,
+            sql,
+            list(parameters),
+            get_caller(),
+            is_many=True,
+        )
+
+    async def finish(self):
+        cursors, self._cursors = self._cursors, []
+        for cursor in cursors:
+            try:
+                await cursor.finish()
+            except Exception as e:
+                print(f"Could not record a query: {e}")
+
+
+@asynccontextmanager
+async def instrument_connection(conn):
+    """
+    Record the statements run on a connection while it is in use.
+    """
+    instrumented = InstrumentedConnection(conn, query_stats)
+    try:
+        yield instrumented
+    finally:
+        await instrumented.finish()
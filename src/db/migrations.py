@@ -1,5 +1,31 @@
-from .config import annotations_table_name
-from . import get_new_db_connection
+from .config import (
+    annotations_table_name,
+    runs_table_name,
+    queue_runs_table_name,
+    metrics_totals_table_name,
+    metrics_daily_runs_table_name,
+    orgs_table_name,
+    runs_search_table_name,
+    blobs_table_name,
+)
+from . import (
+    get_new_db_connection,
+    create_facet_tables,
+    backfill_facet_tables,
+    create_search_index,
+    backfill_search_index,
+    create_metrics_rollup_tables,
+    create_daily_metrics_tables,
+    backfill_daily_metrics,
+    rebuild_metrics,
+    runs_metadata_columns,
+    get_runs_metadata_column_definition,
+    get_run_summary_sql,
+    get_blobs_insert_query,
+    get_run_inline_metadata_sql,
+    get_run_blob_refs_sql,
+    create_write_counters,
+)
 
 
 async def add_annotations_unique_constraint():
@@ -43,3 +69,441 @@ async def add_annotations_unique_constraint():
             await conn.rollback()
             print(f"Error adding unique constraint: {e}")
             raise
+
+
+async def add_runs_metadata_columns():
+    """
+    Migration to expose the metadata fields used in filters as generated columns
+    on the runs table and index them. Generated columns added to an existing
+    table are virtual, so creating the indexes is what backfills the values.
+    """
+    async with get_new_db_connection() as conn:
+        cursor = await conn.cursor()
+
+        try:
+            # Generated columns are only listed by table_xinfo, not table_info
+            await cursor.execute(f"PRAGMA table_xinfo({runs_table_name})")
+            existing_columns = {row[1] for row in await cursor.fetchall()}
+
+            for column in runs_metadata_columns:
+                if column in existing_columns:
+                    continue
+
+                await cursor.execute(
+                    f"ALTER TABLE {runs_table_name} ADD COLUMN {get_runs_metadata_column_definition(column)}"
+                )
+                print(f"Added generated column {column} to {runs_table_name} table")
+
+            # Composite indexes with start_time so that filtered queries ordered
+            # by time are served by a single index seek
+            for column in runs_metadata_columns:
+                await cursor.execute(
+                    f"""
+                    CREATE INDEX IF NOT EXISTS idx_{runs_table_name}_{column}_start_time
+                    ON {runs_table_name} ({column}, start_time)
+                    """
+                )
+
+            await cursor.execute(
+                f"""
+                CREATE INDEX IF NOT EXISTS idx_{runs_table_name}_start_time
+                ON {runs_table_name} (start_time)
+                """
+            )
+
+            await conn.commit()
+        except Exception as e:
+            await conn.rollback()
+            print(f"Error adding generated metadata columns: {e}")
+            raise
+
+
+async def add_pagination_indexes():
+    """
+    Migration to add the indexes used for keyset pagination: runs are paged by
+    (start_time, id) and the runs of a queue are looked up by queue_id.
+    """
+    async with get_new_db_connection() as conn:
+        cursor = await conn.cursor()
+
+        try:
+            await cursor.execute(
+                f"""
+                CREATE INDEX IF NOT EXISTS idx_{runs_table_name}_start_time_id
+                ON {runs_table_name} (start_time, id)
+                """
+            )
+            # Superseded by the (start_time, id) index
+            await cursor.execute(
+                f"DROP INDEX IF EXISTS idx_{runs_table_name}_start_time"
+            )
+
+            await cursor.execute(
+                f"""
+                CREATE INDEX IF NOT EXISTS idx_{queue_runs_table_name}_queue_run
+                ON {queue_runs_table_name} (queue_id, run_id)
+                """
+            )
+
+            await conn.commit()
+        except Exception as e:
+            await conn.rollback()
+            print(f"Error adding pagination indexes: {e}")
+            raise
+
+
+async def add_runs_run_id_unique_index():
+    """
+    Migration to add a unique index on runs.run_id, so that ingestion can
+    upsert runs by their span id. Duplicate runs inserted before the index
+    existed are merged into the first copy of each run: their queue links and
+    annotations are moved over (unless that user already annotated the first
+    copy) and the duplicates are deleted.
+    """
+    async with get_new_db_connection() as conn:
+        cursor = await conn.cursor()
+
+        try:
+            await cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type='index' AND name=?",
+                (f"idx_{runs_table_name}_run_id_unique",),
+            )
+            if await cursor.fetchone():
+                return
+
+            await cursor.execute(
+                f"""
+                CREATE TEMP TABLE run_duplicates AS
+                SELECT r.id, k.keep_id
+                FROM {runs_table_name} r
+                JOIN (
+                    SELECT run_id, MIN(id) AS keep_id FROM {runs_table_name}
+                    WHERE run_id IS NOT NULL
+                    GROUP BY run_id HAVING COUNT(*) > 1
+                ) k ON r.run_id = k.run_id AND r.id != k.keep_id
+                """
+            )
+
+            await cursor.execute("SELECT COUNT(*) FROM run_duplicates")
+            num_duplicates = (await cursor.fetchone())[0]
+
+            if num_duplicates:
+                await cursor.execute(
+                    f"""
+                    INSERT INTO {queue_runs_table_name} (queue_id, run_id)
+                    SELECT DISTINCT qr.queue_id, d.keep_id
+                    FROM {queue_runs_table_name} qr
+                    JOIN run_duplicates d ON qr.run_id = d.id
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM {queue_runs_table_name} existing
+                        WHERE existing.queue_id = qr.queue_id
+                        AND existing.run_id = d.keep_id
+                    )
+                    """
+                )
+                await cursor.execute(
+                    f"""
+                    UPDATE OR IGNORE {annotations_table_name}
+                    SET run_id = (
+                        SELECT keep_id FROM run_duplicates d
+                        WHERE d.id = {annotations_table_name}.run_id
+                    )
+                    WHERE run_id IN (SELECT id FROM run_duplicates)
+                    """
+                )
+
+                for table_name in (queue_runs_table_name, annotations_table_name):
+                    await cursor.execute(
+                        f"""
+                        DELETE FROM {table_name}
+                        WHERE run_id IN (SELECT id FROM run_duplicates)
+                        """
+                    )
+
+                await cursor.execute(
+                    f"""
+                    DELETE FROM {runs_table_name}
+                    WHERE id IN (SELECT id FROM run_duplicates)
+                    """
+                )
+                print(f"Merged {num_duplicates} duplicate runs")
+
+            await cursor.execute("DROP TABLE run_duplicates")
+
+            await cursor.execute(
+                f"""
+                CREATE UNIQUE INDEX idx_{runs_table_name}_run_id_unique
+                ON {runs_table_name} (run_id)
+                """
+            )
+
+            await conn.commit()
+        except Exception as e:
+            await conn.rollback()
+            print(f"Error adding unique index on run_id: {e}")
+            raise
+
+
+async def add_metrics_rollups():
+    """
+    Migration to add the metrics summary tables and the triggers maintaining
+    them, backfilling them from the existing runs and annotations.
+    """
+    async with get_new_db_connection() as conn:
+        cursor = await conn.cursor()
+
+        try:
+            await create_metrics_rollup_tables(cursor)
+            await conn.commit()
+
+            await cursor.execute(
+                f"SELECT 1 FROM {metrics_totals_table_name} WHERE id = 1"
+            )
+            is_backfilled = await cursor.fetchone()
+        except Exception as e:
+            await conn.rollback()
+            print(f"Error adding metrics rollups: {e}")
+            raise
+
+    if not is_backfilled:
+        await rebuild_metrics()
+        print("Backfilled metrics rollups")
+
+
+async def add_facet_tables():
+    """
+    Migration to add the orgs and courses tables used by the filters, backfilled
+    from the existing runs.
+    """
+    async with get_new_db_connection() as conn:
+        cursor = await conn.cursor()
+
+        try:
+            await cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+                (orgs_table_name,),
+            )
+            tables_exist = await cursor.fetchone()
+
+            await create_facet_tables(cursor)
+
+            if not tables_exist:
+                await backfill_facet_tables(cursor)
+                print("Backfilled orgs and courses tables")
+
+            await conn.commit()
+        except Exception as e:
+            await conn.rollback()
+            print(f"Error adding orgs and courses tables: {e}")
+            raise
+
+
+async def add_search_index():
+    """
+    Migration to add the full-text index over run messages and annotation
+    notes, backfilled from the existing runs.
+    """
+    async with get_new_db_connection() as conn:
+        cursor = await conn.cursor()
+
+        try:
+            await cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+                (runs_search_table_name,),
+            )
+            index_exists = await cursor.fetchone()
+
+            await create_search_index(cursor)
+
+            if not index_exists:
+                await backfill_search_index(cursor)
+                print("Backfilled full-text search index")
+
+            await conn.commit()
+        except Exception as e:
+            await conn.rollback()
+            print(f"Error adding full-text search index: {e}")
+            raise
+
+
+async def add_runs_summary_column(batch_size: int = 10000):
+    """
+    Migration to add the summary column returned by the run listings to the
+    runs table, and compute it for the existing runs in batches.
+    """
+    async with get_new_db_connection() as conn:
+        cursor = await conn.cursor()
+
+        try:
+            await cursor.execute(f"PRAGMA table_xinfo({runs_table_name})")
+            existing_columns = {row[1] for row in await cursor.fetchall()}
+
+            if "summary" not in existing_columns:
+                await cursor.execute(
+                    f"ALTER TABLE {runs_table_name} ADD COLUMN summary TEXT"
+                )
+                await conn.commit()
+                print(f"Added summary column to {runs_table_name} table")
+
+            num_updated = 0
+            while True:
+                await cursor.execute(
+                    f"""
+                    UPDATE {runs_table_name}
+                    SET summary = {get_run_summary_sql("decompress_text(messages)", "metadata", "start_time", "end_time")}
+                    WHERE id IN (
+                        SELECT id FROM {runs_table_name} WHERE summary IS NULL LIMIT ?
+                    )
+                    """,
+                    (batch_size,),
+                )
+                await conn.commit()
+
+                if cursor.rowcount <= 0:
+                    break
+                num_updated += cursor.rowcount
+
+            if num_updated:
+                print(f"Computed the summary of {num_updated} runs")
+        except Exception as e:
+            await conn.rollback()
+            print(f"Error adding summary column: {e}")
+            raise
+
+
+async def add_run_blobs(batch_size: int = 10000):
+    """
+    Migration to move the large metadata fields of the existing runs (see
+    run_blob_fields) into the blobs table, referenced from the new blob_refs
+    column. Contexts stored compressed in the context column, which this
+    replaces, are moved too and the column is dropped.
+
+    Runs in the same transaction, so that an interrupted migration is retried
+    from scratch.
+    """
+    async with get_new_db_connection() as conn:
+        cursor = await conn.cursor()
+
+        try:
+            await cursor.execute(f"PRAGMA table_xinfo({runs_table_name})")
+            existing_columns = {row[1] for row in await cursor.fetchall()}
+
+            has_context_column = "context" in existing_columns
+            if "blob_refs" in existing_columns and not has_context_column:
+                return
+
+            if "blob_refs" not in existing_columns:
+                await cursor.execute(
+                    f"ALTER TABLE {runs_table_name} ADD COLUMN blob_refs TEXT"
+                )
+
+            metadata = "metadata"
+            if has_context_column:
+                metadata = """CASE WHEN context IS NULL THEN metadata
+                    ELSE JSON_SET(metadata, '$.context', JSON(decompress_text(context)))
+                END"""
+
+            await cursor.execute(f"SELECT MAX(id) FROM {runs_table_name}")
+            max_id = (await cursor.fetchone())[0] or 0
+
+            num_runs = 0
+            for batch_start in range(0, max_id, batch_size):
+                batch = (batch_start, batch_start + batch_size)
+                await cursor.execute(
+                    get_blobs_insert_query(
+                        metadata,
+                        f"FROM {runs_table_name} WHERE id > ?1 AND id <= ?2",
+                    ),
+                    batch,
+                )
+
+                # Every SET expression reads the values of the row before the update
+                await cursor.execute(
+                    f"""
+                    UPDATE {runs_table_name}
+                    SET metadata = {get_run_inline_metadata_sql(metadata)},
+                        blob_refs = {get_run_blob_refs_sql(metadata)}
+                    WHERE id > ? AND id <= ?
+                    """,
+                    batch,
+                )
+                num_runs += cursor.rowcount
+
+            if has_context_column:
+                await cursor.execute(
+                    f"ALTER TABLE {runs_table_name} DROP COLUMN context"
+                )
+
+            await conn.commit()
+
+            await cursor.execute(f"SELECT COUNT(*), SUM(size) FROM {blobs_table_name}")
+            num_blobs, size = await cursor.fetchone()
+            print(
+                f"Moved the large metadata fields of {num_runs} runs into "
+                f"{num_blobs} blobs ({(size or 0) / 1024 / 1024:.1f} MB)"
+            )
+        except Exception as e:
+            await conn.rollback()
+            print(f"Error moving run metadata into blobs: {e}")
+            raise
+
+
+async def add_write_counters():
+    """
+    Migration to add the write counters used to tag the API responses with
+    ETags.
+    """
+    async with get_new_db_connection() as conn:
+        cursor = await conn.cursor()
+
+        try:
+            await create_write_counters(cursor)
+            await conn.commit()
+        except Exception as e:
+            await conn.rollback()
+            print(f"Error adding write counters: {e}")
+            raise
+
+
+async def add_daily_metrics_rollups():
+    """
+    Migration to add the per-day metrics summary tables and the triggers
+    maintaining them, backfilled from the existing runs and annotations.
+    """
+    async with get_new_db_connection() as conn:
+        cursor = await conn.cursor()
+
+        try:
+            await cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+                (metrics_daily_runs_table_name,),
+            )
+            tables_exist = await cursor.fetchone()
+
+            await create_daily_metrics_tables(cursor)
+
+            if not tables_exist:
+                await backfill_daily_metrics(cursor)
+                print("Backfilled daily metrics rollups")
+
+            await conn.commit()
+        except Exception as e:
+            await conn.rollback()
+            print(f"Error adding daily metrics rollups: {e}")
+            raise
+
+
+async def run_migrations():
+    """
+    Run all idempotent migrations, in order.
+    """
+    await add_runs_metadata_columns()
+    await add_pagination_indexes()
+    await add_runs_run_id_unique_index()
+    await add_metrics_rollups()
+    await add_facet_tables()
+    await add_search_index()
+    await add_runs_summary_column()
+    await add_run_blobs()
+    await add_write_counters()
+    await add_daily_metrics_rollups()
@@ -0,0 +1,185 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+import aiosqlite
+from .config import (
+    sqlite_db_path,
+    sqlite_pool_size,
+    sqlite_cache_size_kb,
+    sqlite_mmap_size,
+    sqlite_busy_timeout_ms,
+)
+from .compression import sql_functions as compression_sql_functions
+from .blobs import sql_functions as blob_sql_functions
+
+
+async def apply_connection_pragmas(conn, readonly: bool = False):
+    """
+    Apply the per-connection PRAGMAs and register the SQL functions used to
+    read and write compressed runs and blobs. These only need to run once for the
+    lifetime of a connection.
+    """
+    for name, num_params, func, deterministic in (
+        compression_sql_functions + blob_sql_functions
+    ):
+        await conn.create_function(name, num_params, func, deterministic=deterministic)
+
+    await conn.execute("PRAGMA synchronous=NORMAL;")
+    await conn.execute(f"PRAGMA cache_size=-{sqlite_cache_size_kb};")
+    await conn.execute(f"PRAGMA mmap_size={sqlite_mmap_size};")
+    await conn.execute("PRAGMA temp_store=MEMORY;")
+    await conn.execute(f"PRAGMA busy_timeout={sqlite_busy_timeout_ms};")
+    if readonly:
+        await conn.execute("PRAGMA query_only=ON;")
+
+
+class ConnectionPool:
+    """
+    A pool of long-lived aiosqlite connections.
+
+    SQLite (in WAL mode) allows many concurrent readers but only one writer,
+    so the pool keeps a bounded set of read-only connections and a single
+    writer connection that is handed out one caller at a time.
+    """
+
+    def __init__(self, db_path: str = sqlite_db_path, size: int = sqlite_pool_size):
+        self.db_path = db_path
+        self.size = size
+        self.started = False
+        self._readers = None
+        self._writer = None
+        self._writer_lock = None
+        self._version_conn = None
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._stats = {
+            "reader": {"acquired": 0, "wait_total": 0.0, "wait_max": 0.0},
+            "writer": {"acquired": 0, "wait_total": 0.0, "wait_max": 0.0},
+        }
+        self._in_use = {"reader": 0, "writer": 0}
+
+    async def _connect(self, readonly: bool):
+        conn = await aiosqlite.connect(self.db_path)
+        await apply_connection_pragmas(conn, readonly=readonly)
+        return conn
+
+    async def start(self):
+        if self.started:
+            return
+
+        self._readers = asyncio.Queue(maxsize=self.size)
+        for _ in range(self.size):
+            self._readers.put_nowait(await self._connect(readonly=True))
+
+        self._writer = await self._connect(readonly=False)
+        self._writer_lock = asyncio.Lock()
+        self._version_conn = await self._connect(readonly=True)
+        self._reset_stats()
+        self.started = True
+
+    async def stop(self):
+        if not self.started:
+            return
+
+        self.started = False
+
+        while not self._readers.empty():
+            conn = self._readers.get_nowait()
+            await conn.close()
+
+        async with self._writer_lock:
+            await self._writer.close()
+        await self._version_conn.close()
+
+        self._readers = None
+        self._writer = None
+        self._writer_lock = None
+        self._version_conn = None
+
+    async def data_version(self):
+        """
+        Get the PRAGMA data_version of a connection kept only for this purpose,
+        which changes whenever a transaction is committed to the database by any
+        other connection, in this process or another one.
+        """
+        cursor = await self._version_conn.execute("PRAGMA data_version;")
+        row = await cursor.fetchone()
+        await cursor.close()
+        return row[0]
+
+    def _record_wait(self, kind: str, waited: float):
+        stats = self._stats[kind]
+        stats["acquired"] += 1
+        stats["wait_total"] += waited
+        stats["wait_max"] = max(stats["wait_max"], waited)
+
+    async def _release(self, conn, readonly: bool, failed: bool):
+        """
+        Leave the connection clean for the next caller: roll back anything the
+        caller did not commit, and replace the connection if that fails.
+        """
+        try:
+            if failed or conn.in_transaction:
+                await conn.rollback()
+        except Exception:
+            await conn.close()
+            conn = await self._connect(readonly=readonly)
+        return conn
+
+    @asynccontextmanager
+    async def acquire(self, readonly: bool = False):
+        kind = "reader" if readonly else "writer"
+        start = time.perf_counter()
+
+        readers, writer_lock = self._readers, self._writer_lock
+        if readonly:
+            conn = await readers.get()
+        else:
+            await writer_lock.acquire()
+            conn = self._writer
+
+        self._record_wait(kind, time.perf_counter() - start)
+        self._in_use[kind] += 1
+
+        failed = False
+        try:
+            yield conn
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self._in_use[kind] -= 1
+            if readonly and readers is not self._readers:
+                # The pool was stopped while this connection was checked out
+                await conn.close()
+            else:
+                try:
+                    conn = await self._release(conn, readonly, failed)
+                finally:
+                    if readonly:
+                        readers.put_nowait(conn)
+                    else:
+                        self._writer = conn
+                        writer_lock.release()
+
+    def stats(self):
+        """
+        Pool usage and wait-time metrics (wait times are in milliseconds).
+        """
+        result = {"started": self.started, "size": self.size}
+        for kind, stats in self._stats.items():
+            acquired = stats["acquired"]
+            result[kind] = {
+                "acquired": acquired,
+                "in_use": self._in_use[kind],
+                "wait_avg_ms": (
+                    round(stats["wait_total"] / acquired * 1000, 3) if acquired else 0
+                ),
+                "wait_max_ms": round(stats["wait_max"] * 1000, 3),
+            }
+        result["reader"]["idle"] = self._readers.qsize() if self.started else 0
+        return result
+
+
+db_pool = ConnectionPool()
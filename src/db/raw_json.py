@@ -0,0 +1,70 @@
+import json
+from json.encoder import encode_basestring
+
+
+class RawJSON(str):
+    """
+    JSON text read from the database that is spliced into the output of dumps
+    as is, instead of being decoded and encoded again.
+    """
+
+
+def escape_html(text: str) -> str:
+    """
+    HTML-escape the angle brackets in JSON text, like escape_html_sql.
+    """
+    return text.replace("<", "&lt;").replace(">", "&gt;")
+
+
+def escape_html_sql(expression: str) -> str:
+    """
+    SQL expression HTML-escaping the angle brackets in a text column, so that
+    stored JSON text can be sent to the browser without being decoded.
+    """
+    return f"REPLACE(REPLACE({expression}, '<', '&lt;'), '>', '&gt;')"
+
+
+def set_raw_json_fields(raw_object: str, fields: dict) -> str:
+    """
+    Add fields, given as JSON text, to the JSON text of an object.
+    """
+    if not fields:
+        return raw_object
+
+    members = ",".join(
+        f"{encode_basestring(key)}:{value}" for key, value in fields.items()
+    )
+    body = raw_object.rstrip()[:-1].rstrip()
+    separator = "" if body.endswith("{") else ","
+    return f"{body}{separator}{members}}}"
+
+
+def dumps(obj) -> str:
+    """
+    Serialize an object to compact JSON, like json.dumps, except that RawJSON
+    values are written out as they are.
+    """
+    if isinstance(obj, RawJSON):
+        return obj
+    if isinstance(obj, str):
+        return encode_basestring(obj)
+    if obj is None:
+        return "null"
+    if obj is True:
+        return "true"
+    if obj is False:
+        return "false"
+    if isinstance(obj, int):
+        return int.__repr__(obj)
+    if isinstance(obj, dict):
+        return (
+            "{"
+            + ",".join(
+                f"{encode_basestring(str(key))}:{dumps(value)}"
+                for key, value in obj.items()
+            )
+            + "}"
+        )
+    if isinstance(obj, (list, tuple)):
+        return "[" + ",".join(dumps(value) for value in obj) + "]"
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(",", ":"))
@@ -0,0 +1,85 @@
+from db.raw_json import dumps as dumps_raw_json
+import csv
+import io
+import json
+
+export_formats = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+}
+
+# Metadata fields written to their own CSV columns, as (column, path in the metadata)
+csv_metadata_fields = [
+    ("org_id", ("org", "id")),
+    ("course_id", ("course", "id")),
+    ("run_type", ("type",)),
+    ("stage", ("stage",)),
+    ("user_id", ("user_id",)),
+    ("user_email", ("user_email",)),
+    ("task_title", ("task_title",)),
+    ("question_title", ("question_title",)),
+    ("question_type", ("question_type",)),
+    ("question_purpose", ("question_purpose",)),
+    ("question_input_type", ("question_input_type",)),
+]
+
+
+def get_metadata_field(metadata: dict, path: tuple):
+    value = metadata
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+async def stream_ndjson(chunks):
+    """
+    Stream runs as newline-delimited JSON, one run per line with its messages,
+    metadata and {username: annotation} annotations.
+    """
+    async for runs in chunks:
+        yield "".join(f"{dumps_raw_json(run)}\n" for run in runs)
+
+
+async def stream_csv(chunks, annotators: list[str]):
+    """
+    Stream runs as CSV, one row per run with the run fields, the main metadata
+    fields, the messages and full metadata as JSON, and a judgement and notes
+    column for each annotator.
+    """
+    header = ["id", "run_id", "start_time", "end_time", "created_at"]
+    header += [column for column, _ in csv_metadata_fields]
+    header += ["messages", "metadata"]
+    for annotator in annotators:
+        header += [f"{annotator}_judgement", f"{annotator}_notes"]
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+
+    async for runs in chunks:
+        for run in runs:
+            metadata = json.loads(run["metadata"])
+            row = [
+                run["id"],
+                run["run_id"],
+                run["start_time"],
+                run["end_time"],
+                run["created_at"],
+            ]
+            for _, path in csv_metadata_fields:
+                row.append(get_metadata_field(metadata, path))
+            row += [run["messages"], run["metadata"]]
+            for annotator in annotators:
+                annotation = run["annotations"].get(annotator) or {}
+                row += [annotation.get("judgement"), annotation.get("notes")]
+            writer.writerow(row)
+
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    # An empty export still gets the header
+    if buffer.tell():
+        yield buffer.getvalue()
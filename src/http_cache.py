@@ -0,0 +1,79 @@
+from starlette.requests import Request
+from starlette.responses import Response
+from auth import get_current_user
+from db import get_write_versions
+import hashlib
+import json
+import secrets
+
+# Changes on every restart, so that responses cached by browsers are not reused
+# once a new version of the app (which may render them differently) is deployed
+etag_salt = secrets.token_hex(8)
+
+etag_cache_control = "private, no-cache"
+
+
+def normalize_query_params(request: Request):
+    """
+    Get the query parameters of a request in a canonical form, so that the same
+    query gets the same ETag whatever the order of its parameters. Empty values
+    are dropped, since the endpoints treat them as missing.
+    """
+    return sorted(
+        (key, value.strip())
+        for key, value in request.query_params.multi_items()
+        if value.strip()
+    )
+
+
+async def get_etag(request: Request, tables: list[str], extra=None):
+    """
+    Get the ETag of the response to a request, derived from the write counters
+    of the tables the response is read from, the normalized query parameters
+    and the current user, without running the query itself. Anything else the
+    response depends on (such as the current date) is passed as extra.
+    """
+    versions = await get_write_versions()
+    key = json.dumps(
+        [
+            etag_salt,
+            request.url.path,
+            normalize_query_params(request),
+            get_current_user(request),
+            [versions.get(table) for table in tables],
+            extra,
+        ]
+    )
+    return f'"{hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]}"'
+
+
+def is_not_modified(request: Request, etag: str):
+    """
+    Whether the client already has the response with this ETag, as given in
+    its If-None-Match header.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+
+    # If-None-Match uses the weak comparison
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in tags or "*" in tags
+
+
+def not_modified_response(etag: str):
+    return Response(
+        status_code=304,
+        headers={"ETag": etag, "Cache-Control": etag_cache_control},
+    )
+
+
+def with_etag(response: Response, etag: str):
+    """
+    Tag a successful response with its ETag, asking browsers to revalidate it
+    on every use rather than reusing it as is.
+    """
+    if response.status_code == 200:
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = etag_cache_control
+    return response
@@ -207,8 +207,31 @@ function scrollToRun(runIndex) {
     }, 100); // Small delay to ensure DOM is updated
 }
 
+// Cache of the full runs (with their messages) loaded so far, by run id
+const runDetailsCache = {};
+
+// Function to load the full run, since the run lists only include summaries
+async function loadRunDetails(run) {
+    if (!runDetailsCache[run.id]) {
+        const response = await fetch(`/api/runs/${run.id}`);
+        const data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.error || 'Failed to load run');
+        }
+        runDetailsCache[run.id] = data.run;
+    }
+    // Keep the fields of the list entry (e.g. the annotations, which are updated
+    // as the user annotates) and add the messages and full metadata to them
+    const details = runDetailsCache[run.id];
+    return {
+        ...run,
+        messages: details.messages,
+        metadata: { ...details.metadata, ...run.metadata }
+    };
+}
+
 // Function to select and display a run
-function selectRun(runIndex) {
+async function selectRun(runIndex) {
     // Update URL with run ID as query parameter
     if (runsData[runIndex]) {
         const runId = runsData[runIndex].id;
@@ -248,9 +271,19 @@ function selectRun(runIndex) {
     navigatingFromSidebar = false;
     
     currentRunIndex = runIndex; // Track the selected run
-    const selectedRun = runsData[runIndex];
-    
-    if (!selectedRun) return;
+    if (!runsData[runIndex]) return;
+
+    let selectedRun;
+    try {
+        selectedRun = await loadRunDetails(runsData[runIndex]);
+    } catch (error) {
+        console.error('Error loading run:', error);
+        window.showErrorState(error.message, `selectRun(${runIndex})`);
+        return;
+    }
+
+    // Another run may have been selected while this one was loading
+    if (currentRunIndex !== runIndex) return;
     
     // Use the new component function to populate the selected run view
     if (typeof window.populateSelectedRunView === 'function') {
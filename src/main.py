@@ -2,11 +2,12 @@ from fasthtml.common import *
 from starlette.middleware.sessions import SessionMiddleware
 from starlette.responses import RedirectResponse
 from starlette.requests import Request
-from starlette.responses import JSONResponse
+from starlette.responses import StreamingResponse
+from datetime import date, datetime, timezone
 import json
 
 # Import modularized components
-from auth import VALID_USERS, get_current_user, require_auth
+from auth import VALID_USERS, get_current_user, require_auth, is_admin
 from pages.runs import runs_page
 from pages.queues import queues_page
 from pages.queue import individual_queue_page
@@ -14,13 +15,50 @@ from pages.overview import overview_page
 from dotenv import load_dotenv
 from db import (
     fetch_all_runs,
+    get_run,
     get_all_queues,
     get_queue,
     create_queue,
     update_queue,
     get_unique_orgs_and_courses,
+    start_db_pool,
+    stop_db_pool,
+    get_db_pool_stats,
+    decode_run_cursor,
+    get_run_page_cursors,
+    iter_export_runs,
+    get_all_users,
+    get_metric_trends,
+    trend_bucket_days,
+    get_new_db_connection,
+)
+from db.config import (
+    users_json_path,
+    runs_table_name,
+    annotations_table_name,
+    queues_table_name,
+    queue_runs_table_name,
+    users_table_name,
+)
+from db.agreement import get_agreement
+from db.instrumentation import query_stats
+from db.raw_json import dumps as dumps_raw_json
+from export import export_formats, stream_ndjson, stream_csv
+from scheduler import ingest_scheduler
+from snapshot import check_pyarrow, get_snapshot_tables, iter_snapshot_stream
+from http_cache import get_etag, is_not_modified, not_modified_response, with_etag
+from response_compression import (
+    CompressionMiddleware,
+    compression_stats,
+    precompress_static,
+)
+from request_metrics import (
+    JSONResponse,
+    RequestTimingMiddleware,
+    request_metrics,
+    metrics_token,
+    prometheus_content_type,
 )
-from db.config import users_json_path
 import json
 import os
 
@@ -33,8 +71,28 @@ app, rt = fast_app(
         Link(rel="stylesheet", href="https://cdn.tailwindcss.com"),
     ),
     static_path="public",  # This serves static files from the src/public directory
+    # Keep a pool of long-lived database connections for the lifetime of the app,
+    # which the scheduled syncs of new runs (if enabled) also write through
+    on_startup=[start_db_pool, ingest_scheduler.start],
+    on_shutdown=[ingest_scheduler.stop, stop_db_pool],
 )
 app.add_middleware(SessionMiddleware, secret_key="your-secret-key-here")
+app.add_middleware(
+    CompressionMiddleware, static_dir="public" if precompress_static else None
+)
+# Added last so that it wraps every other middleware and times whole requests
+app.add_middleware(RequestTimingMiddleware, router=app.router)
+
+
+class RawJSONResponse(JSONResponse):
+    """
+    JSON response for the runs read from the database, whose stored JSON
+    columns (RawJSON) are spliced into the body instead of being decoded and
+    encoded again
+    """
+
+    def render(self, content) -> bytes:
+        return dumps_raw_json(content).encode("utf-8")
 
 
 @app.get("/")
@@ -157,90 +215,208 @@ def logout(request):
     return RedirectResponse(url="/login", status_code=302)
 
 
+def get_run_filters(request: Request):
+    """
+    Get the run filters of fetch_all_runs from the query parameters of a request
+    """
+    params = request.query_params
+    annotator_user = params.get(
+        "annotator_user"
+    )  # New parameter for filtering by annotator
+
+    # Get annotation filter user ID - use annotator_user if provided, otherwise current user
+    annotation_filter_user_id = None
+    user = get_current_user(request)
+
+    if annotator_user and annotator_user in VALID_USERS:
+        # If specific annotator is requested, use that user's ID
+        annotation_filter_user_id = VALID_USERS[annotator_user]["id"]
+    # Remove the automatic defaulting to current user - let it be None to show all users' annotations
+    # elif annotation_filter and user and user in VALID_USERS:
+    #     # If judgment filter is specified but no specific annotator, use current user's ID
+    #     annotation_filter_user_id = VALID_USERS[user]["id"]
+
+    # Support multiple values for comma-separated filters
+    def parse_multi(val):
+        if val is None:
+            return None
+        return [v.strip() for v in val.split(",") if v.strip()]
+
+    org_ids = parse_multi(params.get("org_id"))
+    course_ids = parse_multi(params.get("course_id"))
+
+    return {
+        "annotation_filter": params.get("annotation_filter"),
+        "annotation_filter_user_id": annotation_filter_user_id,
+        "time_range": params.get("time_range"),
+        "org_ids": [int(id) for id in org_ids] if org_ids else None,
+        "course_ids": [int(id) for id in course_ids] if course_ids else None,
+        "run_type": parse_multi(params.get("run_type")),
+        "purpose": parse_multi(params.get("purpose")),
+        "question_type": parse_multi(params.get("question_type")),
+        "question_input_type": parse_multi(params.get("question_input_type")),
+        "user_email": params.get("user_email"),
+        "task_title": params.get("task_title"),
+        "question_title": params.get("question_title"),
+        "search": params.get("q"),
+    }
+
+
 @app.get("/api/runs")
 async def get_runs_api(request: Request):
     """API endpoint to get filtered and paginated runs"""
     try:
+        # Time ranges are relative to the current date, so the results of a
+        # query filtered on one also change when the date does
+        time_range_date = None
+        if request.query_params.get("time_range"):
+            time_range_date = datetime.now(timezone.utc).date().isoformat()
+        etag = await get_etag(
+            request,
+            [runs_table_name, annotations_table_name, users_table_name],
+            extra=time_range_date,
+        )
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
+
         # Get query params
         params = request.query_params
-        annotation_filter = params.get("annotation_filter")
-        time_range = params.get("time_range")
-        org_id = params.get("org_id")
-        course_id = params.get("course_id")
-        run_type = params.get("run_type")
-        purpose = params.get("purpose")
-        question_type = params.get("question_type")
-        question_input_type = params.get("question_input_type")
+        filters = get_run_filters(request)
         page = int(params.get("page", 1))
         page_size = int(params.get("page_size", 20))
         sort_by = params.get("sort_by", "timestamp")
         sort_order = params.get("sort_order", "desc")
-        user_email = params.get("user_email")
-        task_title = params.get("task_title")
-        question_title = params.get("question_title")
-        annotator_user = params.get(
-            "annotator_user"
-        )  # New parameter for filtering by annotator
-
-        # Get annotation filter user ID - use annotator_user if provided, otherwise current user
-        annotation_filter_user_id = None
-        user = get_current_user(request)
 
-        if annotator_user and annotator_user in VALID_USERS:
-            # If specific annotator is requested, use that user's ID
-            annotation_filter_user_id = VALID_USERS[annotator_user]["id"]
-        # Remove the automatic defaulting to current user - let it be None to show all users' annotations
-        # elif annotation_filter and user and user in VALID_USERS:
-        #     # If judgment filter is specified but no specific annotator, use current user's ID
-        #     annotation_filter_user_id = VALID_USERS[user]["id"]
-
-        # Support multiple values for comma-separated filters
-        def parse_multi(val):
-            if val is None:
-                return None
-            return [v.strip() for v in val.split(",") if v.strip()]
-
-        run_type = parse_multi(run_type)
-        purpose = parse_multi(purpose)
-        question_type = parse_multi(question_type)
-        question_input_type = parse_multi(question_input_type)
-        org_ids = parse_multi(org_id)
-        course_ids = parse_multi(course_id)
-
-        org_ids = [int(id) for id in org_ids] if org_ids else None
-        course_ids = [int(id) for id in course_ids] if course_ids else None
+        # Cursor pagination (takes precedence over page when given)
+        try:
+            after = decode_run_cursor(params.get("after"))
+            before = decode_run_cursor(params.get("before"))
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
 
         # Call fetch_all_runs with all filters, pagination, and sorting
-        runs_data, total_count = await fetch_all_runs(
-            annotation_filter=annotation_filter,
-            time_range=time_range,
-            org_ids=org_ids,
-            course_ids=course_ids,
-            run_type=run_type,
-            purpose=purpose,
-            question_type=question_type,
-            question_input_type=question_input_type,
+        runs_data, total_count, has_more = await fetch_all_runs(
+            **filters,
             page=page,
             page_size=page_size,
-            annotation_filter_user_id=annotation_filter_user_id,
             sort_by=sort_by,
             sort_order=sort_order,
-            user_email=user_email,
-            task_title=task_title,
-            question_title=question_title,
+            after=after,
+            before=before,
         )
         total_pages = (total_count + page_size - 1) // page_size
-        return JSONResponse(
+        response = RawJSONResponse(
             {
                 "runs": runs_data,
                 "total_count": total_count,
                 "total_pages": total_pages,
                 "current_page": page,
+                **get_run_page_cursors(
+                    runs_data,
+                    page_size,
+                    page=page,
+                    after=after,
+                    before=before,
+                    by_relevance=bool(filters["search"]) and sort_by == "relevance",
+                    has_more=has_more,
+                ),
             }
         )
+        return with_etag(response, etag)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.get("/api/runs/{run_id}")
+async def get_run_api(request: Request, run_id: int):
+    """API endpoint to get a run with its full conversation and metadata"""
+    auth_redirect = require_auth(request)
+    if auth_redirect:
+        return JSONResponse({"error": "Authentication required"}, status_code=401)
+
+    try:
+        run = await get_run(run_id)
+        if run is None:
+            return JSONResponse({"error": "Run not found"}, status_code=404)
+        return RawJSONResponse({"run": run})
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.get("/api/export/runs")
+async def export_runs_api(request: Request):
+    """
+    API endpoint to export every run matching the filters of /api/runs, with
+    its annotations, as a stream of NDJSON lines (format=ndjson, the default)
+    or CSV rows (format=csv)
+    """
+    auth_redirect = require_auth(request)
+    if auth_redirect:
+        return JSONResponse({"error": "Authentication required"}, status_code=401)
+
+    params = request.query_params
+    export_format = params.get("format", "ndjson")
+    if export_format not in export_formats:
+        return JSONResponse(
+            {"error": f"Unsupported format: {export_format}"}, status_code=400
+        )
+
+    try:
+        chunks = iter_export_runs(
+            **get_run_filters(request),
+            sort_order=params.get("sort_order", "desc"),
+        )
+        if export_format == "csv":
+            annotators = sorted(user["name"] for user in await get_all_users())
+            body = stream_csv(chunks, annotators)
+        else:
+            body = stream_ndjson(chunks)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
+    media_type, extension = export_formats[export_format]
+    filename = f"runs-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.{extension}"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@app.get("/api/snapshot/{table_name}")
+async def get_snapshot_api(request: Request, table_name: str):
+    """
+    API endpoint to get a columnar snapshot of the runs (with their main metadata
+    fields as columns), annotations, queues or queue_runs table, as an Arrow IPC
+    stream. With since=YYYY-MM-DD, only the runs started or the annotations made
+    from that date onwards are returned, for incremental refreshes.
+    """
+    auth_redirect = require_auth(request)
+    if auth_redirect:
+        return JSONResponse({"error": "Authentication required"}, status_code=401)
+
+    try:
+        check_pyarrow()
+    except RuntimeError as e:
+        return JSONResponse({"error": str(e)}, status_code=501)
+
+    if table_name not in get_snapshot_tables():
+        return JSONResponse({"error": "Table not found"}, status_code=404)
+
+    since = request.query_params.get("since")
+    if since:
+        try:
+            since = date.fromisoformat(since).isoformat()
+        except ValueError:
+            return JSONResponse({"error": "Invalid since date"}, status_code=400)
+
+    # The stream is read and serialized from the thread pool
+    return StreamingResponse(
+        iter_snapshot_stream(table_name, since),
+        media_type="application/vnd.apache.arrow.stream",
+        headers={"Content-Disposition": f'attachment; filename="{table_name}.arrows"'},
+    )
+
 
 @app.get("/api/queues")
 async def get_queues_api(request: Request):
@@ -251,9 +427,17 @@ async def get_queues_api(request: Request):
         return JSONResponse({"error": "Authentication required"}, status_code=401)
 
     try:
+        etag = await get_etag(
+            request, [queues_table_name, queue_runs_table_name, users_table_name]
+        )
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
+
         queues_data = await get_all_queues()
         current_user = get_current_user(request)
-        return JSONResponse({"queues": queues_data, "user": current_user})
+        return with_etag(
+            JSONResponse({"queues": queues_data, "user": current_user}), etag
+        )
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
@@ -262,6 +446,19 @@ async def get_queues_api(request: Request):
 async def get_queue_api(queue_id: str, request: Request):
     """API endpoint to get a specific queue with pagination and annotation status filtering support"""
     try:
+        etag = await get_etag(
+            request,
+            [
+                queues_table_name,
+                queue_runs_table_name,
+                runs_table_name,
+                annotations_table_name,
+                users_table_name,
+            ],
+        )
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
+
         # Get pagination and filter parameters from query string
         params = request.query_params
         page = int(params.get("page", 1))
@@ -271,6 +468,8 @@ async def get_queue_api(queue_id: str, request: Request):
         user_email = params.get("user_email")
         task_title = params.get("task_title")
         question_title = params.get("question_title")
+        search = params.get("q")
+        sort_by = params.get("sort_by", "timestamp")
 
         # Get current user ID for annotation filtering
         annotation_filter_user_id = None
@@ -278,7 +477,14 @@ async def get_queue_api(queue_id: str, request: Request):
             if annotator_filter_user and annotator_filter_user in VALID_USERS:
                 annotation_filter_user_id = VALID_USERS[annotator_filter_user]["id"]
 
-        queue_data, total_count = await get_queue(
+        # Cursor pagination (takes precedence over page when given)
+        try:
+            after = decode_run_cursor(params.get("after"))
+            before = decode_run_cursor(params.get("before"))
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+
+        queue_data, total_count, has_more = await get_queue(
             int(queue_id),
             page,
             page_size,
@@ -287,28 +493,47 @@ async def get_queue_api(queue_id: str, request: Request):
             user_email=user_email,
             task_title=task_title,
             question_title=question_title,
+            after=after,
+            before=before,
+            search=search,
+            sort_by=sort_by,
         )
         total_pages = (total_count + page_size - 1) // page_size
 
-        return JSONResponse(
+        response = RawJSONResponse(
             {
                 "queue": queue_data,
                 "total_count": total_count,
                 "total_pages": total_pages,
                 "current_page": page,
                 "page_size": page_size,
+                **get_run_page_cursors(
+                    queue_data["runs"],
+                    page_size,
+                    page=page,
+                    after=after,
+                    before=before,
+                    by_relevance=bool(search) and sort_by == "relevance",
+                    has_more=has_more,
+                ),
             }
         )
+        return with_etag(response, etag)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
 
 @app.get("/api/filter_data")
-async def get_filter_data():
+async def get_filter_data(request: Request):
     """API endpoint to get the data required for the filters section"""
     try:
+        # The orgs and courses are derived from the runs
+        etag = await get_etag(request, [runs_table_name])
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
+
         data = await get_unique_orgs_and_courses()
-        return JSONResponse(data)
+        return with_etag(JSONResponse(data), etag)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
@@ -319,12 +544,216 @@ async def get_metrics_api(request: Request):
     try:
         from db import get_metrics
 
+        # The metrics are derived from the runs, annotations and users
+        etag = await get_etag(
+            request, [runs_table_name, annotations_table_name, users_table_name]
+        )
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
+
         metrics_data = await get_metrics()
-        return JSONResponse(metrics_data)
+        return with_etag(JSONResponse(metrics_data), etag)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.get("/api/metrics/trends")
+async def get_metric_trends_api(request: Request):
+    """
+    API endpoint to get the daily or weekly (granularity=day|week) series of runs
+    and annotations over the last days (default 90), with the leaderboard of
+    that window
+    """
+    try:
+        params = request.query_params
+        granularity = params.get("granularity", "day")
+        try:
+            days = int(params.get("days", 90))
+        except ValueError:
+            return JSONResponse({"error": "Invalid days"}, status_code=400)
+        if granularity not in trend_bucket_days or not 1 <= days <= 3660:
+            return JSONResponse(
+                {"error": "Invalid granularity or days"}, status_code=400
+            )
+
+        # The window ends today, so the response also changes with the date
+        end_date = datetime.now(timezone.utc).date()
+        etag = await get_etag(
+            request,
+            [runs_table_name, annotations_table_name, users_table_name],
+            extra=end_date.isoformat(),
+        )
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
+
+        trends = await get_metric_trends(granularity, days, end_date)
+        return with_etag(JSONResponse(trends), etag)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
 
+@app.get("/api/agreement")
+async def get_agreement_api(request: Request):
+    """
+    API endpoint to get the agreement between annotators (pairwise Cohen's kappa,
+    Fleiss' kappa and the runs they disagree on), globally and per queue, or
+    within one queue with queue_id
+    """
+    auth_redirect = require_auth(request)
+    if auth_redirect:
+        return JSONResponse({"error": "Authentication required"}, status_code=401)
+
+    try:
+        params = request.query_params
+        try:
+            queue_id = int(params["queue_id"]) if params.get("queue_id") else None
+            limit = int(params.get("limit", 100))
+        except ValueError:
+            return JSONResponse({"error": "Invalid queue_id or limit"}, status_code=400)
+        if limit < 0:
+            return JSONResponse({"error": "Invalid queue_id or limit"}, status_code=400)
+
+        etag = await get_etag(
+            request,
+            [
+                annotations_table_name,
+                queues_table_name,
+                queue_runs_table_name,
+                users_table_name,
+            ],
+        )
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
+
+        agreement = await get_agreement(queue_id, limit)
+        return with_etag(JSONResponse(agreement), etag)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.get("/api/ingest/status")
+async def get_ingest_status_api(request: Request):
+    """API endpoint to get when new runs were last and will next be synced from S3"""
+    auth_redirect = require_auth(request)
+    if auth_redirect:
+        return JSONResponse({"error": "Authentication required"}, status_code=401)
+
+    return JSONResponse(ingest_scheduler.status())
+
+
+@app.get("/api/debug/pool")
+async def get_pool_stats_api(request: Request):
+    """API endpoint to get database connection pool usage and wait times"""
+    auth_redirect = require_auth(request)
+    if auth_redirect:
+        return JSONResponse({"error": "Authentication required"}, status_code=401)
+
+    return JSONResponse(get_db_pool_stats())
+
+
+def require_admin_api(request: Request):
+    """Get the error response for a request by someone other than an admin, if any"""
+    if require_auth(request):
+        return JSONResponse({"error": "Authentication required"}, status_code=401)
+    if not is_admin(request):
+        return JSONResponse({"error": "Admin access required"}, status_code=403)
+    return None
+
+
+@app.get("/api/debug/queries")
+async def get_query_stats_api(request: Request):
+    """
+    API endpoint to get the timings, row counts and callers of the SQL statements
+    run since the stats were reset, with the latest slow queries and their plans
+    """
+    error_response = require_admin_api(request)
+    if error_response:
+        return error_response
+
+    params = request.query_params
+    sort_by = params.get("sort", "total_ms")
+    if sort_by not in ("total_ms", "mean_ms", "max_ms", "calls", "rows"):
+        return JSONResponse({"error": "Invalid sort"}, status_code=400)
+    try:
+        limit = int(params.get("limit", 50))
+    except ValueError:
+        return JSONResponse({"error": "Invalid limit"}, status_code=400)
+
+    return JSONResponse(query_stats.stats(limit, sort_by))
+
+
+@app.post("/api/debug/queries")
+async def update_query_stats_api(request: Request):
+    """
+    API endpoint to turn the SQL instrumentation on or off ("enabled"), change
+    the slow query threshold ("slow_query_ms") or reset the stats ("reset")
+    """
+    error_response = require_admin_api(request)
+    if error_response:
+        return error_response
+
+    try:
+        body = await request.json()
+        enabled = body.get("enabled", query_stats.enabled)
+        threshold = float(body.get("slow_query_ms", query_stats.slow_query_ms))
+    except (ValueError, TypeError, AttributeError):
+        return JSONResponse({"error": "Invalid request body"}, status_code=400)
+    if not isinstance(enabled, bool) or threshold < 0:
+        return JSONResponse({"error": "Invalid request body"}, status_code=400)
+
+    query_stats.enabled = enabled
+    query_stats.slow_query_ms = threshold
+    if body.get("reset"):
+        query_stats.reset()
+
+    return JSONResponse(
+        {"enabled": query_stats.enabled, "slow_query_ms": query_stats.slow_query_ms}
+    )
+
+
+@app.get("/api/debug/compression")
+async def get_compression_stats_api(request: Request):
+    """API endpoint to get the bytes sent before and after response compression"""
+    auth_redirect = require_auth(request)
+    if auth_redirect:
+        return JSONResponse({"error": "Authentication required"}, status_code=401)
+
+    return JSONResponse(compression_stats.stats())
+
+
+@app.get("/metrics")
+async def get_metrics_prometheus(request: Request):
+    """
+    Request counts, errors, requests in flight and per route latency histograms
+    in the Prometheus text format
+    """
+    if (
+        metrics_token
+        and request.headers.get("authorization") != f"Bearer {metrics_token}"
+    ):
+        return Response("Unauthorized", status_code=401, media_type="text/plain")
+
+    return Response(request_metrics.render(), media_type=prometheus_content_type)
+
+
+@app.get("/healthz")
+async def healthz():
+    """
+    Health check for the container, which only runs a trivial query on the
+    database instead of rendering a page
+    """
+    try:
+        async with get_new_db_connection(readonly=True) as conn:
+            cursor = await conn.execute("SELECT 1")
+            await cursor.fetchone()
+    except Exception as e:
+        return Response(
+            f"Database unavailable: {e}", status_code=503, media_type="text/plain"
+        )
+
+    return Response("ok", media_type="text/plain")
+
+
 @app.post("/api/queues")
 async def create_queue_api(request: Request):
     """API endpoint to create a new queue"""
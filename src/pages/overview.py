@@ -34,9 +34,41 @@ def overview_page(request):
                 </div>
             </div>
 
+            <!-- Trends -->
+            <div class="bg-white rounded-lg shadow p-6 mb-8">
+                <div class="flex items-center justify-between mb-6">
+                    <h3 class="text-lg font-medium text-gray-900">Trends</h3>
+                    <div class="flex items-center space-x-2">
+                        <select id="trendsGranularity" onchange="loadTrends()" class="border border-gray-300 rounded-md px-2 py-1 text-sm text-gray-700">
+                            <option value="day">Daily</option>
+                            <option value="week">Weekly</option>
+                        </select>
+                        <select id="trendsDays" onchange="loadTrends()" class="border border-gray-300 rounded-md px-2 py-1 text-sm text-gray-700">
+                            <option value="30">Last 30 days</option>
+                            <option value="90" selected>Last 90 days</option>
+                            <option value="180">Last 180 days</option>
+                            <option value="365">Last year</option>
+                        </select>
+                    </div>
+                </div>
+                <div id="trendsCharts" class="space-y-6">
+                    <div class="flex items-center justify-center py-12">
+                        <div class="animate-spin rounded-full h-6 w-6 border-b-2 border-blue-600"></div>
+                    </div>
+                </div>
+            </div>
+
             <!-- Annotation Leaderboard -->
             <div class="bg-white rounded-lg shadow p-6 mb-8">
-                <h3 class="text-lg font-medium text-gray-900 mb-6">Annotation Leaderboard</h3>
+                <div class="flex items-center justify-between mb-6">
+                    <h3 class="text-lg font-medium text-gray-900">Annotation Leaderboard</h3>
+                    <select id="leaderboardWindow" onchange="loadLeaderboard()" class="border border-gray-300 rounded-md px-2 py-1 text-sm text-gray-700">
+                        <option value="all">All time</option>
+                        <option value="7">Last 7 days</option>
+                        <option value="30">Last 30 days</option>
+                        <option value="90">Last 90 days</option>
+                    </select>
+                </div>
                 <div class="overflow-x-auto">
                     <table class="min-w-full divide-y divide-gray-200">
                         <thead class="bg-gray-50">
@@ -217,8 +249,96 @@ def overview_page(request):
                     </div>
                 `;
                 
-                // Update leaderboard
-                updateLeaderboard(metrics.leaderboard || []);
+                // Update leaderboard, unless a window other than all time is selected
+                if (document.getElementById('leaderboardWindow').value === 'all') {{
+                    updateLeaderboard(metrics.leaderboard || []);
+                }}
+            }}
+
+            // Load the leaderboard of the selected window
+            async function loadLeaderboard() {{
+                const days = document.getElementById('leaderboardWindow').value;
+                if (days === 'all') {{
+                    loadMetrics();
+                    return;
+                }}
+
+                try {{
+                    const response = await fetch(`/api/metrics/trends?days=${{days}}`);
+                    const data = await response.json();
+                    if (response.ok) {{
+                        updateLeaderboard(data.leaderboard || []);
+                    }} else {{
+                        console.error('Error loading leaderboard:', data.error);
+                    }}
+                }} catch (error) {{
+                    console.error('Error loading leaderboard:', error);
+                }}
+            }}
+
+            // Load the time series of runs and annotations
+            async function loadTrends() {{
+                const granularity = document.getElementById('trendsGranularity').value;
+                const days = document.getElementById('trendsDays').value;
+
+                try {{
+                    const response = await fetch(`/api/metrics/trends?granularity=${{granularity}}&days=${{days}}`);
+                    const data = await response.json();
+                    if (response.ok) {{
+                        updateTrends(data);
+                    }} else {{
+                        console.error('Error loading trends:', data.error);
+                    }}
+                }} catch (error) {{
+                    console.error('Error loading trends:', error);
+                }}
+            }}
+
+            function renderBarChart(title, values, labels, color, describe) {{
+                const max = Math.max(1, ...values);
+                const total = values.reduce((sum, value) => sum + value, 0);
+                const bars = values.map((value, index) => `
+                    <div class="flex-1 flex flex-col justify-end h-full" title="${{describe(index)}}">
+                        <div class="${{color}} rounded-t" style="height: ${{(value / max) * 100}}%; min-height: ${{value > 0 ? 1 : 0}}px"></div>
+                    </div>
+                `).join('');
+
+                return `
+                    <div>
+                        <div class="flex items-baseline justify-between mb-2">
+                            <p class="text-sm font-medium text-gray-500">${{title}}</p>
+                            <p class="text-sm text-gray-900">${{total.toLocaleString()}}</p>
+                        </div>
+                        <div class="flex items-end h-24 gap-px border-b border-gray-200">${{bars}}</div>
+                        <div class="flex justify-between mt-1 text-xs text-gray-400">
+                            <span>${{labels[0]}}</span>
+                            <span>${{labels[labels.length - 1]}}</span>
+                        </div>
+                    </div>
+                `;
+            }}
+
+            function updateTrends(trends) {{
+                const labels = trends.buckets;
+                const annotations = trends.annotations;
+
+                document.getElementById('trendsCharts').innerHTML = [
+                    renderBarChart(
+                        'Runs',
+                        trends.runs,
+                        labels,
+                        'bg-blue-500',
+                        (i) => `${{labels[i]}}: ${{trends.runs[i]}} runs`
+                    ),
+                    renderBarChart(
+                        'Annotations',
+                        annotations.total,
+                        labels,
+                        'bg-purple-500',
+                        (i) => `${{labels[i]}}: ${{annotations.total[i]}} annotations (${{annotations.correct[i]}} correct, ${{annotations.wrong[i]}} incorrect)` +
+                            (annotations.accuracy[i] === null ? '' : `, ${{annotations.accuracy[i]}}% accuracy`)
+                    ),
+                ].join('');
             }}
 
             function showMetricsError(errorMessage) {{
@@ -295,6 +415,7 @@ def overview_page(request):
             // Load metrics when page loads
             window.addEventListener('DOMContentLoaded', function() {{
                 loadMetrics();
+                loadTrends();
             }});
         </script>
     </body>
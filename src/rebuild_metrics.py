@@ -0,0 +1,5 @@
+from db import rebuild_metrics
+import asyncio
+
+if __name__ == "__main__":
+    asyncio.run(rebuild_metrics())
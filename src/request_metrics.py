@@ -0,0 +1,274 @@
+from starlette.responses import JSONResponse as BaseJSONResponse
+from starlette.routing import Match
+from contextvars import ContextVar
+from bisect import bisect_left
+from dotenv import load_dotenv
+from db.instrumentation import DBTimer, db_timer
+import os
+import time
+
+load_dotenv()
+
+# Upper bounds, in seconds, of the buckets of the latency histograms
+latency_buckets = tuple(
+    sorted(
+        float(bound)
+        for bound in os.getenv(
+            "METRICS_LATENCY_BUCKETS",
+            "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10",
+        ).split(",")
+    )
+)
+
+# When set, /metrics can only be read with an "Authorization: Bearer <token>" header
+metrics_token = os.getenv("METRICS_TOKEN") or None
+
+prometheus_content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+# Requests are labelled with the path template of their route, and the ones
+# matching no route or with an unknown method are counted together, so that
+# scans of random URLs do not create new series
+unmatched_route = "unmatched"
+known_methods = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+
+# Status of the requests whose client went away before a response was started,
+# as nginx logs them
+client_closed_status = 499
+
+# Timings of the request being handled
+request_timings = ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    """
+    Where the time of one request goes: the time spent in the database, from
+    db.instrumentation, and the time spent encoding the JSON responses.
+    """
+
+    __slots__ = ("start", "db", "serialization")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db = DBTimer()
+        self.serialization = 0.0
+
+    def server_timing(self, total: float) -> str:
+        return (
+            f"total;dur={total * 1000:.1f}, "
+            f"db;dur={self.db.seconds * 1000:.1f}, "
+            f"serialize;dur={self.serialization * 1000:.1f}"
+        )
+
+
+class JSONResponse(BaseJSONResponse):
+    """
+    JSONResponse adding the time taken to encode its content to the
+    serialization time of the request being handled.
+    """
+
+    def __init__(self, *args, **kwargs):
+        start = time.perf_counter()
+        super().__init__(*args, **kwargs)
+        timings = request_timings.get()
+        if timings is not None:
+            timings.serialization += time.perf_counter() - start
+
+
+class Histogram:
+    """
+    Counts of observations per bucket (not cumulative, the last one being
+    +Inf) and their sum.
+    """
+
+    __slots__ = ("counts", "sum")
+
+    def __init__(self, num_buckets: int):
+        self.counts = [0] * (num_buckets + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float, buckets: tuple):
+        self.counts[bisect_left(buckets, value)] += 1
+        self.sum += value
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: dict) -> str:
+    return ",".join(f'{name}="{escape_label(value)}"' for name, value in labels.items())
+
+
+class RequestMetrics:
+    """
+    Request counts by route, method and status, errors, requests in flight and
+    per route histograms of the total, database and serialization time of the
+    requests, exported in the Prometheus text format.
+    """
+
+    histograms = (
+        (
+            "http_request_duration_seconds",
+            "Time to handle a request, until its response was sent",
+        ),
+        (
+            "http_request_db_duration_seconds",
+            "Time spent by a request waiting for or holding database connections",
+        ),
+        (
+            "http_request_serialization_duration_seconds",
+            "Time spent by a request encoding its JSON response",
+        ),
+    )
+
+    def __init__(self, buckets: tuple = latency_buckets):
+        self.buckets = buckets
+        self.in_flight = 0
+        self.requests = {}
+        self.errors = {}
+        self.latencies = {}
+
+    def record(
+        self,
+        method: str,
+        route: str,
+        status: int,
+        elapsed: float,
+        timings: RequestTimings,
+        failed: bool,
+    ):
+        if method not in known_methods:
+            method, route = "other", unmatched_route
+
+        key = (method, route, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        if failed or status >= 500:
+            self.errors[(method, route)] = self.errors.get((method, route), 0) + 1
+
+        histograms = self.latencies.get((method, route))
+        if histograms is None:
+            histograms = self.latencies[(method, route)] = [
+                Histogram(len(self.buckets)) for _ in self.histograms
+            ]
+        for histogram, value in zip(
+            histograms, (elapsed, timings.db.seconds, timings.serialization)
+        ):
+            histogram.observe(value, self.buckets)
+
+    def render(self) -> str:
+        lines = [
+            "# HELP http_requests_in_flight Requests being handled",
+            "# TYPE http_requests_in_flight gauge",
+            f"http_requests_in_flight {self.in_flight}",
+            "# HELP http_requests_total Requests handled",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route, status), count in sorted(self.requests.items()):
+            labels = format_labels(
+                {"method": method, "route": route, "status": str(status)}
+            )
+            lines.append(f"http_requests_total{{{labels}}} {count}")
+
+        lines += [
+            "# HELP http_request_errors_total Requests that failed with a server error",
+            "# TYPE http_request_errors_total counter",
+        ]
+        for (method, route), count in sorted(self.errors.items()):
+            labels = format_labels({"method": method, "route": route})
+            lines.append(f"http_request_errors_total{{{labels}}} {count}")
+
+        bounds = [repr(bound) for bound in self.buckets] + ["+Inf"]
+        latencies = sorted(self.latencies.items())
+        for index, (name, description) in enumerate(self.histograms):
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+            for (method, route), histograms in latencies:
+                histogram = histograms[index]
+                labels = format_labels({"method": method, "route": route})
+                cumulative = 0
+                for bound, count in zip(bounds, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{labels}}} {histogram.sum!r}")
+                lines.append(f"{name}_count{{{labels}}} {cumulative}")
+
+        return "\n".join(lines) + "\n"
+
+
+request_metrics = RequestMetrics()
+
+
+class RequestTimingMiddleware:
+    """
+    ASGI middleware timing every request: the total time, the time spent in
+    the database and the time spent encoding JSON responses are sent in a
+    Server-Timing header and recorded in the per route histograms of
+    request_metrics, along with the requests in flight and the errors.
+
+    The header is sent with the start of the response, so for streamed
+    responses it only covers the time until the first chunk, while the
+    histograms cover the whole response.
+    """
+
+    def __init__(self, app, router=None, metrics: RequestMetrics = None):
+        self.app = app
+        # Router of the app, whose routes label requests with their path
+        # template; its list of routes is replaced as routes are added
+        self.router = router
+        self.metrics = metrics or request_metrics
+
+    def get_route(self, scope) -> str:
+        partial = None
+        for route in self.router.routes if self.router else ():
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+            # The path matches but not the method
+            if match == Match.PARTIAL and partial is None:
+                partial = route.path
+        return partial or unmatched_route
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        timings_token = request_timings.set(timings)
+        db_timer_token = db_timer.set(timings.db)
+        status = None
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                elapsed = time.perf_counter() - timings.start
+                # The headers of a response object may be sent more than once
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"server-timing", timings.server_timing(elapsed).encode()),
+                ]
+            await send(message)
+
+        self.metrics.in_flight += 1
+        failed = False
+        try:
+            await self.app(scope, receive, send_with_timing)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - timings.start
+            self.metrics.in_flight -= 1
+            request_timings.reset(timings_token)
+            db_timer.reset(db_timer_token)
+
+            if status is None:
+                status = 500 if failed else client_closed_status
+            self.metrics.record(
+                scope["method"],
+                self.get_route(scope),
+                status,
+                elapsed,
+                timings,
+                failed,
+            )
@@ -0,0 +1,422 @@
+from starlette.datastructures import Headers, MutableHeaders
+from dotenv import load_dotenv
+from email.utils import formatdate
+import hashlib
+import mimetypes
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+load_dotenv()
+
+# Responses smaller than this are sent uncompressed, since compressing them
+# saves less than it costs
+compression_min_size = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+gzip_level = int(os.getenv("COMPRESSION_GZIP_LEVEL", 6))
+brotli_quality = int(os.getenv("COMPRESSION_BROTLI_QUALITY", 5))
+
+# Static files are compressed once at the highest level and served from memory
+precompress_static = os.getenv("COMPRESSION_PRECOMPRESS_STATIC", "1") == "1"
+static_max_size = 1024 * 1024
+
+compressible_types = {
+    "text/html",
+    "text/css",
+    "text/plain",
+    "text/csv",
+    "text/javascript",
+    "application/javascript",
+    "application/json",
+    "application/x-ndjson",
+    "application/vnd.apache.arrow.stream",
+    "image/svg+xml",
+}
+
+# ETags of compressed responses get the encoding appended, since each encoding
+# is a different representation of the resource
+etag_suffixes = {"gzip": "-gzip", "br": "-br"}
+
+
+def negotiate_encoding(accept_encoding: str):
+    """
+    Pick the content encoding of a response from the Accept-Encoding header of
+    the request: brotli when the client accepts it and the brotli package is
+    installed, then gzip, or None to send the response as is.
+    """
+    accepted = set()
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                pass
+        accepted.add(name.strip().lower())
+
+    if brotli is not None and ("br" in accepted or "*" in accepted):
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+class Compressor:
+    """
+    Incremental gzip or brotli compressor.
+    """
+
+    def __init__(self, encoding: str, level: int = None):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(
+                quality=brotli_quality if level is None else level
+            )
+        else:
+            # wbits=31 writes the gzip header and trailer
+            self._compressor = zlib.compressobj(
+                gzip_level if level is None else level, zlib.DEFLATED, 31
+            )
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        """
+        Compress a chunk of data; with flush, everything compressed so far is
+        written out, so that streamed chunks reach the client without delay.
+        """
+        if self.encoding == "br":
+            output = self._compressor.process(data)
+            return output + self._compressor.flush() if flush else output
+
+        output = self._compressor.compress(data)
+        return output + self._compressor.flush(zlib.Z_SYNC_FLUSH) if flush else output
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def compress(data: bytes, encoding: str, level: int = None) -> bytes:
+    compressor = Compressor(encoding, level)
+    return compressor.compress(data) + compressor.finish()
+
+
+class CompressionStats:
+    """
+    Counts of the bytes sent before and after compression, per encoding.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.encodings = {}
+        self.static_cache_hits = 0
+
+    def record(self, encoding: str, size: int, compressed_size: int):
+        stats = self.encodings.setdefault(
+            encoding or "identity", {"responses": 0, "bytes_in": 0, "bytes_out": 0}
+        )
+        stats["responses"] += 1
+        stats["bytes_in"] += size
+        stats["bytes_out"] += compressed_size
+
+    def stats(self):
+        bytes_in = sum(stats["bytes_in"] for stats in self.encodings.values())
+        bytes_out = sum(stats["bytes_out"] for stats in self.encodings.values())
+        return {
+            "bytes_in": bytes_in,
+            "bytes_out": bytes_out,
+            "bytes_saved": bytes_in - bytes_out,
+            "ratio": round(bytes_out / bytes_in, 4) if bytes_in else 1,
+            "static_cache_hits": self.static_cache_hits,
+            "encodings": self.encodings,
+        }
+
+
+compression_stats = CompressionStats()
+
+
+class StaticCompressionCache:
+    """
+    Compressed copies of the compressible files in a static directory, made
+    once at the highest compression level and invalidated when a file changes.
+    """
+
+    def __init__(self, static_dir: str):
+        self.static_dir = os.path.realpath(static_dir)
+        self._entries = {}
+
+    def get(self, path: str, encoding: str):
+        """
+        Get the compressed file served at a URL path, as (body, content type,
+        uncompressed size, ETag, Last-Modified), or None if it is not a
+        compressible static file. The ETag is the one FileResponse gives the
+        uncompressed file, with the encoding appended.
+        """
+        file_path = os.path.realpath(os.path.join(self.static_dir, path.lstrip("/")))
+        if not file_path.startswith(self.static_dir + os.sep):
+            return None
+
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+
+        content_type, _ = mimetypes.guess_type(file_path)
+        if (
+            content_type not in compressible_types
+            or stat.st_size > static_max_size
+            or stat.st_size < compression_min_size
+        ):
+            return None
+
+        key = (file_path, encoding)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != (stat.st_mtime_ns, stat.st_size):
+            with open(file_path, "rb") as file:
+                data = file.read()
+            level = 11 if encoding == "br" else 9
+            entry = (
+                (stat.st_mtime_ns, stat.st_size),
+                compress(data, encoding, level),
+                add_etag_suffix(get_file_etag(stat), encoding),
+                formatdate(stat.st_mtime, usegmt=True),
+            )
+            self._entries[key] = entry
+        else:
+            compression_stats.static_cache_hits += 1
+
+        return entry[1], content_type, stat.st_size, entry[2], entry[3]
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing responses with gzip, or brotli when available,
+    as negotiated with the client's Accept-Encoding header.
+
+    Responses of compressible types (JSON, HTML, ...) sent in one piece are
+    compressed when they are at least minimum_size bytes. Streamed responses
+    are compressed chunk by chunk, so they keep streaming. With a static
+    directory, compressible static files are served from an in-memory cache of
+    precompressed copies without reaching the app.
+    """
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = compression_min_size,
+        static_dir: str = None,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.static_cache = StaticCompressionCache(static_dir) if static_dir else None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        encoding = negotiate_encoding(headers.get("accept-encoding", ""))
+
+        # The app compares If-None-Match with the ETags it generates, which do
+        # not include the encoding suffix
+        client_etags = {}
+        if_none_match = headers.get("if-none-match")
+        if if_none_match:
+            tags = []
+            for tag in if_none_match.split(","):
+                tag = tag.strip()
+                base_tag = strip_etag_suffix(tag)
+                client_etags[base_tag] = tag
+                tags.append(base_tag)
+            scope = {**scope, "headers": list(scope["headers"])}
+            request_headers = MutableHeaders(scope=scope)
+            request_headers["if-none-match"] = ", ".join(tags)
+
+        if (
+            encoding
+            and self.static_cache
+            and scope["method"] in ("GET", "HEAD")
+            and await self._send_static(scope, encoding, client_etags, send)
+        ):
+            return
+
+        responder = CompressionResponder(
+            self.app, encoding, self.minimum_size, client_etags
+        )
+        await responder(scope, receive, send)
+
+    async def _send_static(self, scope, encoding: str, client_etags: dict, send):
+        cached = self.static_cache.get(scope["path"], encoding)
+        if cached is None:
+            return False
+
+        body, content_type, size, etag, last_modified = cached
+        headers = [
+            (b"etag", etag.encode("latin-1")),
+            (b"last-modified", last_modified.encode("latin-1")),
+            (b"vary", b"Accept-Encoding"),
+        ]
+
+        # The client already has this encoding of the file
+        if etag in client_etags.values() or "*" in client_etags:
+            await send(
+                {"type": "http.response.start", "status": 304, "headers": headers}
+            )
+            await send({"type": "http.response.body", "body": b""})
+            return True
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", content_type.encode("latin-1")),
+                    (b"content-encoding", encoding.encode("latin-1")),
+                    (b"content-length", str(len(body)).encode("latin-1")),
+                    *headers,
+                ],
+            }
+        )
+        await send(
+            {
+                "type": "http.response.body",
+                "body": body if scope["method"] == "GET" else b"",
+            }
+        )
+        compression_stats.record(encoding, size, len(body))
+        return True
+
+
+def get_file_etag(stat: os.stat_result):
+    """
+    Get the ETag that Starlette's FileResponse sends for a file.
+    """
+    etag_base = f"{stat.st_mtime}-{stat.st_size}"
+    return f'"{hashlib.md5(etag_base.encode(), usedforsecurity=False).hexdigest()}"'
+
+
+def strip_etag_suffix(tag: str):
+    for suffix in etag_suffixes.values():
+        if tag.endswith(f'{suffix}"'):
+            return tag[: -len(suffix) - 1] + '"'
+    return tag
+
+
+def add_etag_suffix(tag: str, encoding: str):
+    if not tag.endswith('"'):
+        return tag
+    return tag[:-1] + etag_suffixes[encoding] + '"'
+
+
+class CompressionResponder:
+    """
+    Wraps the send of one request, deciding from the response headers and its
+    first body chunk whether and how to compress it.
+    """
+
+    def __init__(self, app, encoding: str, minimum_size: int, client_etags: dict):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.client_etags = client_etags
+
+        self.send = None
+        self.start_message = None
+        self.compressor = None
+        self.passthrough = False
+        self.size = 0
+        self.compressed_size = 0
+
+    async def __call__(self, scope, receive, send):
+        self.send = send
+        await self.app(scope, receive, self.send_with_compression)
+
+    async def send_with_compression(self, message):
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            headers = MutableHeaders(raw=message["headers"])
+
+            # A 304 carries the ETag of the representation the client has
+            etag = headers.get("etag")
+            if message["status"] == 304 and etag in self.client_etags:
+                headers["etag"] = self.client_etags[etag]
+
+            content_type = headers.get("content-type", "").split(";")[0].strip()
+            compressible = (
+                message["status"] == 200
+                and "content-encoding" not in headers
+                and content_type in compressible_types
+            )
+            # Caches must tell apart the compressed and uncompressed versions,
+            # including when this one is sent uncompressed
+            if compressible:
+                headers.add_vary_header("Accept-Encoding")
+
+            self.passthrough = self.encoding is None or not compressible
+            if self.passthrough:
+                await self.send(message)
+            return
+
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        self.size += len(body)
+
+        if self.passthrough:
+            self.compressed_size += len(body)
+            await self.send(message)
+            if not more_body:
+                compression_stats.record(None, self.size, self.compressed_size)
+            return
+
+        if self.start_message is not None:
+            start_message, self.start_message = self.start_message, None
+
+            if not more_body and len(body) < self.minimum_size:
+                self.passthrough = True
+                await self.send(start_message)
+                await self.send(message)
+                compression_stats.record(None, self.size, self.size)
+                return
+
+            headers = MutableHeaders(raw=start_message["headers"])
+            headers["content-encoding"] = self.encoding
+            if "etag" in headers:
+                headers["etag"] = add_etag_suffix(headers["etag"], self.encoding)
+
+            self.compressor = Compressor(self.encoding)
+            if more_body:
+                # Streamed responses are sent chunk by chunk, without a length
+                del headers["content-length"]
+            else:
+                body = self.compressor.compress(body) + self.compressor.finish()
+                headers["content-length"] = str(len(body))
+                await self.send(start_message)
+                await self.send({"type": "http.response.body", "body": body})
+                compression_stats.record(self.encoding, self.size, len(body))
+                return
+
+            await self.send(start_message)
+
+        if more_body:
+            body = self.compressor.compress(body, flush=True)
+        else:
+            body = self.compressor.compress(body) + self.compressor.finish()
+
+        self.compressed_size += len(body)
+        await self.send(
+            {"type": "http.response.body", "body": body, "more_body": more_body}
+        )
+        if not more_body:
+            compression_stats.record(self.encoding, self.size, self.compressed_size)
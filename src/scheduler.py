@@ -0,0 +1,179 @@
+from cron import add_new_runs_from_s3, ingest_lock
+from utils import get_s3_client
+from dotenv import load_dotenv
+from datetime import datetime, timezone
+import asyncio
+import os
+import random
+import time
+
+load_dotenv()
+
+# Minutes between two syncs of new runs from S3 run by the app itself; 0 (the
+# default) leaves the syncs to cron.py
+ingest_interval_minutes = float(os.getenv("INGEST_INTERVAL_MINUTES", 0))
+
+# Delay before retrying a failed sync, doubled after every consecutive failure
+# up to the interval
+ingest_retry_base_seconds = float(os.getenv("INGEST_RETRY_BASE_SECONDS", 30))
+
+# The first sync runs within this many seconds of the app starting, so that
+# several app processes started together do not all sync at once
+ingest_start_delay_seconds = 60
+
+
+def to_isoformat(timestamp: float):
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+class IngestScheduler:
+    """
+    Syncs new runs from S3 inside the app process every interval_minutes,
+    instead of a separate cron job, so that new traces show up within an
+    interval and each sync reuses the same S3 client and the app's warm
+    database connections.
+
+    A failed sync is retried after an exponential backoff with jitter, capped
+    at the interval. A sync is never started while another one is running,
+    whether in this process, in another app process or from cron.py.
+    """
+
+    def __init__(
+        self,
+        interval_minutes: float = ingest_interval_minutes,
+        retry_base_seconds: float = ingest_retry_base_seconds,
+    ):
+        self.interval = interval_minutes * 60
+        self.retry_base = retry_base_seconds
+
+        self.task = None
+        self.s3_client = None
+        self.running = False
+
+        self.last_started = None
+        self.last_finished = None
+        self.last_success = None
+        self.last_error = None
+        self.last_result = None
+        self.next_run = None
+        self.consecutive_failures = 0
+        self.num_syncs = 0
+        self.num_failures = 0
+        self.num_skipped = 0
+
+    @property
+    def enabled(self):
+        return self.interval > 0
+
+    async def start(self):
+        if not self.enabled or self.task is not None:
+            return
+
+        self.task = asyncio.create_task(self._run_forever())
+        print(f"Syncing new runs from S3 every {self.interval / 60:g} minutes")
+
+    async def stop(self):
+        if self.task is None:
+            return
+
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        self.next_run = None
+
+    def get_retry_delay(self):
+        """
+        Get the delay before retrying after consecutive failures: the backoff
+        doubles with every failure, up to the interval, and a random half of it
+        is added so that processes failing together do not retry together.
+        """
+        backoff = min(
+            self.retry_base * 2 ** (self.consecutive_failures - 1), self.interval
+        )
+        return random.uniform(backoff / 2, backoff)
+
+    async def _run_forever(self):
+        delay = random.uniform(0, min(ingest_start_delay_seconds, self.interval))
+        while True:
+            self.next_run = time.time() + delay
+            await asyncio.sleep(delay)
+            self.next_run = None
+
+            succeeded = await self.run_once()
+            delay = self.interval if succeeded is not False else self.get_retry_delay()
+
+    async def run_once(self):
+        """
+        Sync new runs from S3 now, unless a sync is already running.
+
+        Returns:
+            True if the sync succeeded, False if it failed and None if it was
+            skipped because another sync was running
+        """
+        if self.running:
+            self.num_skipped += 1
+            return None
+
+        self.running = True
+        try:
+            with ingest_lock() as locked:
+                if not locked:
+                    print("Another sync is already running, skipping")
+                    self.num_skipped += 1
+                    return None
+
+                return await self._sync()
+        finally:
+            self.running = False
+
+    async def _sync(self):
+        self.last_started = time.time()
+        try:
+            # Creating the client loads the botocore service models, which
+            # takes a while, so it is done once and off the event loop
+            if self.s3_client is None:
+                self.s3_client = await asyncio.to_thread(get_s3_client)
+
+            result = await add_new_runs_from_s3(s3_client=self.s3_client, pooled=True)
+        except Exception as e:
+            self.last_finished = time.time()
+            self.last_error = f"{type(e).__name__}: {e}"
+            self.consecutive_failures += 1
+            self.num_failures += 1
+            # The next attempt starts from a new client, in case this one broke
+            self.s3_client = None
+            print(f"Syncing runs from S3 failed: {self.last_error}")
+            return False
+
+        self.last_finished = time.time()
+        self.last_success = self.last_finished
+        self.last_error = None
+        self.last_result = result
+        self.consecutive_failures = 0
+        self.num_syncs += 1
+        return True
+
+    def status(self):
+        return {
+            "enabled": self.enabled,
+            "interval_minutes": self.interval / 60,
+            "running": self.running,
+            "last_started": to_isoformat(self.last_started),
+            "last_finished": to_isoformat(self.last_finished),
+            "last_success": to_isoformat(self.last_success),
+            "last_error": self.last_error,
+            "last_result": self.last_result,
+            "next_run": to_isoformat(self.next_run),
+            "consecutive_failures": self.consecutive_failures,
+            "num_syncs": self.num_syncs,
+            "num_failures": self.num_failures,
+            "num_skipped": self.num_skipped,
+        }
+
+
+ingest_scheduler = IngestScheduler()
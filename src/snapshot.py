@@ -0,0 +1,485 @@
+from db.config import (
+    data_root_dir,
+    sqlite_db_path,
+    runs_table_name,
+    annotations_table_name,
+    queues_table_name,
+    queue_runs_table_name,
+    users_table_name,
+    write_counters_table_name,
+)
+from dotenv import load_dotenv
+from datetime import date, timedelta
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import time
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+load_dotenv()
+
+snapshot_dir = os.getenv("SNAPSHOT_DIR", f"{data_root_dir}/snapshot")
+snapshot_batch_size = int(os.getenv("SNAPSHOT_BATCH_SIZE", 10000))
+
+# Runs are upserted for a while after they start (see INGEST_LOOKBACK_HOURS in
+# cron.py), so the partitions of the last few days already in the snapshot are
+# always written again
+snapshot_rewrite_days = int(os.getenv("SNAPSHOT_REWRITE_DAYS", 2))
+
+manifest_file_name = "manifest.json"
+
+
+def timestamp_sql(column: str):
+    # Normalized by SQLite (timezones converted to UTC) so that Arrow can parse it
+    return f"STRFTIME('%Y-%m-%d %H:%M:%f', {column})"
+
+
+def summary_field_sql(path: str):
+    return f"JSON_EXTRACT(r.summary, '$.{path}')"
+
+
+def get_snapshot_tables():
+    """
+    Columns of each table in the snapshot, as (name, Arrow type, SQL expression),
+    along with the table it is read from, the timestamp column whose date it is
+    partitioned by (None to write the table as a single file) and, for
+    partitioned tables, an SQL expression that changes when the rows of a
+    partition change.
+    """
+    string, int64, float64 = pa.string(), pa.int64(), pa.float64()
+    timestamp = pa.timestamp("ms")
+
+    return {
+        runs_table_name: {
+            "source": f"{runs_table_name} r",
+            "partition": "r.start_time",
+            # Runs only change through upserts, which are limited to the
+            # partitions rewritten every time
+            "fingerprint": "COUNT(*) || ':' || MAX(r.id)",
+            "columns": [
+                ("id", int64, "r.id"),
+                ("run_id", string, "r.run_id"),
+                ("start_time", timestamp, timestamp_sql("r.start_time")),
+                ("end_time", timestamp, timestamp_sql("r.end_time")),
+                ("created_at", timestamp, timestamp_sql("r.created_at")),
+                # Hot metadata fields, flattened into columns
+                ("org_id", int64, "r.org_id"),
+                ("org_name", string, summary_field_sql("metadata.org.name")),
+                ("course_id", int64, "r.course_id"),
+                ("course_name", string, summary_field_sql("metadata.course.name")),
+                ("run_type", string, "r.run_type"),
+                ("stage", string, summary_field_sql("metadata.stage")),
+                ("milestone", string, summary_field_sql("metadata.milestone")),
+                ("user_id", int64, summary_field_sql("metadata.user_id")),
+                ("user_email", string, "r.user_email"),
+                ("task_title", string, summary_field_sql("metadata.task_title")),
+                (
+                    "question_title",
+                    string,
+                    summary_field_sql("metadata.question_title"),
+                ),
+                ("question_purpose", string, "r.question_purpose"),
+                ("question_type", string, "r.question_type"),
+                ("question_input_type", string, "r.question_input_type"),
+                (
+                    "question_has_context",
+                    pa.bool_(),
+                    summary_field_sql("metadata.question_has_context"),
+                ),
+                ("message_count", int64, summary_field_sql("message_count")),
+                ("duration_seconds", float64, summary_field_sql("duration_seconds")),
+            ],
+        },
+        annotations_table_name: {
+            "source": f"""{annotations_table_name} a
+                JOIN {users_table_name} u ON a.user_id = u.id""",
+            "partition": "a.created_at",
+            # Annotations are updated in place, so their content is hashed
+            "fingerprint": "COUNT(*) || ':' || content_hash(GROUP_CONCAT(a.id || ':' || a.judgement || ':' || COALESCE(a.notes, ''), char(30)))",
+            "columns": [
+                ("id", int64, "a.id"),
+                ("run_id", int64, "a.run_id"),
+                ("user_id", int64, "a.user_id"),
+                ("user_name", string, "u.name"),
+                ("judgement", string, "a.judgement"),
+                ("notes", string, "a.notes"),
+                ("created_at", timestamp, timestamp_sql("a.created_at")),
+            ],
+        },
+        queues_table_name: {
+            "source": f"""{queues_table_name} q
+                JOIN {users_table_name} u ON q.user_id = u.id""",
+            "partition": None,
+            "columns": [
+                ("id", int64, "q.id"),
+                ("name", string, "q.name"),
+                ("description", string, "q.description"),
+                ("user_id", int64, "q.user_id"),
+                ("user_name", string, "u.name"),
+                ("created_at", timestamp, timestamp_sql("q.created_at")),
+            ],
+        },
+        queue_runs_table_name: {
+            "source": f"{queue_runs_table_name} qr",
+            "partition": None,
+            "columns": [
+                ("id", int64, "qr.id"),
+                ("queue_id", int64, "qr.queue_id"),
+                ("run_id", int64, "qr.run_id"),
+            ],
+        },
+    }
+
+
+def check_pyarrow():
+    if pa is None:
+        raise RuntimeError(
+            "Snapshots require the pyarrow package (pip install pyarrow)"
+        )
+
+
+def connect_readonly():
+    """
+    Open a read-only connection to the database, with the SQL functions used to
+    fingerprint partitions.
+    """
+    from db.blobs import content_hash
+
+    # The connection may be used from several threads, one at a time, when it
+    # serves a response streamed from the thread pool
+    conn = sqlite3.connect(
+        f"file:{sqlite_db_path}?mode=ro", uri=True, check_same_thread=False
+    )
+    conn.create_function("content_hash", 1, content_hash, deterministic=True)
+    return conn
+
+
+def cast_sql(expression: str, arrow_type):
+    """
+    Cast the value of a column to the SQLite type matching its Arrow type, since
+    the values extracted from the JSON metadata may be of any type.
+    """
+    if pa.types.is_integer(arrow_type) or pa.types.is_boolean(arrow_type):
+        return f"CAST({expression} AS INTEGER)"
+    if pa.types.is_floating(arrow_type):
+        return f"CAST({expression} AS REAL)"
+    if pa.types.is_string(arrow_type):
+        return f"CAST({expression} AS TEXT)"
+    return expression
+
+
+def get_schema(table: dict):
+    return pa.schema([(name, arrow_type) for name, arrow_type, _ in table["columns"]])
+
+
+def iter_record_batches(
+    conn,
+    table: dict,
+    conditions: list[str] = None,
+    params: list = None,
+    batch_size: int = snapshot_batch_size,
+):
+    """
+    Read the rows of a snapshot table matching the conditions as Arrow record
+    batches of up to batch_size rows, built column by column from the fetched
+    rows.
+    """
+    schema = get_schema(table)
+    columns = ", ".join(
+        cast_sql(expression, arrow_type)
+        for _, arrow_type, expression in table["columns"]
+    )
+    where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
+    order_column = table["columns"][0][2]
+
+    cursor = conn.execute(
+        f"SELECT {columns} FROM {table['source']}{where_clause} ORDER BY {order_column}",
+        params or [],
+    )
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+
+        arrays = []
+        for values, field in zip(zip(*rows), schema):
+            if pa.types.is_timestamp(field.type):
+                # Timestamps are parsed from the text normalized by SQLite
+                arrays.append(pa.array(values, pa.string()).cast(field.type))
+            elif pa.types.is_boolean(field.type):
+                arrays.append(pa.array(values, pa.int64()).cast(field.type))
+            else:
+                arrays.append(pa.array(values, field.type))
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def write_parquet(path: str, batches, schema):
+    """
+    Write record batches to a Parquet file, through a temporary file that then
+    replaces the file, so that readers never see a partially written file.
+
+    Returns:
+        Number of rows written
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    num_rows = 0
+    with pq.ParquetWriter(temp_path, schema, compression="zstd") as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+            num_rows += batch.num_rows
+    os.replace(temp_path, path)
+    return num_rows
+
+
+def get_partition_conditions(column: str, day: str, since: bool = False):
+    """
+    Conditions selecting the rows of the partition of a date (or, with since,
+    of every partition from that date onwards). The date of a timestamp with a
+    timezone may differ from the date it starts with by a day, so the rows are
+    first narrowed down on the column itself, which can use its index.
+    """
+    if day == "unknown":
+        return [f"DATE({column}) IS NULL"], []
+    if since:
+        return [f"{column} >= DATE(?1, '-1 day')", f"DATE({column}) >= ?1"], [day]
+    return [
+        f"{column} >= DATE(?1, '-1 day')",
+        f"{column} < DATE(?1, '+2 days')",
+        f"DATE({column}) = ?1",
+    ], [day]
+
+
+def get_partition_fingerprints(conn, table: dict) -> dict:
+    cursor = conn.execute(
+        f"""
+        SELECT COALESCE(DATE({table["partition"]}), 'unknown') AS day, {table["fingerprint"]}
+        FROM {table["source"]}
+        GROUP BY day
+        """
+    )
+    return dict(cursor.fetchall())
+
+
+def get_rewrite_start(partitions: dict):
+    """
+    Get the first date of the partitions always written again: the last
+    snapshot_rewrite_days days up to the newest partition already written.
+    """
+    days = [day for day in partitions if day != "unknown"]
+    if not days:
+        return None
+    return str(
+        date.fromisoformat(max(days)) - timedelta(days=snapshot_rewrite_days - 1)
+    )
+
+
+def write_snapshot_table(conn, name: str, table: dict, state: dict, output_dir: str):
+    """
+    Write one table of the snapshot, updating its entry in the manifest.
+
+    Partitioned tables are written as one file per date, under date=YYYY-MM-DD
+    directories, and only the partitions that are new, have changed or are
+    within the last snapshot_rewrite_days days are written.
+
+    Returns:
+        Tuple of (number of files written, number of rows written)
+    """
+    table_dir = os.path.join(output_dir, name)
+    schema = get_schema(table)
+
+    if table["partition"] is None:
+        num_rows = write_parquet(
+            os.path.join(table_dir, "part-0.parquet"),
+            iter_record_batches(conn, table),
+            schema,
+        )
+        state["rows"] = num_rows
+        return 1, num_rows
+
+    written = state.setdefault("partitions", {})
+    fingerprints = get_partition_fingerprints(conn, table)
+    rewrite_start = get_rewrite_start(written)
+
+    # Partitions whose rows have all been deleted
+    for day in set(written) - set(fingerprints):
+        shutil.rmtree(os.path.join(table_dir, f"date={day}"), ignore_errors=True)
+        del written[day]
+
+    num_files = 0
+    num_rows = 0
+    for day, fingerprint in sorted(fingerprints.items()):
+        if (
+            day in written
+            and written[day]["fingerprint"] == fingerprint
+            and (rewrite_start is None or day == "unknown" or day < rewrite_start)
+        ):
+            continue
+
+        conditions, params = get_partition_conditions(table["partition"], day)
+        rows = write_parquet(
+            os.path.join(table_dir, f"date={day}", "part-0.parquet"),
+            iter_record_batches(conn, table, conditions, params),
+            schema,
+        )
+        written[day] = {"fingerprint": fingerprint, "rows": rows}
+        num_files += 1
+        num_rows += rows
+
+    return num_files, num_rows
+
+
+def load_manifest(output_dir: str):
+    path = os.path.join(output_dir, manifest_file_name)
+    if not os.path.exists(path):
+        return {"tables": {}}
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_manifest(output_dir: str, manifest: dict):
+    path = os.path.join(output_dir, manifest_file_name)
+    with open(f"{path}.tmp", "w") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+
+def write_snapshot(output_dir: str = snapshot_dir, full: bool = False):
+    """
+    Write (or refresh) a Parquet snapshot of the runs, annotations, queues and
+    queue_runs tables under output_dir, to be read with pandas or any other
+    Parquet reader, e.g. pd.read_parquet(f"{output_dir}/runs").
+
+    Tables that have not been written to since the last snapshot, according to
+    their write counters, are skipped, and only the changed date partitions of
+    the others are written, unless full is set.
+
+    Returns:
+        Dictionary mapping each table to {"files": ..., "rows": ...} written
+    """
+    check_pyarrow()
+
+    manifest = {"tables": {}} if full else load_manifest(output_dir)
+    if full:
+        for name in get_snapshot_tables():
+            shutil.rmtree(os.path.join(output_dir, name), ignore_errors=True)
+
+    conn = connect_readonly()
+    try:
+        # Every table is read in the same transaction, so that the snapshot is
+        # consistent
+        conn.execute("BEGIN")
+        versions = dict(
+            conn.execute(
+                f"SELECT table_name, version FROM {write_counters_table_name}"
+            ).fetchall()
+        )
+
+        results = {}
+        for name, table in get_snapshot_tables().items():
+            state = manifest["tables"].setdefault(name, {})
+            # The user names of annotations and queues come from the users table
+            version = [versions.get(name), versions.get(users_table_name)]
+            if state.get("version") == version:
+                results[name] = {"files": 0, "rows": 0}
+                continue
+
+            num_files, num_rows = write_snapshot_table(
+                conn, name, table, state, output_dir
+            )
+            state["version"] = version
+            results[name] = {"files": num_files, "rows": num_rows}
+        conn.rollback()
+    finally:
+        conn.close()
+
+    save_manifest(output_dir, manifest)
+    return results
+
+
+class StreamSink:
+    """
+    Write-only file collecting the bytes written by an Arrow writer until they
+    are taken, so that a stream can be sent as it is written.
+    """
+
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_snapshot_stream(table_name: str, since: str = None):
+    """
+    Serialize a snapshot table as an Arrow IPC stream, batch by batch, limited
+    to the partitions from the date since (YYYY-MM-DD) onwards for the tables
+    partitioned by date.
+    """
+    check_pyarrow()
+    table = get_snapshot_tables()[table_name]
+
+    conditions, params = [], []
+    if since and table["partition"]:
+        conditions, params = get_partition_conditions(
+            table["partition"], since, since=True
+        )
+
+    conn = connect_readonly()
+    try:
+        sink = StreamSink()
+        with pa.ipc.new_stream(sink, get_schema(table)) as writer:
+            for batch in iter_record_batches(conn, table, conditions, params):
+                writer.write_batch(batch)
+                yield sink.take()
+        yield sink.take()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Write a Parquet snapshot of the runs, annotations and queues for offline analysis"
+    )
+    parser.add_argument("--output-dir", default=snapshot_dir)
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Write every table again instead of only the changed partitions",
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = write_snapshot(args.output_dir, full=args.full)
+    for name, result in results.items():
+        print(f"{name}: {result['rows']} rows in {result['files']} files")
+    print(
+        f"Snapshot written to {args.output_dir} in {time.perf_counter() - start:.1f}s"
+    )
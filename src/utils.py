@@ -1,5 +1,11 @@
 from dotenv import load_dotenv
 import boto3
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+from datetime import datetime, timezone
+import codecs
+import hashlib
+import json
 import os
 from os.path import join
 
@@ -8,13 +14,170 @@ if "S3_BUCKET_NAME" not in os.environ:
     load_dotenv(join(root_dir, ".env"))
 
 
+class LocalS3Client:
+    """
+    Filesystem-backed stand-in for the parts of the S3 client used by the data
+    pipeline, so that it can be run and tested offline. Keys are paths relative
+    to root_dir and the bucket name is ignored.
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+
+    def _path(self, key: str):
+        return join(self.root_dir, *key.split("/"))
+
+    def _etag(self, path: str):
+        md5 = hashlib.md5()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                md5.update(chunk)
+        return f'"{md5.hexdigest()}"'
+
+    def _last_modified(self, path: str):
+        return datetime.fromtimestamp(os.path.getmtime(path), tz=timezone.utc)
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = "", **kwargs):
+        contents = []
+        for dir_path, _, file_names in os.walk(self.root_dir):
+            for file_name in file_names:
+                path = join(dir_path, file_name)
+                key = os.path.relpath(path, self.root_dir).replace(os.sep, "/")
+                if key.startswith(Prefix):
+                    contents.append(
+                        {
+                            "Key": key,
+                            "ETag": self._etag(path),
+                            "LastModified": self._last_modified(path),
+                            "Size": os.path.getsize(path),
+                        }
+                    )
+
+        contents.sort(key=lambda item: item["Key"])
+        return {"Contents": contents, "IsTruncated": False}
+
+    def get_object(self, Bucket: str, Key: str, IfNoneMatch: str = None, **kwargs):
+        path = self._path(Key)
+        if not os.path.isfile(path):
+            raise ClientError(
+                {"Error": {"Code": "NoSuchKey", "Message": Key}}, "GetObject"
+            )
+
+        etag = self._etag(path)
+        if IfNoneMatch is not None and IfNoneMatch == etag:
+            raise ClientError(
+                {"Error": {"Code": "304", "Message": "Not Modified"}}, "GetObject"
+            )
+
+        size = os.path.getsize(path)
+        return {
+            "Body": StreamingBody(open(path, "rb"), size),
+            "ETag": etag,
+            "LastModified": self._last_modified(path),
+            "ContentLength": size,
+        }
+
+
+def get_s3_client():
+    """
+    Get the S3 client used by the data pipeline. Set S3_LOCAL_DIR to read the
+    objects from a local directory instead of S3.
+    """
+    local_dir = os.getenv("S3_LOCAL_DIR")
+    if local_dir:
+        return LocalS3Client(local_dir)
+
+    session = boto3.Session()
+    return session.client("s3")
+
+
+def is_not_modified_error(error: ClientError):
+    """
+    Whether an S3 error is the response to a conditional GET of an unchanged object
+    """
+    return error.response.get("Error", {}).get("Code") in ("304", "NotModified")
+
+
+def list_s3_objects(s3_client, prefix: str):
+    """
+    List all the objects in the S3 bucket under a key prefix, following pagination.
+    """
+    bucket_name = os.getenv("S3_BUCKET_NAME")
+    kwargs = {"Bucket": bucket_name, "Prefix": prefix}
+
+    while True:
+        response = s3_client.list_objects_v2(**kwargs)
+        yield from response.get("Contents", [])
+
+        if not response.get("IsTruncated"):
+            return
+        kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+
 def download_file_from_s3_as_bytes(key: str):
     """
     Download a file from S3 bucket
     """
     bucket_name = os.getenv("S3_BUCKET_NAME")
-    session = boto3.Session()
-    s3_client = session.client("s3")
+    s3_client = get_s3_client()
 
     response = s3_client.get_object(Bucket=bucket_name, Key=key)
     return response["Body"].read()
+
+
+def iter_json_array(chunks):
+    """
+    Incrementally parse a JSON array from an iterable of byte chunks, yielding
+    one element at a time, so that memory use depends on the size of the
+    largest element rather than on the size of the whole array.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+
+    buffer = ""
+    position = 0
+    started = False
+    exhausted = False
+
+    while True:
+        # Skip whitespace and the separators between elements
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+
+        if position < len(buffer):
+            if not started:
+                if buffer[position] != "[":
+                    raise ValueError("Expected a JSON array")
+                started = True
+                position += 1
+                continue
+
+            if buffer[position] == "]":
+                return
+
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+                # Only accept the element once the character following it has been
+                # read, since a number may continue in the next chunk
+                if exhausted or (end < len(buffer) and buffer[end] in " \t\r\n,]"):
+                    yield element
+                    position = end
+                    continue
+            except json.JSONDecodeError:
+                # The element is not complete yet, unless there is no more data
+                if exhausted:
+                    raise
+        elif exhausted:
+            raise ValueError("Unexpected end of JSON array")
+
+        # Drop what has already been parsed and read more data
+        buffer = buffer[position:]
+        position = 0
+
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+            buffer += text_decoder.decode(b"", final=True)
+        else:
+            buffer += text_decoder.decode(chunk)
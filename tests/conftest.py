@@ -0,0 +1,48 @@
+import asyncio
+import json
+import os
+import tempfile
+import pytest
+
+# The database path is read when the db package is imported, so the tests point
+# it at a temporary database before importing anything from src
+test_data_dir = tempfile.mkdtemp(prefix="sensai-evals-tests-")
+os.environ["SQLITE_DB_PATH"] = os.path.join(test_data_dir, "db.evals.sqlite")
+# Keeps utils from loading the S3 settings of a local .env file
+os.environ.setdefault("S3_BUCKET_NAME", "test-bucket")
+
+# Logins of the app, with the ids the users fixture gives them in the database
+test_users = {
+    "alice": {"id": 1, "password": "alice-password", "admin": True},
+    "bob": {"id": 2, "password": "bob-password"},
+}
+os.environ["USERS_JSON_PATH"] = os.path.join(test_data_dir, "users.json")
+with open(os.environ["USERS_JSON_PATH"], "w") as file:
+    json.dump(test_users, file)
+
+
+@pytest.fixture
+def db_path():
+    """Create an empty database for the test and return its path."""
+    from db import init_db
+    from db.config import sqlite_db_path
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(sqlite_db_path + suffix):
+            os.remove(sqlite_db_path + suffix)
+
+    asyncio.run(init_db())
+    return sqlite_db_path
+
+
+@pytest.fixture
+def users(db_path):
+    """Create the users of test_users in the database and return them."""
+    from db import create_user
+
+    async def create_users():
+        for name, user in test_users.items():
+            assert await create_user(name) == user["id"]
+
+    asyncio.run(create_users())
+    return test_users
@@ -0,0 +1,155 @@
+import asyncio
+import numpy as np
+import pytest
+from db import bulk_insert_runs, create_annotation, create_queue
+from db.agreement import compute_agreement, get_agreement
+
+# Judgements of annotators 1, 2 and 3 on runs 1 to 4:
+#   run 1: correct, correct
+#   run 2: correct, wrong
+#   run 3: wrong,   wrong
+#   run 4: correct, correct, wrong
+judgements = [
+    (1, 1, "correct"),
+    (1, 2, "correct"),
+    (2, 1, "correct"),
+    (2, 2, "wrong"),
+    (3, 1, "wrong"),
+    (3, 2, "wrong"),
+    (4, 1, "correct"),
+    (4, 2, "correct"),
+    (4, 3, "wrong"),
+]
+categories = ["correct", "wrong"]
+user_names = {1: "alice", 2: "bob", 3: "carol"}
+
+
+def get_pair(result, user_ids):
+    return next(pair for pair in result["pairwise"] if pair["user_ids"] == user_ids)
+
+
+def test_compute_agreement():
+    run_ids, user_ids, codes = (
+        np.array(column)
+        for column in zip(
+            *[
+                (run_id, user_id, categories.index(judgement))
+                for run_id, user_id, judgement in judgements
+            ]
+        )
+    )
+
+    result = compute_agreement(
+        run_ids, user_ids, codes, categories, user_names, max_disagreements=10
+    )
+
+    assert result["num_runs"] == 4
+    assert result["num_annotations"] == 9
+    assert result["num_annotators"] == 3
+    assert result["num_disagreements"] == 2
+    assert result["percent_agreement"] == 50.0
+
+    # 1 and 2 agree on 3 of 4 runs. 1 said correct 3/4 of the time and 2 half of
+    # the time, so they would agree by chance 3/4 * 1/2 + 1/4 * 1/2 = 1/2 of the
+    # time, and kappa = (3/4 - 1/2) / (1 - 1/2)
+    pair = get_pair(result, [1, 2])
+    assert pair["annotators"] == ["alice", "bob"]
+    assert pair["num_runs"] == 4
+    assert pair["observed_agreement"] == 0.75
+    assert pair["cohen_kappa"] == 0.5
+    # 3 only judged run 4, disagreeing with both, with no agreement by chance
+    assert get_pair(result, [1, 3])["cohen_kappa"] == 0.0
+    assert result["pairwise"][0]["user_ids"] == [1, 2]
+
+    # Per run agreement: 1, 0, 1 and 1/3, so 7/12 on average. 5 of the 9
+    # judgements are correct, so the agreement by chance is (5/9)^2 + (4/9)^2 =
+    # 41/81, and kappa = (7/12 - 41/81) / (1 - 41/81) = 0.15625
+    assert result["fleiss_kappa"] == pytest.approx(0.15625, abs=1e-4)
+
+    # Latest runs first
+    assert result["disagreements"] == [
+        {
+            "run_id": 4,
+            "judgements": {"alice": "correct", "bob": "correct", "carol": "wrong"},
+        },
+        {"run_id": 2, "judgements": {"alice": "correct", "bob": "wrong"}},
+    ]
+
+
+def test_kappa_is_undefined_without_variation():
+    run_ids = np.array([1, 1, 2, 2])
+    user_ids = np.array([1, 2, 1, 2])
+    codes = np.array([0, 0, 0, 0])
+
+    result = compute_agreement(run_ids, user_ids, codes, categories, user_names)
+
+    assert result["percent_agreement"] == 100.0
+    assert result["fleiss_kappa"] is None
+    assert result["pairwise"][0]["cohen_kappa"] is None
+    assert "disagreements" not in result
+
+
+def add_judgements(judgements):
+    async def run():
+        await bulk_insert_runs(
+            [
+                (f"span-{run_id}", f"2025-01-0{run_id}", None, "[]", "{}")
+                for run_id in range(1, 6)
+            ]
+        )
+        for run_id, user_id, judgement in judgements:
+            await create_annotation(run_id, user_id, judgement)
+
+    asyncio.run(run())
+
+
+def test_get_agreement(db_path, users):
+    # Run 5 is only judged once, and judgements are not case sensitive
+    add_judgements(
+        [
+            (run_id, user_id, judgement.upper())
+            for run_id, user_id, judgement in judgements
+        ]
+        + [(5, 1, "wrong")]
+    )
+    queue_id = asyncio.run(create_queue("queue", "", 1, [1, 2, 5]))
+
+    result = asyncio.run(get_agreement())
+
+    assert result["num_runs"] == 4
+    assert result["categories"] == categories
+    assert result["fleiss_kappa"] == pytest.approx(0.15625, abs=1e-4)
+    assert get_pair(result, [1, 2])["annotators"] == ["alice", "bob"]
+    # 3 is not a user of the database
+    assert get_pair(result, [1, 3])["annotators"] == ["alice", "User 3"]
+    assert [run["run_id"] for run in result["disagreements"]] == [4, 2]
+
+    [queue] = result["queues"]
+    assert queue["queue_id"] == queue_id
+    assert queue["name"] == "queue"
+    assert queue["num_runs"] == 2
+    assert queue["percent_agreement"] == 50.0
+    assert "disagreements" not in queue
+
+    result = asyncio.run(get_agreement(queue_id))
+    assert result["num_runs"] == 2
+    assert [run["run_id"] for run in result["disagreements"]] == [2]
+    assert "queues" not in result
+
+
+def test_get_agreement_with_other_judgements(db_path, users):
+    add_judgements(
+        [
+            (1, 1, "correct"),
+            (1, 2, "unsure"),
+            (2, 1, "wrong"),
+            (2, 2, "wrong"),
+        ]
+    )
+
+    result = asyncio.run(get_agreement())
+
+    assert result["categories"] == ["correct", "wrong", "unsure"]
+    assert result["disagreements"] == [
+        {"run_id": 1, "judgements": {"alice": "correct", "bob": "unsure"}}
+    ]
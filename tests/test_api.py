@@ -0,0 +1,333 @@
+import asyncio
+import csv
+import io
+import json
+from datetime import datetime, timedelta, timezone
+import pytest
+from starlette.testclient import TestClient
+from db import bulk_insert_runs
+from conftest import test_users
+
+now = datetime.now(timezone.utc)
+
+
+def make_run(index: int, days_ago: int, text: str, org_id: int, email: str, **metadata):
+    start_time = now - timedelta(days=days_ago)
+    messages = [
+        {"role": "user", "content": text},
+        {"role": "assistant", "content": f"Answer {index}"},
+    ]
+    metadata = {
+        "org": {"id": org_id, "name": f"Org {org_id}"},
+        "course": {"id": org_id * 10, "name": f"Course {org_id * 10}"},
+        "user_email": email,
+        "type": "quiz",
+        **metadata,
+    }
+    return (
+        f"span-{index}",
+        start_time.strftime("%Y-%m-%dT%H:%M:%S"),
+        (start_time + timedelta(seconds=30)).strftime("%Y-%m-%dT%H:%M:%S"),
+        json.dumps(messages),
+        json.dumps(metadata),
+    )
+
+
+# Runs 1 to 5, from the oldest to the latest
+runs = [
+    make_run(
+        1,
+        100,
+        "explain recursion",
+        1,
+        "ana@example.com",
+        task_title="Loops and recursion",
+        question_title="Factorial",
+        question_purpose="exam",
+        question_type="objective",
+        question_input_type="code",
+    ),
+    make_run(2, 20, "what is a loop", 1, "ben@example.com", type="learning_material"),
+    make_run(3, 3, "binary search", 2, "ana@example.com", question_purpose="practice"),
+    make_run(4, 1, "sorting lists", 2, "ben@example.com"),
+    make_run(5, 0, "hello there", 2, "ana@example.com"),
+]
+
+
+@pytest.fixture
+def client(db_path, users):
+    asyncio.run(bulk_insert_runs(runs))
+
+    from main import app
+
+    return TestClient(app)
+
+
+def login(client, username: str = "alice"):
+    response = client.post(
+        "/login",
+        data={"username": username, "password": test_users[username]["password"]},
+        follow_redirects=False,
+    )
+    assert response.status_code == 302
+
+
+def annotate(client, run_id: int, judgement: str, notes: str = ""):
+    response = client.post(
+        "/api/annotations",
+        json={"run_id": run_id, "judgement": judgement, "notes": notes},
+    )
+    assert response.json() == {"success": True}
+
+
+def get_run_ids(client, query: str = "", url: str = "/api/runs"):
+    response = client.get(f"{url}?{query}")
+    assert response.status_code == 200
+    return [run["id"] for run in response.json()["runs"]]
+
+
+def test_run_requires_login(client):
+    assert client.get("/api/runs/1").status_code == 401
+
+    login(client)
+    annotate(client, 1, "correct", "good answer")
+    run = client.get("/api/runs/1").json()["run"]
+
+    assert run["run_id"] == "span-1"
+    assert run["messages"][0] == {"role": "user", "content": "explain recursion"}
+    assert run["metadata"]["user_email"] == "ana@example.com"
+    assert run["annotations"]["alice"]["judgement"] == "correct"
+    assert client.get("/api/runs/100").status_code == 404
+
+
+def test_runs_are_not_modified_until_annotated(client):
+    login(client)
+    response = client.get("/api/runs")
+    etag = response.headers["etag"]
+
+    assert client.get("/api/runs", headers={"If-None-Match": etag}).status_code == 304
+
+    annotate(client, 5, "wrong")
+    response = client.get("/api/runs", headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert response.json()["runs"][0]["annotations"]["alice"]["judgement"] == "wrong"
+
+
+def test_time_range_results_change_with_the_date(client):
+    query = "/api/runs?time_range=today"
+    etag = client.get(query).headers["etag"]
+
+    # Without a time range, the results only change with the database
+    assert client.get("/api/runs").headers["etag"] != etag
+    assert client.get(query, headers={"If-None-Match": etag}).status_code == 304
+
+
+@pytest.mark.parametrize(
+    "query, run_ids",
+    [
+        ("", [5, 4, 3, 2, 1]),
+        ("sort_order=asc", [1, 2, 3, 4, 5]),
+        ("time_range=today", [5]),
+        ("time_range=yesterday", [4]),
+        ("time_range=last7", [5, 4, 3]),
+        ("time_range=last30", [5, 4, 3, 2]),
+        ("org_id=1", [2, 1]),
+        ("course_id=10,20", [5, 4, 3, 2, 1]),
+        ("run_type=learning_material", [2]),
+        ("purpose=exam,practice", [3, 1]),
+        ("question_type=objective", [1]),
+        ("question_input_type=code", [1]),
+        ("user_email=ben@example.com", [4, 2]),
+        ("task_title=recursion", [1]),
+        ("question_title=fact", [1]),
+        ("q=recursion", [1]),
+        ("q=search%20lists", []),
+        ('q="binary search"', [3]),
+        # FTS5 operators are taken literally
+        ("q=recursion%20OR%20lists", []),
+    ],
+)
+def test_run_filters(client, query, run_ids):
+    assert get_run_ids(client, query) == run_ids
+
+
+def test_search_results_are_ranked(client):
+    response = client.get("/api/runs?q=Answer&sort_by=relevance")
+    data = response.json()
+
+    assert sorted(run["id"] for run in data["runs"]) == [1, 2, 3, 4, 5]
+    # Runs ordered by relevance are only paged by offset
+    assert data["next_cursor"] is None
+
+
+def test_annotation_filters(client):
+    login(client, "alice")
+    annotate(client, 1, "correct")
+    annotate(client, 2, "wrong")
+    login(client, "bob")
+    annotate(client, 2, "correct", "loops explained well")
+
+    assert get_run_ids(client, "annotation_filter=annotated") == [2, 1]
+    assert get_run_ids(client, "annotation_filter=unannotated") == [5, 4, 3]
+    assert get_run_ids(client, "annotation_filter=correct") == [2, 1]
+    assert get_run_ids(client, "annotator_user=bob") == [2]
+    assert get_run_ids(client, "annotation_filter=wrong&annotator_user=alice") == [2]
+    assert get_run_ids(client, "annotation_filter=unannotated&annotator_user=bob") == [
+        5,
+        4,
+        3,
+        1,
+    ]
+    # Annotation notes are searched too
+    assert get_run_ids(client, "q=explained") == [2]
+
+
+def test_runs_are_paged_by_cursor(client):
+    first_page = client.get("/api/runs?page_size=2").json()
+    assert [run["id"] for run in first_page["runs"]] == [5, 4]
+    assert first_page["total_count"] == 5
+    assert first_page["total_pages"] == 3
+    assert first_page["prev_cursor"] is None
+
+    second_page = client.get(
+        f"/api/runs?page_size=2&after={first_page['next_cursor']}"
+    ).json()
+    assert [run["id"] for run in second_page["runs"]] == [3, 2]
+
+    last_page = client.get(
+        f"/api/runs?page_size=2&after={second_page['next_cursor']}"
+    ).json()
+    assert [run["id"] for run in last_page["runs"]] == [1]
+    assert last_page["next_cursor"] is None
+
+    previous_page = client.get(
+        f"/api/runs?page_size=2&before={last_page['prev_cursor']}"
+    ).json()
+    assert [run["id"] for run in previous_page["runs"]] == [3, 2]
+    assert previous_page["prev_cursor"] is not None
+
+    assert get_run_ids(client, "page_size=2&page=2") == [3, 2]
+    assert client.get("/api/runs?after=invalid").status_code == 400
+
+
+def test_queues(client):
+    assert client.get("/api/queues").status_code == 401
+    login(client)
+
+    response = client.post(
+        "/api/queues", json={"name": "Recent", "description": "", "run_ids": [4, 5]}
+    )
+    queue_id = response.json()["queue_id"]
+    response = client.post(
+        "/api/queues",
+        json={
+            "name": "Org 1",
+            "select_all_filtered": True,
+            "filters": {"org_id": "1", "run_type": "quiz,learning_material"},
+        },
+    )
+    filtered_queue_id = response.json()["queue_id"]
+    assert client.post("/api/queues", json={"run_ids": [1]}).status_code == 400
+
+    queues = client.get("/api/queues").json()
+    assert queues["user"] == "alice"
+    assert {queue["name"] for queue in queues["queues"]} == {"Recent", "Org 1"}
+
+    queue = client.get(f"/api/queues/{queue_id}").json()
+    assert queue["queue"]["name"] == "Recent"
+    assert [run["id"] for run in queue["queue"]["runs"]] == [5, 4]
+    assert get_run_ids_in_queue(client, filtered_queue_id) == [2, 1]
+
+    response = client.put(f"/api/queues/{queue_id}", json={"run_ids": [3]})
+    assert response.json()["success"]
+    response = client.put(
+        f"/api/queues/{filtered_queue_id}",
+        json={"select_all_filtered": True, "filters": {"time_range": "last7"}},
+    )
+    assert response.json()["success"]
+
+    assert get_run_ids_in_queue(client, queue_id) == [5, 4, 3]
+    assert get_run_ids_in_queue(client, queue_id, "page_size=2") == [5, 4]
+    assert get_run_ids_in_queue(client, queue_id, "q=sorting") == [4]
+    assert get_run_ids_in_queue(client, filtered_queue_id) == [5, 4, 3, 2, 1]
+
+    annotate(client, 4, "correct")
+    assert get_run_ids_in_queue(
+        client,
+        queue_id,
+        "annotation_filter=unannotated&annotator_filter_user=alice",
+    ) == [5, 3]
+    assert get_run_ids_in_queue(
+        client, queue_id, "annotation_filter=correct&annotator_filter_user=alice"
+    ) == [4]
+
+    agreement = client.get(f"/api/agreement?queue_id={queue_id}").json()
+    assert agreement["num_runs"] == 0
+    assert client.get("/api/agreement?queue_id=x").status_code == 400
+
+
+def get_run_ids_in_queue(client, queue_id: int, query: str = ""):
+    response = client.get(f"/api/queues/{queue_id}?{query}")
+    assert response.status_code == 200
+    return [run["id"] for run in response.json()["queue"]["runs"]]
+
+
+def test_queue_is_paged_by_cursor(client):
+    login(client)
+    queue_id = client.post(
+        "/api/queues", json={"name": "All", "run_ids": [1, 2, 3, 4, 5]}
+    ).json()["queue_id"]
+
+    first_page = client.get(f"/api/queues/{queue_id}?page_size=3").json()
+    next_page = client.get(
+        f"/api/queues/{queue_id}?page_size=3&after={first_page['next_cursor']}"
+    ).json()
+
+    assert [run["id"] for run in next_page["queue"]["runs"]] == [2, 1]
+    assert next_page["next_cursor"] is None
+    assert next_page["total_count"] == 5
+
+
+def test_metrics(client):
+    login(client, "alice")
+    annotate(client, 1, "correct")
+    annotate(client, 2, "wrong")
+    login(client, "bob")
+    annotate(client, 1, "correct")
+
+    metrics = client.get("/api/metrics").json()
+    assert metrics["num_runs"] == 5
+    assert metrics["num_annotations"] == 3
+    assert metrics["num_correct"] == 2
+    assert {row["name"] for row in metrics["leaderboard"]} == {"alice", "bob"}
+
+    trends = client.get("/api/metrics/trends?days=7").json()
+    assert sum(trends["runs"]) == 3
+    assert sum(trends["annotations"]["total"]) == 3
+    assert sum(trends["annotations"]["correct"]) == 2
+    assert client.get("/api/metrics/trends?granularity=month").status_code == 400
+
+    filter_data = client.get("/api/filter_data").json()
+    assert {org["name"] for org in filter_data["orgs"]} == {"Org 1", "Org 2"}
+
+    agreement = client.get("/api/agreement").json()
+    assert agreement["num_runs"] == 1
+    assert agreement["percent_agreement"] == 100.0
+
+
+def test_export(client):
+    login(client)
+    annotate(client, 3, "wrong", "off by one")
+
+    response = client.get("/api/export/runs?org_id=2")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["run_id"] for line in lines] == ["span-5", "span-4", "span-3"]
+    assert lines[2]["annotations"]["alice"]["notes"] == "off by one"
+
+    response = client.get("/api/export/runs?format=csv&sort_order=asc")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["run_id"] for row in rows] == [f"span-{i}" for i in range(1, 6)]
+
+    assert client.get("/api/export/runs?format=xml").status_code == 400
@@ -0,0 +1,177 @@
+import asyncio
+import json
+import sqlite3
+import pytest
+from db import compression, get_new_db_connection, get_search_messages_update_query
+from db.compression import (
+    compress_text,
+    decompress_text,
+    load_dictionaries,
+    save_dictionary,
+    train_dictionary,
+)
+
+
+def make_messages(index: int) -> str:
+    return json.dumps(
+        [
+            {"role": "system", "content": "You are a helpful tutor for the course."},
+            {"role": "user", "content": f"What is question {index} about?"},
+            {
+                "role": "assistant",
+                "content": f"Question {index} is about loops. " * 20,
+            },
+        ],
+        indent=2,
+    )
+
+
+@pytest.fixture
+def dictionaries(db_path):
+    """Load the (no) dictionaries of the test database, and forget them after."""
+    load_dictionaries(force=True)
+    yield
+    compression._dictionaries_loaded = False
+
+
+def add_dictionary(db_path: str, codec: str = "zlib") -> int:
+    samples = [make_messages(index) for index in range(20)]
+    conn = sqlite3.connect(db_path)
+    try:
+        return save_dictionary(conn, codec, train_dictionary(samples, codec))
+    finally:
+        conn.close()
+
+
+def test_round_trip(dictionaries):
+    text = make_messages(1)
+
+    value = compress_text(text, "zlib")
+
+    assert isinstance(value, bytes)
+    assert len(value) < len(text)
+    # No dictionary
+    assert value[:6] == b"\x00z\x00\x00\x00\x00"
+    assert decompress_text(value) == text
+
+
+def test_round_trip_with_dictionary(db_path, dictionaries):
+    text = make_messages(100)
+    without_dictionary = compress_text(text, "zlib")
+
+    dictionary_id = add_dictionary(db_path)
+    value = compress_text(text, "zlib")
+
+    assert value[2:6] == dictionary_id.to_bytes(4, "big")
+    assert len(value) < len(without_dictionary)
+    assert decompress_text(value) == text
+    # Values compressed before the dictionary was added can still be read
+    assert decompress_text(without_dictionary) == text
+
+
+def test_dictionaries_are_reloaded_when_one_is_missing(db_path, dictionaries):
+    add_dictionary(db_path)
+    value = compress_text(make_messages(1), "zlib")
+    # As if the dictionary had been added by another process
+    compression._dictionaries = {}
+
+    assert decompress_text(value) == make_messages(1)
+
+
+def test_unknown_dictionary(dictionaries):
+    value = compression.header.pack(b"\x00", b"z", 42) + b"data"
+
+    with pytest.raises(ValueError, match="Unknown compression dictionary: 42"):
+        decompress_text(value)
+
+
+def test_values_that_are_not_compressed(dictionaries):
+    # Too short to be made smaller
+    assert compress_text("[]", "zlib") == "[]"
+    assert compress_text(make_messages(1), "none") == make_messages(1)
+    assert compress_text(None, "zlib") is None
+    assert decompress_text("[]") == "[]"
+    assert decompress_text(None) is None
+
+
+def test_unknown_codec(dictionaries):
+    with pytest.raises(ValueError, match="Unknown compression codec"):
+        compress_text(make_messages(1), "lz4")
+
+
+def test_zstd_round_trip(db_path, dictionaries):
+    pytest.importorskip("zstandard")
+    text = make_messages(1)
+
+    assert decompress_text(compress_text(text, "zstd")) == text
+    add_dictionary(db_path, "zstd")
+    assert decompress_text(compress_text(text, "zstd")) == text
+
+
+def test_sql_functions(dictionaries):
+    async def run():
+        async with get_new_db_connection() as conn:
+            cursor = await conn.execute(
+                "SELECT compress_text(?, 'zlib'), decompress_text(compress_text(?, 'zlib'))",
+                (make_messages(1), make_messages(1)),
+            )
+            return await cursor.fetchone()
+
+    value, text = asyncio.run(run())
+
+    assert isinstance(value, bytes)
+    assert text == make_messages(1)
+
+
+def search(db_path: str, query: str):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(
+            "SELECT rowid FROM runs_search WHERE runs_search MATCH ?", (query,)
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def test_runs_can_be_written_without_the_app_functions(db_path, dictionaries):
+    messages = json.dumps([{"role": "user", "content": "plain loops"}])
+    compressed_messages = json.dumps(
+        [{"role": "user", "content": "packed loops " * 20}]
+    )
+
+    # A connection without the functions the app registers
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute(
+            "INSERT INTO runs (run_id, start_time, messages, metadata) VALUES (?, ?, ?, ?)",
+            ("span-1", "2025-01-01", messages, "{}"),
+        )
+        conn.execute(
+            "INSERT INTO runs (run_id, start_time, messages, metadata) VALUES (?, ?, ?, ?)",
+            (
+                "span-2",
+                "2025-01-02",
+                compress_text(compressed_messages, "zlib"),
+                "{}",
+            ),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    assert search(db_path, "plain") == [(1,)]
+    # Compressed messages are indexed from their text by the writer
+    assert search(db_path, "packed") == []
+
+    async def index():
+        async with get_new_db_connection() as conn:
+            await conn.execute(
+                get_search_messages_update_query(),
+                ("span-2", compressed_messages),
+            )
+            await conn.commit()
+
+    asyncio.run(index())
+
+    assert search(db_path, "packed") == [(2,)]
+    assert search(db_path, "loops") == [(1,), (2,)]
@@ -0,0 +1,60 @@
+import asyncio
+import json
+import pytest
+from db import get_new_db_connection
+from db import instrumentation
+from db.instrumentation import normalize_sql
+
+
+@pytest.fixture
+def slow_query_log(tmp_path, monkeypatch):
+    """Record every statement as a slow query, logged to a temporary file."""
+    log_path = tmp_path / "slow_queries.log"
+    monkeypatch.setattr(instrumentation, "slow_query_log_path", str(log_path))
+    monkeypatch.setattr(instrumentation.query_stats, "enabled", True)
+    monkeypatch.setattr(instrumentation.query_stats, "slow_query_ms", 0)
+    yield log_path
+    instrumentation.query_stats.reset()
+
+
+def read_log(log_path):
+    return [json.loads(line) for line in log_path.read_text().splitlines()]
+
+
+def test_slow_queries_are_logged_with_their_plan(db_path, slow_query_log):
+    async def run():
+        async with get_new_db_connection() as conn:
+            cursor = await conn.cursor()
+            # Parameters are passed as lists as well as tuples across the repo
+            await cursor.execute(
+                "SELECT id FROM runs WHERE run_id = ? AND start_time > ?",
+                ["span-1", "2025-01-01"],
+            )
+            await cursor.fetchall()
+            await cursor.execute("SELECT id FROM runs WHERE id = ?", (1,))
+            await cursor.fetchall()
+            await cursor.executemany(
+                "INSERT INTO runs (run_id, start_time) VALUES (?, ?)",
+                [("span-1", "2025-01-02"), ("span-2", "2025-01-03")],
+            )
+            await conn.rollback()
+
+    asyncio.run(run())
+
+    entries = read_log(slow_query_log)
+    assert len(entries) == 3
+    for entry in entries:
+        assert not any("Could not get the query plan" in line for line in entry["plan"])
+    # An INSERT of values has no plan to show
+    assert all(entry["plan"] for entry in entries if entry["sql"].startswith("SELECT"))
+
+
+def test_normalize_sql():
+    assert (
+        normalize_sql("SELECT *\n  FROM runs WHERE id IN (?, ?, ?) AND name = 'a''b'")
+        == "SELECT * FROM runs WHERE id IN (?, ...) AND name = ?"
+    )
+    assert (
+        normalize_sql("SELECT JSON_EXTRACT(metadata, '$.org.id') FROM runs LIMIT 10")
+        == "SELECT JSON_EXTRACT(metadata, '$.org.id') FROM runs LIMIT ?"
+    )
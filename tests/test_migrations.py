@@ -0,0 +1,226 @@
+import asyncio
+import json
+import os
+import sqlite3
+import pytest
+from db import get_run, init_db
+from db.compression import compress_text
+from db.config import sqlite_db_path
+from db.migrations import run_migrations
+
+# Schema of the databases created before any migration
+baseline_schema = """
+    CREATE TABLE runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        run_id TEXT,
+        start_time TEXT,
+        end_time TEXT,
+        messages TEXT,
+        metadata TEXT,
+        created_at NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE queues (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT,
+        description TEXT,
+        user_id INTEGER NOT NULL,
+        created_at NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE queue_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        queue_id INTEGER NOT NULL,
+        run_id INTEGER NOT NULL
+    );
+    CREATE TABLE annotations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        run_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        judgement TEXT NOT NULL,
+        notes TEXT,
+        created_at NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(run_id, user_id)
+    );
+    CREATE TABLE users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE NOT NULL,
+        created_at NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+context = {"course": {"name": "Python"}, "lesson": "Loops " * 50}
+
+
+def make_run(run_id: str, start_time: str, text: str, with_context: bool = True):
+    metadata = {
+        "type": "quiz",
+        "org": {"id": 1, "name": "Org"},
+        "course": {"id": 2, "name": "Course"},
+    }
+    if with_context:
+        metadata["context"] = context
+    messages = [{"role": "user", "content": text}]
+    return (run_id, start_time, start_time, json.dumps(messages), json.dumps(metadata))
+
+
+@pytest.fixture
+def baseline_db():
+    """Create a database with the baseline schema and return a connection to it."""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(sqlite_db_path + suffix):
+            os.remove(sqlite_db_path + suffix)
+
+    conn = sqlite3.connect(sqlite_db_path)
+    conn.executescript(baseline_schema)
+    conn.executemany(
+        "INSERT INTO users (name) VALUES (?)", [("alice",), ("bob",), ("carol",)]
+    )
+    yield conn
+    conn.close()
+
+
+def fetch(conn, sql: str):
+    return conn.execute(sql).fetchall()
+
+
+def test_duplicate_runs_are_merged(baseline_db):
+    runs = [
+        make_run("span-a", "2025-01-01T10:00:00", "first copy"),
+        make_run("span-b", "2025-01-02T10:00:00", "other run"),
+        make_run("span-a", "2025-01-01T10:00:00", "second copy"),
+        make_run("span-a", "2025-01-01T10:00:00", "third copy"),
+    ]
+    baseline_db.executemany(
+        "INSERT INTO runs (run_id, start_time, end_time, messages, metadata) VALUES (?, ?, ?, ?, ?)",
+        runs,
+    )
+    baseline_db.executemany(
+        "INSERT INTO queues (name, description, user_id) VALUES (?, '', 1)",
+        [("both copies",), ("duplicate only",)],
+    )
+    baseline_db.executemany(
+        "INSERT INTO queue_runs (queue_id, run_id) VALUES (?, ?)",
+        [(1, 1), (1, 3), (2, 4)],
+    )
+    baseline_db.executemany(
+        "INSERT INTO annotations (run_id, user_id, judgement) VALUES (?, ?, ?)",
+        [
+            (1, 1, "correct"),
+            # Already annotated by the same user on the first copy, so dropped
+            (3, 1, "wrong"),
+            (4, 2, "wrong"),
+            (4, 3, "correct"),
+        ],
+    )
+    baseline_db.commit()
+
+    asyncio.run(init_db())
+
+    assert fetch(baseline_db, "SELECT id, run_id FROM runs ORDER BY id") == [
+        (1, "span-a"),
+        (2, "span-b"),
+    ]
+    assert fetch(
+        baseline_db, "SELECT queue_id, run_id FROM queue_runs ORDER BY queue_id"
+    ) == [(1, 1), (2, 1)]
+    assert fetch(
+        baseline_db,
+        "SELECT run_id, user_id, judgement FROM annotations ORDER BY user_id",
+    ) == [(1, 1, "correct"), (1, 2, "wrong"), (1, 3, "correct")]
+
+    with pytest.raises(sqlite3.IntegrityError):
+        baseline_db.execute(
+            "INSERT INTO runs (run_id, start_time) VALUES ('span-a', '2025-01-03')"
+        )
+
+    # The rollups, facets and search index are backfilled from the merged runs
+    assert fetch(baseline_db, "SELECT id, name FROM orgs") == [(1, "Org")]
+    assert fetch(
+        baseline_db, "SELECT rowid FROM runs_search WHERE runs_search MATCH 'copy'"
+    ) == [(1,)]
+    assert fetch(baseline_db, "SELECT COUNT(*) FROM runs WHERE summary IS NULL") == [
+        (0,)
+    ]
+
+
+def test_migrations_only_run_once(baseline_db):
+    baseline_db.execute(
+        "INSERT INTO runs (run_id, start_time, end_time, messages, metadata) VALUES (?, ?, ?, ?, ?)",
+        make_run("span-a", "2025-01-01T10:00:00", "text"),
+    )
+    baseline_db.commit()
+    asyncio.run(init_db())
+    # Some triggers are recreated every time, so the order may change
+    schema = set(fetch(baseline_db, "SELECT type, name, sql FROM sqlite_master"))
+    blobs = fetch(baseline_db, "SELECT hash, size FROM blobs")
+
+    asyncio.run(run_migrations())
+
+    assert (
+        set(fetch(baseline_db, "SELECT type, name, sql FROM sqlite_master")) == schema
+    )
+    assert fetch(baseline_db, "SELECT hash, size FROM blobs") == blobs
+
+    index_names = {name for _, name, _ in schema}
+    assert "idx_runs_start_time_id" in index_names
+    # Superseded by the index above
+    assert "idx_runs_start_time" not in index_names
+
+
+def get_full_run(id: int):
+    run = asyncio.run(get_run(id))
+    return json.loads(run["messages"]), json.loads(run["metadata"])
+
+
+def test_contexts_are_moved_into_blobs(baseline_db):
+    baseline_db.executemany(
+        "INSERT INTO runs (run_id, start_time, end_time, messages, metadata) VALUES (?, ?, ?, ?, ?)",
+        [
+            make_run("span-a", "2025-01-01T10:00:00", "first"),
+            make_run("span-b", "2025-01-02T10:00:00", "second"),
+            make_run("span-c", "2025-01-03T10:00:00", "third", with_context=False),
+        ],
+    )
+    baseline_db.commit()
+
+    asyncio.run(init_db())
+
+    # Both runs share the same context, which is stored once
+    [(hash, size)] = fetch(baseline_db, "SELECT hash, size FROM blobs")
+    assert size == len(json.dumps(context, separators=(",", ":")))
+    rows = fetch(baseline_db, "SELECT metadata, blob_refs FROM runs ORDER BY id")
+    for metadata, blob_refs in rows[:2]:
+        assert "context" not in json.loads(metadata)
+        assert json.loads(blob_refs) == {"context": hash}
+    assert rows[2][1] is None
+
+    messages, metadata = get_full_run(1)
+    assert messages == [{"role": "user", "content": "first"}]
+    assert metadata["context"] == context
+    assert metadata["org"] == {"id": 1, "name": "Org"}
+    assert "context" not in get_full_run(3)[1]
+
+
+def test_compressed_context_column_is_moved_into_blobs(baseline_db):
+    # Contexts were stored compressed in their own column before blobs
+    baseline_db.execute("ALTER TABLE runs ADD COLUMN context BLOB")
+    run_id, start_time, end_time, messages, metadata = make_run(
+        "span-a", "2025-01-01T10:00:00", "first", with_context=False
+    )
+    baseline_db.execute(
+        "INSERT INTO runs (run_id, start_time, end_time, messages, metadata, context) VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            run_id,
+            start_time,
+            end_time,
+            messages,
+            metadata,
+            compress_text(json.dumps(context), "zlib"),
+        ),
+    )
+    baseline_db.commit()
+
+    asyncio.run(init_db())
+
+    columns = {row[1] for row in fetch(baseline_db, "PRAGMA table_info(runs)")}
+    assert "context" not in columns
+    assert get_full_run(1)[1]["context"] == context
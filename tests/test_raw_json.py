@@ -0,0 +1,61 @@
+import json
+import sqlite3
+import pytest
+from db.raw_json import (
+    RawJSON,
+    dumps,
+    escape_html,
+    escape_html_sql,
+    set_raw_json_fields,
+)
+
+
+@pytest.mark.parametrize(
+    "obj",
+    [
+        {"a": 1, "b": [True, False, None], "c": {"d": 'é 😀 "quoted" \n'}},
+        [1, 2.5, -3, "text", (4, 5)],
+        {1: "integer keys"},
+        0.1,
+    ],
+)
+def test_dumps_matches_json(obj):
+    assert json.loads(dumps(obj)) == json.loads(json.dumps(obj))
+
+
+def test_raw_json_is_spliced_in():
+    raw = RawJSON('[{"role": "user", "content": "hi"}]')
+
+    assert dumps({"messages": raw, "id": 1}) == (
+        '{"messages":[{"role": "user", "content": "hi"}],"id":1}'
+    )
+
+
+def test_non_finite_numbers_are_rejected():
+    with pytest.raises(ValueError):
+        dumps({"value": float("nan")})
+
+
+@pytest.mark.parametrize(
+    "raw_object, expected",
+    [
+        ('{"a": 1}', '{"a": 1,"context":{"b":2}}'),
+        ("{ }", '{"context":{"b":2}}'),
+    ],
+)
+def test_set_raw_json_fields(raw_object, expected):
+    assert set_raw_json_fields(raw_object, {"context": '{"b":2}'}) == expected
+    assert set_raw_json_fields(raw_object, {}) == raw_object
+
+
+def test_escape_html_matches_sql():
+    text = json.dumps({"content": "<script>alert('x')</script> a > b"})
+    conn = sqlite3.connect(":memory:")
+    try:
+        [(escaped,)] = conn.execute(f"SELECT {escape_html_sql('?')}", (text,))
+    finally:
+        conn.close()
+
+    assert escaped == escape_html(text)
+    assert "<" not in escaped
+    assert json.loads(escaped)["content"].startswith("&lt;script&gt;")
@@ -0,0 +1,90 @@
+import asyncio
+import aiosqlite
+from starlette.applications import Starlette
+from starlette.routing import Route
+from starlette.testclient import TestClient
+from db import get_new_db_connection, start_db_pool, stop_db_pool
+from db.instrumentation import DBTimer, db_timer
+from request_metrics import (
+    JSONResponse,
+    RequestMetrics,
+    RequestTimingMiddleware,
+)
+
+
+def test_db_timer_counts_overlapping_connections_once(db_path):
+    async def run():
+        await start_db_pool()
+        timer = DBTimer()
+        db_timer.set(timer)
+        try:
+            async with get_new_db_connection(readonly=True) as conn:
+                # Timing the request must not wrap the connection
+                assert isinstance(conn, aiosqlite.Connection)
+                async with get_new_db_connection() as inner:
+                    await inner.execute("SELECT 1")
+                await asyncio.sleep(0.05)
+            held = timer.seconds
+
+            await asyncio.sleep(0.05)
+            async with get_new_db_connection(readonly=True):
+                pass
+        finally:
+            await stop_db_pool()
+        return timer, held
+
+    timer, held = asyncio.run(run())
+
+    assert timer.num_active == 0
+    assert held >= 0.05
+    # The sleep between the connections is not counted. Sleeps can only be
+    # relied on to last at least as long as asked for
+    assert timer.seconds >= held
+    assert timer.seconds < held + 0.05
+
+
+def get_test_client(metrics: RequestMetrics):
+    async def get_item(request):
+        return JSONResponse({"id": request.path_params["item_id"]})
+
+    async def fail(request):
+        raise RuntimeError("failed")
+
+    app = Starlette(
+        routes=[
+            Route("/items/{item_id}", get_item),
+            Route("/fail", fail),
+        ]
+    )
+    app.add_middleware(RequestTimingMiddleware, router=app.router, metrics=metrics)
+    return TestClient(app, raise_server_exceptions=False)
+
+
+def test_requests_are_timed_and_counted_per_route():
+    metrics = RequestMetrics(buckets=(0.1, 1.0))
+    client = get_test_client(metrics)
+
+    response = client.get("/items/1")
+    client.get("/items/2")
+    client.get("/fail")
+    client.get("/unknown")
+
+    names = [
+        part.strip().split(";")[0]
+        for part in response.headers["server-timing"].split(",")
+    ]
+    assert names == ["total", "db", "serialize"]
+
+    text = metrics.render()
+    assert (
+        'http_requests_total{method="GET",route="/items/{item_id}",status="200"} 2'
+        in text
+    )
+    assert 'http_requests_total{method="GET",route="/fail",status="500"} 1' in text
+    assert 'http_requests_total{method="GET",route="unmatched",status="404"} 1' in text
+    assert 'http_request_errors_total{method="GET",route="/fail"} 1' in text
+    assert (
+        'http_request_duration_seconds_bucket{method="GET",route="/items/{item_id}",le="+Inf"} 2'
+        in text
+    )
+    assert "http_requests_in_flight 0" in text
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import os
+import sqlite3
+import pytest
+from cron import add_new_runs_from_s3
+from utils import LocalS3Client
+
+prefix = "traces/"
+
+
+def make_conversation(span_id: str, start_time: str, text: str = "hello"):
+    return {
+        "id": span_id,
+        "start_time": start_time,
+        "end_time": start_time,
+        "messages": [{"role": "user", "content": text}],
+        "metadata": {"type": "chat"},
+        "context": None,
+        "trace_id": f"trace-{span_id}",
+        "llm": {"model": "test"},
+    }
+
+
+def write_part(root_dir, key: str, conversations: list):
+    path = os.path.join(root_dir, *key.split("/"))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        json.dump(conversations, file)
+
+
+def get_runs(db_path: str):
+    conn = sqlite3.connect(db_path)
+    try:
+        return dict(conn.execute("SELECT run_id, messages FROM runs").fetchall())
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def s3_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("S3_LLM_TRACES_PREFIX", prefix)
+    return tmp_path
+
+
+def sync(s3_dir, **kwargs):
+    return asyncio.run(
+        add_new_runs_from_s3(s3_client=LocalS3Client(str(s3_dir)), **kwargs)
+    )
+
+
+def test_first_sync_inserts_runs(db_path, s3_dir):
+    write_part(
+        s3_dir,
+        f"{prefix}2025-01-01.json",
+        [
+            make_conversation("span-1", "2025-01-01T10:00:00.000000"),
+            make_conversation("span-2", "2025-01-01T11:00:00.000000"),
+        ],
+    )
+    write_part(
+        s3_dir,
+        f"{prefix}2025-01-02.json",
+        [make_conversation("span-3", "2025-01-02T10:00:00.000000")],
+    )
+
+    result = sync(s3_dir)
+
+    assert result["num_synced"] == 2
+    assert result["num_skipped"] == 0
+    assert result["num_conversations"] == 3
+    assert set(get_runs(db_path)) == {"span-1", "span-2", "span-3"}
+
+
+def test_unchanged_object_is_skipped(db_path, s3_dir):
+    write_part(
+        s3_dir,
+        f"{prefix}2025-01-01.json",
+        [make_conversation("span-1", "2025-01-01T10:00:00.000000")],
+    )
+    sync(s3_dir)
+
+    result = sync(s3_dir)
+
+    assert result["num_synced"] == 0
+    assert result["num_skipped"] == 1
+    assert result["num_conversations"] == 0
+    assert set(get_runs(db_path)) == {"span-1"}
+
+
+def test_unchanged_single_key_is_not_downloaded_again(db_path, s3_dir, monkeypatch):
+    monkeypatch.delenv("S3_LLM_TRACES_PREFIX")
+    monkeypatch.setenv("S3_LLM_TRACES_KEY", "traces.json")
+    write_part(
+        s3_dir, "traces.json", [make_conversation("span-1", "2025-01-01T10:00:00")]
+    )
+    sync(s3_dir)
+
+    result = sync(s3_dir)
+
+    assert result["num_synced"] == 0
+    assert result["num_skipped"] == 1
+
+
+def test_changed_object_only_rereads_lookback_window(db_path, s3_dir):
+    key = f"{prefix}2025-01-10.json"
+    old = make_conversation("span-old", "2025-01-01T10:00:00.000000")
+    latest = make_conversation("span-latest", "2025-01-10T10:00:00.000000")
+    write_part(s3_dir, key, [old, latest])
+    sync(s3_dir, lookback_hours=24)
+    old_messages = get_runs(db_path)["span-old"]
+
+    # A late run within the window, a late run before it and an edit of a run
+    # before it
+    write_part(
+        s3_dir,
+        key,
+        [
+            make_conversation("span-old", "2025-01-01T10:00:00.000000", "edited"),
+            make_conversation("span-late", "2025-01-10T02:00:00.000000"),
+            make_conversation("span-too-late", "2025-01-08T10:00:00.000000"),
+            latest,
+        ],
+    )
+    result = sync(s3_dir, lookback_hours=24)
+
+    runs = get_runs(db_path)
+    assert result["num_synced"] == 1
+    assert "span-late" in runs
+    assert "span-too-late" not in runs
+    assert runs["span-old"] == old_messages
+
+
+def test_new_part_file_is_loaded_in_full(db_path, s3_dir):
+    write_part(
+        s3_dir,
+        f"{prefix}2025-01-10.json",
+        [make_conversation("span-latest", "2025-01-10T10:00:00.000000")],
+    )
+    sync(s3_dir, lookback_hours=24)
+
+    # A part file that shows up late, with runs older than the lookback window
+    write_part(
+        s3_dir,
+        f"{prefix}2025-01-01.json",
+        [
+            make_conversation("span-1", "2025-01-01T10:00:00.000000"),
+            make_conversation("span-2", "2025-01-01T11:00:00.000000"),
+        ],
+    )
+    result = sync(s3_dir, lookback_hours=24)
+
+    assert result["num_synced"] == 1
+    assert result["num_skipped"] == 1
+    assert set(get_runs(db_path)) == {"span-latest", "span-1", "span-2"}
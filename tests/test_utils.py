@@ -0,0 +1,55 @@
+import json
+import pytest
+from utils import iter_json_array
+
+elements = [
+    {"id": 1, "text": 'brackets ] [ and braces } { and commas , in "quotes"'},
+    {"id": 2, "text": 'escapes \\ \\" \n \t é 😀'},
+    {"id": 3, "text": "multi-byte UTF-8: é ñ 日本語 😀"},
+    [1, 2.5, -3e2, None, True, False, ["nested", {"a": []}]],
+    "a string element",
+    123456789,
+    0.5,
+]
+
+
+def split(data: bytes, chunk_size: int):
+    return [data[i : i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 7, 64, 1 << 20])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_iter_json_array_across_chunk_boundaries(chunk_size, indent):
+    data = json.dumps(elements, ensure_ascii=False, indent=indent).encode("utf-8")
+
+    assert list(iter_json_array(split(data, chunk_size))) == elements
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3])
+def test_iter_json_array_with_ascii_escapes(chunk_size):
+    data = json.dumps(elements, ensure_ascii=True).encode("utf-8")
+
+    assert list(iter_json_array(split(data, chunk_size))) == elements
+
+
+def test_iter_json_array_splits_multi_byte_characters():
+    data = json.dumps(["😀é日"], ensure_ascii=False).encode("utf-8")
+    # Every character of the string is split between two chunks
+    chunks = [data[:3], data[3:5], data[5:8], data[8:11], data[11:]]
+
+    assert list(iter_json_array(chunks)) == ["😀é日"]
+
+
+def test_iter_json_array_waits_for_the_end_of_numbers():
+    assert list(iter_json_array([b"[12", b"34, 5", b"6]"])) == [1234, 56]
+
+
+@pytest.mark.parametrize("data", [b"[]", b"  [ ]  ", b"\n[\n]\n"])
+def test_iter_json_array_empty(data):
+    assert list(iter_json_array(split(data, 1))) == []
+
+
+@pytest.mark.parametrize("data", [b'{"a": 1}', b'[{"a": 1}', b'[{"a": '])
+def test_iter_json_array_invalid(data):
+    with pytest.raises(ValueError):
+        list(iter_json_array(split(data, 2)))